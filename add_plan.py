@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
-import sqlite3
+from repository import Database, bump_plan_catalog_version
 
 def add_plan(plan_id, name, days, price, description, features):
-    conn = sqlite3.connect('subscriptions.db')
+    conn = Database.connect()
     cur = conn.cursor()
 
     # Check if already exists
@@ -13,9 +13,10 @@ def add_plan(plan_id, name, days, price, description, features):
         return
 
     cur.execute("""
-        INSERT INTO plans (id, name, days, price, description, features)
+        INSERT INTO plans (id, name, duration_days, price, description, features)
         VALUES (?, ?, ?, ?, ?, ?)
     """, (plan_id, name, days, price, description, features))
+    bump_plan_catalog_version(cur)
 
     conn.commit()
     conn.close()
@@ -0,0 +1,552 @@
+#!/usr/bin/env python3
+"""
+benchmark.py - Handler-level benchmarks against a stubbed Telegram API
+Each run works in a fresh temporary directory with a seeded subscriptions.db;
+Telegram API calls are answered locally (apihelper.CUSTOM_REQUEST_SENDER), so
+the numbers cover routing, rendering, keyboards and SQL only.
+
+Usage:
+  python benchmark.py callbacks                          # bot.py and handlers.py
+  python benchmark.py callbacks --stack bot --rounds 500
+  python benchmark.py callbacks --stack handlers --users 50000 --payments 20000
+  python benchmark.py sqlite                             # DB_PROFILE default vs tuned
+  python benchmark.py sqlite --dir . --users 100000      # measure on the real disk
+  python benchmark.py approve-race                       # parallel /approve, exactly-once check
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+FAKE_TOKEN = "123456789:" + "A" * 35
+ADMIN_ID = 1000
+FIRST_USER_ID = 10_000_000
+
+# (callback_data, sent by admin) per stack
+BOT_CALLBACKS = [
+    ("main_menu", False), ("view_plans", False), ("plan_2", False), ("features_2", False),
+    ("compare_plans", False), ("buy_2", False), ("pay_upi_2", False), ("confirm_upi_2", False),
+    ("how_to_pay", False), ("payment_methods", False), ("my_subscription", False),
+    ("refer_earn", False), ("join_channel", False), ("contact_support", False), ("rate_5", False),
+    ("admin_panel", True), ("admin_stats", True), ("admin_active", True),
+    ("admin_users", True), ("admin_payments", True), ("admin_logs", True),
+]
+HANDLERS_CALLBACKS = [
+    ("main_menu", False), ("view_plans", False), ("plan_2", False), ("buy_2", False),
+    ("pay_bank_2", False), ("confirm_upi_2", False), ("payment_methods", False),
+    ("my_subscription", False), ("refer_earn", False), ("how_to_use", False),
+    ("check_access", False), ("contact_support", False), ("join_channel", False),
+    ("admin_panel", True), ("admin_list_channels", True),
+]
+
+# ==================== FAKE TELEGRAM API ====================
+
+class _FakeResponse:
+    status_code = 200
+
+    def __init__(self, payload):
+        self._payload = payload
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return self._payload
+
+
+class FakeTelegramApi:
+    """Answers every Bot API request locally; counts calls made from the benchmark thread."""
+
+    def __init__(self):
+        self.calls = 0
+        self._thread = threading.current_thread()
+
+    def install(self):
+        from telebot import apihelper
+        apihelper.CUSTOM_REQUEST_SENDER = self._send
+
+    def take(self) -> int:
+        n, self.calls = self.calls, 0
+        return n
+
+    def _send(self, method, url, params=None, files=None, **kwargs):
+        if threading.current_thread() is self._thread:
+            self.calls += 1
+        name = url.rsplit("/", 1)[-1]
+        params = params or {}
+        if name == "getMe":
+            result = {"id": 42, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif name.startswith(("send", "edit")):
+            chat_id = params.get("chat_id") or ADMIN_ID
+            result = {"message_id": int(params.get("message_id") or 1), "date": int(time.time()),
+                      "chat": {"id": int(chat_id), "type": "private"}, "text": params.get("text", "")}
+        else:
+            result = True
+        return _FakeResponse({"ok": True, "result": result})
+
+# ==================== SQL COUNTER ====================
+
+class SqlCounter:
+    """Counts statements run on the connections it is attached to."""
+
+    def __init__(self):
+        self.statements = 0
+
+    def attach(self, conn):
+        conn.set_trace_callback(self._trace)
+
+    def _trace(self, sql):
+        # trigger bodies are reported as "-- TRIGGER ..." lines; count top-level statements only
+        if not sql.startswith("--"):
+            self.statements += 1
+
+    def take(self) -> int:
+        n, self.statements = self.statements, 0
+        return n
+
+# ==================== ERROR COUNTER ====================
+
+class ErrorCounter(logging.Handler):
+    """Counts ERROR+ log records (handlers log and swallow their exceptions)."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.errors = 0
+
+    def emit(self, record):
+        self.errors += 1
+
+    def take(self) -> int:
+        n, self.errors = self.errors, 0
+        return n
+
+    def install(self):
+        # replaces console/file logging: tracebacks would dominate the timings
+        root = logging.getLogger()
+        for h in list(root.handlers):
+            root.removeHandler(h)
+        root.addHandler(self)
+        root.setLevel(logging.WARNING)
+
+# ==================== WORKSPACE ====================
+
+def prepare_workspace(stack: str) -> str:
+    """Fresh temp dir as cwd (all DB paths are relative) plus env for a fake bot."""
+    workdir = tempfile.mkdtemp(prefix=f"bench_{stack}_")
+    os.chdir(workdir)
+    os.environ.update({
+        "BOT_TOKEN": FAKE_TOKEN,
+        "ADMIN_IDS": str(ADMIN_ID),
+        "BOT_MODE": "polling",
+        "BOT_USERNAME": "bench_bot",
+        "LOG_FILE": os.path.join(workdir, "bot.log"),
+        "LOG_LEVEL": "WARNING",
+    })
+    return workdir
+
+
+def seed_db(users: int, payments: int, seed: int = 1, path: str = "subscriptions.db"):
+    """Fill users/payments with a realistic mix (active, expired, free; pending/completed)."""
+    rnd = random.Random(seed)
+    now = datetime.now()
+    fmt = '%Y-%m-%d %H:%M:%S'
+    user_rows = []
+    for i in range(users):
+        joined = now - timedelta(days=rnd.randint(0, 365))
+        kind = rnd.random()
+        if kind < 0.6:
+            expiry, status, plan = (now + timedelta(days=rnd.randint(1, 90))).strftime(fmt), 'active', 'PRO'
+        elif kind < 0.8:
+            expiry, status, plan = (now - timedelta(days=rnd.randint(1, 90))).strftime(fmt), 'expired', 'PRO'
+        else:
+            expiry, status, plan = None, 'active', 'free'
+        user_rows.append((FIRST_USER_ID + i, f"user{i}", f"User {i}", joined.strftime(fmt),
+                          expiry, plan, status, joined.strftime(fmt)))
+    payment_rows = [
+        (FIRST_USER_ID + rnd.randrange(max(users, 1)), rnd.randint(1, 4), rnd.choice((99, 299, 799, 1999)),
+         'pending' if rnd.random() < 0.1 else 'completed',
+         (now - timedelta(minutes=rnd.randint(0, 500000))).strftime(fmt))
+        for _ in range(payments)
+    ]
+
+    conn = sqlite3.connect(path)
+    conn.executemany('''
+    INSERT OR IGNORE INTO users (user_id, username, name, join_date, expiry_date, plan, status, last_active)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', user_rows)
+    conn.executemany(
+        "INSERT INTO payments (user_id, plan_id, amount, status, timestamp) VALUES (?, ?, ?, ?, ?)",
+        payment_rows)
+    conn.commit()
+    conn.close()
+
+# ==================== STACKS ====================
+
+def load_bot_stack(sql: SqlCounter):
+    """Import bot.py against the workspace; returns its handle_callback."""
+    from repository import Database
+    # every pooled connection, including the ones bot.py opens at import
+    Database.connect_hooks.append(sql.attach)
+    import bot
+    bot.stop_logging()
+    bot.init_db()
+    return bot.handle_callback, bot.callback_router
+
+
+def load_handlers_stack(sql: SqlCounter):
+    """Build CallbackHandlers around a stub-backed TeleBot; returns its handle_callback."""
+    import telebot
+    from repository import Database, init_database
+    Database.connect_hooks.append(sql.attach)
+    from handlers import CallbackHandlers
+    init_database()
+    handler = CallbackHandlers(telebot.TeleBot(FAKE_TOKEN, threaded=False))
+    return handler.handle_callback, handler.router
+
+
+def make_call(data: str, user_id: int, seq: int):
+    from telebot.types import CallbackQuery
+    return CallbackQuery.de_json({
+        "id": str(seq), "chat_instance": "bench", "data": data,
+        "from": {"id": user_id, "is_bot": False, "first_name": "Bench", "username": "bench"},
+        "message": {"message_id": 1, "date": 0, "chat": {"id": user_id, "type": "private"}},
+    })
+
+# ==================== RUNNING ====================
+
+def percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def run_callbacks(stack: str, rounds: int, warmup: int, users: int, payments: int, seed: int):
+    workdir = prepare_workspace(stack)
+    api = FakeTelegramApi()
+    api.install()
+    sql = SqlCounter()
+    errors = ErrorCounter()
+
+    if stack == "bot":
+        handle, router = load_bot_stack(sql)
+        samples = BOT_CALLBACKS
+    else:
+        handle, router = load_handlers_stack(sql)
+        samples = HANDLERS_CALLBACKS
+    errors.install()
+    seed_db(users, payments, seed)
+
+    rnd = random.Random(seed)
+    results = {data: {"ms": [], "sql": 0, "api": 0, "errors": 0} for data, _ in samples}
+    seq = 0
+    for r in range(warmup + rounds):
+        for data, as_admin in samples:
+            seq += 1
+            user_id = ADMIN_ID if as_admin else FIRST_USER_ID + rnd.randrange(max(users, 1))
+            call = make_call(data, user_id, seq)
+            sql.take()
+            api.take()
+            errors.take()
+            start = time.perf_counter()
+            handle(call)
+            elapsed = (time.perf_counter() - start) * 1000
+            if r < warmup:
+                continue
+            res = results[data]
+            res["ms"].append(elapsed)
+            res["sql"] += sql.take()
+            res["api"] += api.take()
+            res["errors"] += errors.take()
+
+    print(f"\n=== {stack} stack: {rounds} rounds, {users} users, {payments} payments ({workdir}) ===")
+    print(f"{'callback':<22}{'route':<18}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'sql/call':>10}{'api/call':>10}{'errors':>8}")
+    for data, _ in samples:
+        res = results[data]
+        ms = sorted(res["ms"])
+        n = len(ms) or 1
+        route, _ = router.resolve(data)
+        print(f"{data:<22}{(route.name if route else '-'):<18}"
+              f"{percentile(ms, 50):>9.2f}{percentile(ms, 95):>9.2f}{percentile(ms, 99):>9.2f}"
+              f"{(ms[-1] if ms else 0):>9.2f}{res['sql'] / n:>10.1f}{res['api'] / n:>10.1f}{res['errors']:>8}")
+
+# ==================== SQLITE PROFILES ====================
+
+# (name, statement, is a write) - parameters come from params_for()
+SQLITE_OPS = [
+    ("update+commit", "UPDATE users SET last_active = ? WHERE user_id = ?", True),
+    ("insert+commit", "INSERT INTO payments (user_id, plan_id, amount, payment_method, status, timestamp) "
+                      "VALUES (?, 2, 299, 'upi', 'pending', ?)", True),
+    ("point read", "SELECT plan, expiry_date, status FROM users WHERE user_id = ?", False),
+    ("sorted scan", "SELECT user_id, username, plan, expiry_date FROM users ORDER BY last_active DESC LIMIT 20", False),
+    ("group by", "SELECT plan_id, COUNT(*), SUM(amount) FROM payments GROUP BY plan_id ORDER BY 3 DESC", False),
+]
+
+
+def run_sqlite(profiles, users: int, payments: int, writes: int, reads: int, seed: int, directory=None):
+    """Commit and read latency of the same workload under each DB_PROFILE."""
+    # time SQLite itself, not the sqlstats wrappers
+    os.environ["SQL_STATS"] = "0"
+    from repository import Database, init_schema, SQLITE_PROFILES
+
+    workdir = tempfile.mkdtemp(prefix="bench_sqlite_", dir=directory)
+    rnd = random.Random(seed)
+    fmt = '%Y-%m-%d %H:%M:%S'
+
+    def params_for(name):
+        user_id = FIRST_USER_ID + rnd.randrange(max(users, 1))
+        if name == "update+commit":
+            return (datetime.now().strftime(fmt), user_id)
+        if name == "insert+commit":
+            return (user_id, datetime.now().strftime(fmt))
+        if name == "point read":
+            return (user_id,)
+        return ()
+
+    print(f"\n=== sqlite profiles: {users} users, {payments} payments, "
+          f"{writes} commits / {reads} reads per op ({workdir}) ===")
+    print(f"{'profile':<10}{'operation':<16}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ops/s':>10}")
+    conns = {}
+    for profile in profiles:
+        path = os.path.join(workdir, f"{profile}.db")
+        conn = Database.connect(path, profile)
+        cur = conn.cursor()
+        init_schema(cur)
+        conn.commit()
+        conn.close()
+        seed_db(users, payments, seed, path)
+        # fresh connection: its page cache starts empty, like a restarted bot
+        conns[profile] = Database.connect(path, profile)
+
+    ms = {}
+    for name, sql, is_write in SQLITE_OPS:
+        count = writes if is_write else reads
+        # profiles take turns on every iteration so machine noise hits them equally
+        for _ in range(count):
+            params = params_for(name)
+            for profile, conn in conns.items():
+                start = time.perf_counter()
+                conn.execute(sql, params).fetchall()
+                if is_write:
+                    conn.commit()
+                ms.setdefault((profile, name), []).append((time.perf_counter() - start) * 1000)
+    for conn in conns.values():
+        conn.close()
+
+    p50 = {}
+    for profile in profiles:
+        for name, _, is_write in SQLITE_OPS:
+            samples = sorted(ms[(profile, name)])
+            total_s = sum(samples) / 1000 or 1e-9
+            p50[(profile, name)] = percentile(samples, 50)
+            print(f"{profile:<10}{name:<16}{percentile(samples, 50):>9.3f}{percentile(samples, 95):>9.3f}"
+                  f"{percentile(samples, 99):>9.3f}{len(samples) / total_s:>10.0f}")
+
+    if len(profiles) > 1:
+        base, *others = profiles
+        for other in others:
+            print(f"\np50 speedup {other} vs {base}: " + ", ".join(
+                f"{name} {p50[(base, name)] / (p50[(other, name)] or 1e-9):.1f}x" for name, _, _ in SQLITE_OPS))
+    print("\nProfiles: " + "; ".join(
+        f"{name} = {', '.join(p.replace('PRAGMA ', '') for p in pragmas) or 'SQLite defaults'}"
+        for name, pragmas in SQLITE_PROFILES.items() if name in profiles))
+
+# ==================== APPROVE RACE ====================
+
+def legacy_approve(payment_id):
+    """The pre-transaction /approve: check, committed UPDATE, then the subscription."""
+    from repository import Database, save_subscription
+    row = Database.execute_query('''
+    SELECT p.user_id, p.plan_id, p.amount, pl.name, pl.duration_days
+    FROM payments p
+    JOIN plans pl ON p.plan_id = pl.id
+    WHERE p.id = ? AND p.status = 'pending'
+    ''', (payment_id,), fetchone=True)
+    if not row:
+        return None
+    Database.execute_query("UPDATE payments SET status = 'completed' WHERE id = ?", (payment_id,), commit=True)
+    with Database.get_cursor() as cursor:
+        save_subscription(cursor, row[0], row[3], row[4])
+    return row
+
+
+def race(approve, payment_ids, threads: int):
+    """Every thread approves every payment; a barrier lines them up on each one."""
+    wins = dict.fromkeys(payment_ids, 0)
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        for payment_id in payment_ids:
+            barrier.wait()
+            try:
+                ok = approve(payment_id)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                continue
+            if ok:
+                with lock:
+                    wins[payment_id] += 1
+
+    workers = [threading.Thread(target=worker, name=f"approve-{i}") for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return wins, errors, time.perf_counter() - start
+
+
+def run_approve_race(payments: int, threads: int, users: int, seed: int, legacy: bool) -> bool:
+    """
+    Parallel /approve of the same pending payments. Passes if complete_payment
+    activated each payment exactly once and the stats counters match the rows.
+    """
+    workdir = prepare_workspace("approve")
+    # one connection per racing thread, so the pool does not serialize them
+    os.environ["DB_POOL_SIZE"] = str(threads)
+    errors_log = ErrorCounter()
+    errors_log.install()
+    from repository import Database, init_schema, complete_payment
+
+    with Database.get_cursor() as cursor:
+        init_schema(cursor)
+    # half the payers already exist, the rest are created by the users UPSERT
+    seed_db(users // 2, 0, seed)
+    prices = {row[0]: row[1] for row in Database.execute_query("SELECT id, price FROM plans", fetchall=True)}
+    rnd = random.Random(seed)
+
+    def pending_batch():
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        ids = []
+        with Database.get_cursor() as cursor:
+            for _ in range(payments):
+                plan_id = rnd.choice(list(prices))
+                cursor.execute(
+                    "INSERT INTO payments (user_id, plan_id, amount, payment_method, status, timestamp) "
+                    "VALUES (?, ?, ?, 'upi', 'pending', ?)",
+                    (FIRST_USER_ID + rnd.randrange(max(users, 1)), plan_id, prices[plan_id], now))
+                ids.append(cursor.lastrowid)
+        return ids
+
+    print(f"\n=== approve race: {payments} payments x {threads} threads, {users} payers ({workdir}) ===")
+    print(f"{'flow':<12}{'activated':>10}{'duplicate':>11}{'missed':>8}{'errors':>8}{'ms':>9}")
+    modes = ([("legacy", legacy_approve)] if legacy else []) + [("atomic", complete_payment)]
+    passed = True
+    for name, approve in modes:
+        ids = pending_batch()
+        wins, errors, elapsed = race(approve, ids, threads)
+        activated = sum(1 for n in wins.values() if n)
+        duplicate = sum(n - 1 for n in wins.values() if n > 1)
+        missed = sum(1 for n in wins.values() if n == 0)
+        print(f"{name:<12}{activated:>10}{duplicate:>11}{missed:>8}{len(errors):>8}{elapsed * 1000:>9.0f}")
+        for e in sorted(set(errors))[:5]:
+            print(f"    {e}")
+        if name == "atomic":
+            left = Database.execute_query(
+                f"SELECT COUNT(*) FROM payments WHERE status = 'pending' AND id IN ({','.join('?' * len(ids))})",
+                ids, fetchone=True)[0]
+            passed = duplicate == 0 and missed == 0 and not errors and left == 0
+
+    counters = dict(Database.execute_query("SELECT name, value FROM stats_counters", fetchall=True))
+    completed, revenue = Database.execute_query(
+        "SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM payments WHERE status = 'completed'", fetchone=True)
+    subscribed = Database.execute_query(
+        "SELECT COUNT(*) FROM users WHERE user_id IN (SELECT user_id FROM payments) AND status = 'active' "
+        "AND expiry_date IS NOT NULL", fetchone=True)[0]
+    payers = Database.execute_query("SELECT COUNT(DISTINCT user_id) FROM payments", fetchone=True)[0]
+    consistent = counters.get("completed_payments") == completed and counters.get("revenue") == revenue
+    print(f"\ncompleted payments {completed} (counter {counters.get('completed_payments'):g}), "
+          f"revenue {revenue} (counter {counters.get('revenue'):g}), "
+          f"payers with an active plan {subscribed}/{payers}, {errors_log.take()} errors logged")
+    passed = passed and consistent and subscribed == payers
+    print(Database.pool().format_stats())
+    Database.close_pool()
+    print(f"\n{'PASS' if passed else 'FAIL'}: atomic approval "
+          f"{'activated every payment exactly once' if passed else 'did not activate every payment exactly once'}")
+    return passed
+
+# ==================== CLI ====================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark bot handlers against a stubbed Telegram API',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='''
+Examples:
+  python benchmark.py callbacks
+  python benchmark.py callbacks --stack bot --rounds 500
+  python benchmark.py callbacks --stack handlers --users 50000
+  python benchmark.py sqlite --dir .
+  python benchmark.py approve-race --threads 32 --legacy
+        '''
+    )
+    subparsers = parser.add_subparsers(dest='command', help='Benchmark to run')
+
+    cb_parser = subparsers.add_parser('callbacks', help='Per-callback latency and SQL/API call counts')
+    cb_parser.add_argument('--stack', choices=('bot', 'handlers', 'both'), default='both',
+                           help='bot.py handle_callback, handlers.CallbackHandlers or both')
+    cb_parser.add_argument('--rounds', type=int, default=200, help='Measured passes over every callback')
+    cb_parser.add_argument('--warmup', type=int, default=5, help='Unmeasured passes first')
+    cb_parser.add_argument('--users', type=int, default=10000, help='Seeded users')
+    cb_parser.add_argument('--payments', type=int, default=5000, help='Seeded payments')
+    cb_parser.add_argument('--seed', type=int, default=1, help='Random seed')
+
+    sq_parser = subparsers.add_parser('sqlite', help='Commit/read latency for each DB_PROFILE')
+    sq_parser.add_argument('--profiles', default='default,tuned', help='Comma-separated profile names')
+    sq_parser.add_argument('--users', type=int, default=20000, help='Seeded users')
+    sq_parser.add_argument('--payments', type=int, default=20000, help='Seeded payments')
+    sq_parser.add_argument('--writes', type=int, default=500, help='Commits measured per write operation')
+    sq_parser.add_argument('--reads', type=int, default=2000, help='Queries measured per read operation')
+    sq_parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    sq_parser.add_argument('--dir', default=None,
+                           help='Directory for the test databases (default: system temp dir, often tmpfs)')
+
+    ar_parser = subparsers.add_parser('approve-race', help='Concurrent /approve of the same payments')
+    ar_parser.add_argument('--payments', type=int, default=200, help='Pending payments to approve')
+    ar_parser.add_argument('--threads', type=int, default=16, help='Threads approving each payment at once')
+    ar_parser.add_argument('--users', type=int, default=100, help='Distinct payers (several payments each)')
+    ar_parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    ar_parser.add_argument('--legacy', action='store_true',
+                           help='Also race the old check-then-update flow for comparison')
+
+    args = parser.parse_args()
+
+    if not args.command:
+        parser.print_help()
+        return
+
+    if args.command == 'callbacks':
+        if args.stack == 'both':
+            # each stack gets its own process: both modules keep per-thread connections
+            # and module-level state that must not share one database file
+            for stack in ('bot', 'handlers'):
+                subprocess.run([sys.executable, os.path.abspath(__file__), 'callbacks', '--stack', stack,
+                                '--rounds', str(args.rounds), '--warmup', str(args.warmup),
+                                '--users', str(args.users), '--payments', str(args.payments),
+                                '--seed', str(args.seed)], check=False)
+        else:
+            run_callbacks(args.stack, args.rounds, args.warmup, args.users, args.payments, args.seed)
+
+    elif args.command == 'sqlite':
+        profiles = list(dict.fromkeys(p.strip() for p in args.profiles.split(',') if p.strip()))
+        run_sqlite(profiles, args.users, args.payments, args.writes, args.reads, args.seed, args.dir)
+
+    elif args.command == 'approve-race':
+        if not run_approve_race(args.payments, args.threads, args.users, args.seed, args.legacy):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,26 @@ import telebot
 import logging
 import time
 import os
+import heapq
 from datetime import datetime, timedelta
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 from dotenv import load_dotenv
 
-# Load environment variables FIRST
+# Load environment variables FIRST (config.py reads them at import time)
 load_dotenv()
 
+from config import Config
+from outbound import OutboundQueue
+from broadcast import Broadcaster, ensure_broadcast_table
+from router import CallbackRouter, CallbackContext, InvalidCallbackData
+from workers import ShardedWorkerPool, attach_to_bot
+from webhook import WebhookServer, valid_secret
+from keyboards import cached_markup, rows_markup, plans_cache_key
+import logtail
+import sqlstats
+import metrics
+from logging_setup import setup_logging, stop_logging
+
 # ==================== CONFIGURATION ====================
 
 # Validate and load configuration
@@ -42,6 +55,31 @@ CHANNEL_USERNAME = os.getenv("CHANNEL_USERNAME", "@StreamxPlayer")
 CHANNEL_INVITE_LINK = os.getenv("CHANNEL_INVITE_LINK", "https://t.me/+wK-uZ4uhG3ozYjNl")
 UPI_ID = os.getenv("UPI_ID", "yourbusiness@oksbi")
 
+# Update delivery: "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip()
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Telegram only posts to HTTPS: leave these empty when a reverse proxy terminates TLS
+WEBHOOK_SSL_CERT = os.getenv("WEBHOOK_SSL_CERT", "").strip()
+WEBHOOK_SSL_KEY = os.getenv("WEBHOOK_SSL_KEY", "").strip()
+WEBHOOK_SSL_SELF_SIGNED = os.getenv("WEBHOOK_SSL_SELF_SIGNED", "0").strip().lower() in ("1", "true", "yes", "on")
+
+# Prometheus metrics endpoint (disabled unless METRICS_PORT is set)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0") or 0)
+
+if BOT_MODE not in ("polling", "webhook"):
+    print(f"❌ ERROR: BOT_MODE must be 'polling' or 'webhook', got: {BOT_MODE}")
+    exit(1)
+
+if BOT_MODE == "webhook" and (not WEBHOOK_URL or not valid_secret(WEBHOOK_SECRET)):
+    print("❌ ERROR: Webhook mode needs WEBHOOK_URL and WEBHOOK_SECRET in .env file!")
+    print("WEBHOOK_SECRET may only contain A-Z, a-z, 0-9, _ and - (max 256 chars)")
+    exit(1)
+
 # Payment Details
 BANK_DETAILS = {
     "account": os.getenv("BANK_ACCOUNT_NAME", "YOUR BUSINESS"),
@@ -58,268 +96,75 @@ print(f"✅ Bot Token: {'[VALID]' if BOT_TOKEN and len(BOT_TOKEN) > 40 else '[IN
 print(f"✅ Admin ID: {ADMIN_ID}")
 print(f"✅ Channel: {CHANNEL_USERNAME}")
 print(f"✅ UPI ID: {UPI_ID}")
+print(f"✅ Mode: {BOT_MODE}")
 print("=" * 50)
 
 # ==================== LOGGING SETUP ====================
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# Records are queued and written by a background listener (LOG_LEVEL / LOG_FILE in .env)
+LOG_FILE = Config.LOG_FILE
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # ==================== BOT INITIALIZATION ====================
 
-bot = telebot.TeleBot(BOT_TOKEN)
+# threaded=False: updates are handed to update_pool instead, which keeps
+# each user's updates in order while different users run in parallel
+bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
+update_pool = attach_to_bot(bot, ShardedWorkerPool())
+
+# All outgoing messages are paced through one rate-limited queue
+outbound = OutboundQueue.for_bot(bot)
+broadcaster = Broadcaster(bot, outbound)
+callback_router = CallbackRouter()
 
 # ==================== DATABASE UTILITIES ====================
 
-# Simple thread-safe database connection manager
-import sqlite3
+# Pooled connections shared with handlers/utils (see repository.py)
 import threading
-
-class DatabaseManager:
-    """Simple thread-safe database connection manager."""
-    
-    _local = threading.local()
-    
-    @staticmethod
-    def get_connection():
-        """Get a thread-local database connection."""
-        if not hasattr(DatabaseManager._local, 'connection') or DatabaseManager._local.connection is None:
-            try:
-                conn = sqlite3.connect(
-                    'subscriptions.db',
-                    check_same_thread=False,
-                    timeout=30,
-                    detect_types=sqlite3.PARSE_DECLTYPES
-                )
-                # Enable WAL mode for better concurrency
-                conn.execute("PRAGMA journal_mode=WAL")
-                conn.execute("PRAGMA busy_timeout=5000")
-                DatabaseManager._local.connection = conn
-            except Exception as e:
-                logger.error(f"Failed to create database connection: {e}")
-                raise
-        return DatabaseManager._local.connection
-    
-    @staticmethod
-    def execute_query(query, params=None, fetchone=False, fetchall=False, commit=False):
-        """Execute a database query safely."""
-        conn = DatabaseManager.get_connection()
-        cursor = None
-        try:
-            cursor = conn.cursor()
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-            
-            if commit:
-                conn.commit()
-            
-            if fetchone:
-                return cursor.fetchone()
-            elif fetchall:
-                return cursor.fetchall()
-            else:
-                return cursor.rowcount
-        except Exception as e:
-            logger.error(f"Database query failed: {e}")
-            if conn:
-                try:
-                    conn.rollback()
-                except:
-                    pass
-            raise
-        finally:
-            if cursor:
-                cursor.close()
-            # DO NOT close connection here
+import utils
+from utils import PlanCatalog, ActivityBuffer
+from repository import (Database, init_schema, has_active_subscription, create_payment, complete_payment,
+                        read_stats_counters)
 
 # ==================== DATABASE / BUSINESS LOGIC ====================
 
 def init_db():
-    """Initialize database tables."""
+    """Create or upgrade the database schema."""
     try:
-        # Users table
-        DatabaseManager.execute_query('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            name TEXT,
-            join_date TEXT,
-            expiry_date TEXT,
-            plan TEXT DEFAULT 'free',
-            status TEXT DEFAULT 'active',
-            last_active TEXT
-        )
-        ''', commit=True)
-
-        # Plans table
-        DatabaseManager.execute_query('''
-        CREATE TABLE IF NOT EXISTS plans (
-            id INTEGER PRIMARY KEY,
-            name TEXT,
-            days INTEGER,
-            price INTEGER,
-            description TEXT,
-            features TEXT
-        )
-        ''', commit=True)
-
-        # Payments table
-        DatabaseManager.execute_query('''
-        CREATE TABLE IF NOT EXISTS payments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            plan_id INTEGER,
-            amount INTEGER,
-            method TEXT,
-            status TEXT DEFAULT 'pending',
-            timestamp TEXT,
-            transaction_id TEXT
-        )
-        ''', commit=True)
-
-        # Insert default plans if not present
-        result = DatabaseManager.execute_query("SELECT COUNT(*) FROM plans", fetchone=True)
-        if result and result[0] == 0:
-            plans = [
-                (1, '⭐ BASIC - 1 Week', 7, 99,
-                 'Weekly access to private channel',
-                 '✅ Channel Access\n✅ Basic Support\n✅ Weekly Updates'),
-
-                (2, '🚀 PRO - 1 Month', 30, 299,
-                 'Monthly access with priority support',
-                 '✅ Channel Access\n✅ Priority Support\n✅ Daily Updates\n✅ HD Content'),
-
-                (3, '🔥 PREMIUM - 3 Months', 90, 799,
-                 '3 months access + bonus content',
-                 '✅ Channel Access\n✅ Priority Support\n✅ All Updates\n✅ Bonus Content\n✅ 4K Quality'),
-
-                (4, '👑 LIFETIME', 36500, 1999,
-                 'Lifetime access + all future updates',
-                 '✅ Lifetime Access\n✅ VIP Support\n✅ All Content\n✅ Future Updates\n✅ Special Badge\n✅ Early Access')
-            ]
-            for plan in plans:
-                DatabaseManager.execute_query(
-                    'INSERT OR IGNORE INTO plans (id, name, days, price, description, features) VALUES (?, ?, ?, ?, ?, ?)',
-                    plan,
-                    commit=True
-                )
-
+        with Database.get_cursor(immediate=True) as cur:
+            init_schema(cur)
+            ensure_broadcast_table(cur)
         logger.info("Database initialized")
     except Exception as e:
         logger.exception(f"init_db failed: {e}")
 
-def has_active_subscription(user_id):
-    """Check if user has active subscription."""
-    try:
-        result = DatabaseManager.execute_query(
-            "SELECT expiry_date FROM users WHERE user_id = ?",
-            (user_id,),
-            fetchone=True
-        )
-        
-        if result and result[0]:
-            try:
-                expiry = datetime.strptime(result[0], '%Y-%m-%d %H:%M:%S')
-            except Exception:
-                expiry = datetime.fromisoformat(result[0])
-            return expiry > datetime.now()
-        return False
-    except Exception as e:
-        logger.error(f"has_active_subscription error for {user_id}: {e}")
-        return False
+def load_admin_stats():
+    """Dashboard counters (O(1): maintained by triggers, see repository.STATS_COUNTERS)."""
+    with Database.get_cursor() as cur:
+        return read_stats_counters(cur)
 
 def add_subscription(user_id, plan_id, days):
-    """Add subscription to user."""
-    try:
-        # Get plan details
-        result = DatabaseManager.execute_query(
-            "SELECT name FROM plans WHERE id = ?",
-            (plan_id,),
-            fetchone=True
-        )
-        if not result:
-            logger.error(f"Plan {plan_id} not found")
-            return False
-        
-        plan_name = result[0]
-        
-        # Calculate expiry
-        new_expiry = datetime.now() + timedelta(days=days)
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        # Check if user exists
-        user_exists = DatabaseManager.execute_query(
-            "SELECT user_id FROM users WHERE user_id = ?",
-            (user_id,),
-            fetchone=True
-        )
-        
-        if user_exists:
-            # Update existing user
-            DatabaseManager.execute_query('''
-            UPDATE users 
-            SET plan = ?, expiry_date = ?, status = 'active', last_active = ?
-            WHERE user_id = ?
-            ''', (plan_name, new_expiry.strftime('%Y-%m-%d %H:%M:%S'), current_time, user_id),
-            commit=True)
-        else:
-            # Insert new user
-            DatabaseManager.execute_query('''
-            INSERT INTO users (user_id, username, name, join_date, expiry_date, plan, status, last_active)
-            VALUES (?, ?, ?, ?, ?, ?, 'active', ?)
-            ''', (user_id, '', '', current_time, 
-                  new_expiry.strftime('%Y-%m-%d %H:%M:%S'), plan_name, current_time),
-            commit=True)
-        
-        logger.info(f"Subscription added for user {user_id}, plan {plan_name}, {days} days")
-        return True
-        
-    except Exception as e:
-        logger.exception(f"add_subscription failed for {user_id}: {e}")
+    """Add subscription to user and schedule its expiry."""
+    new_expiry = utils.add_subscription(user_id, plan_id, days)
+    if not new_expiry:
         return False
+    expiry_scheduler.schedule(user_id, new_expiry)
+    return True
 
 # Initialize DB on startup
 init_db()
 
-# ==================== DB MIGRATION: ensure referral columns exist ====================
-def ensure_user_columns():
-    try:
-        conn = DatabaseManager.get_connection()
-        cur = conn.cursor()
-        cur.execute("PRAGMA table_info(users)")
-        cols = [r[1] for r in cur.fetchall()]
-        if "balance" not in cols:
-            try:
-                cur.execute("ALTER TABLE users ADD COLUMN balance INTEGER DEFAULT 0")
-                logger.info("Added 'balance' column to users table.")
-            except Exception as e:
-                logger.warning(f"Could not add 'balance' column: {e}")
-        if "withdraw_state" not in cols:
-            try:
-                cur.execute("ALTER TABLE users ADD COLUMN withdraw_state TEXT DEFAULT NULL")
-                logger.info("Added 'withdraw_state' column to users table.")
-            except Exception as e:
-                logger.warning(f"Could not add 'withdraw_state' column: {e}")
-        conn.commit()
-        cur.close()
-    except Exception as e:
-        logger.exception(f"ensure_user_columns failed: {e}")
-
-# call it once on startup
-ensure_user_columns()
-
 # ==================== KEYBOARDS ====================
 
+# Keyboards are built once per variant and cached as serialized JSON
+# (cached_markup); telebot passes the string through as reply_markup.
+
 def main_menu(user_id=None):
+    is_admin = user_id == ADMIN_ID
+    return cached_markup(("bot.main_menu", is_admin), lambda: _build_main_menu(is_admin))
+
+def _build_main_menu(is_admin):
     keyboard = InlineKeyboardMarkup(row_width=2)
 
     buttons = [
@@ -339,25 +184,20 @@ def main_menu(user_id=None):
             InlineKeyboardButton(buttons[i+1][0], callback_data=buttons[i+1][1])
         )
 
-    if user_id == ADMIN_ID:
+    if is_admin:
         keyboard.add(InlineKeyboardButton("👑 Admin Panel", callback_data="admin_panel"))
 
     return keyboard
 
 def plans_keyboard():
-    try:
-        plans = DatabaseManager.execute_query(
-            "SELECT id, name, price, days FROM plans ORDER BY price",
-            fetchall=True
-        )
-    except Exception as e:
-        logger.error(f"Error fetching plans: {e}")
-        plans = []
+    plans = PlanCatalog.all()
+    return cached_markup(("bot.plans", plans_cache_key(plans)), lambda: _build_plans_keyboard(plans))
 
+def _build_plans_keyboard(plans):
     keyboard = InlineKeyboardMarkup(row_width=1)
     for plan in plans:
-        button_text = f"{plan[1]} - ₹{plan[2]} ({plan[3]} days)"
-        keyboard.add(InlineKeyboardButton(button_text, callback_data=f"plan_{plan[0]}"))
+        button_text = f"{plan['name']} - ₹{plan['price']} ({plan['duration_days']} days)"
+        keyboard.add(InlineKeyboardButton(button_text, callback_data=f"plan_{plan['id']}"))
 
     keyboard.row(
         InlineKeyboardButton("🔙 Back", callback_data="main_menu"),
@@ -367,6 +207,9 @@ def plans_keyboard():
     return keyboard
 
 def plan_details_keyboard(plan_id):
+    return cached_markup(("bot.plan_details", plan_id), lambda: _build_plan_details_keyboard(plan_id))
+
+def _build_plan_details_keyboard(plan_id):
     keyboard = InlineKeyboardMarkup(row_width=2)
 
     keyboard.row(
@@ -382,6 +225,9 @@ def plan_details_keyboard(plan_id):
     return keyboard
 
 def payment_methods_keyboard(plan_id=None):
+    return cached_markup(("bot.payment_methods", plan_id), lambda: _build_payment_methods_keyboard(plan_id))
+
+def _build_payment_methods_keyboard(plan_id):
     keyboard = InlineKeyboardMarkup(row_width=2)
 
     methods = [
@@ -413,6 +259,9 @@ def payment_methods_keyboard(plan_id=None):
     return keyboard
 
 def confirm_payment_keyboard(plan_id, method):
+    return cached_markup(("bot.confirm_payment", plan_id, method), lambda: _build_confirm_payment_keyboard(plan_id, method))
+
+def _build_confirm_payment_keyboard(plan_id, method):
     keyboard = InlineKeyboardMarkup(row_width=2)
 
     keyboard.row(
@@ -426,6 +275,9 @@ def confirm_payment_keyboard(plan_id, method):
     return keyboard
 
 def admin_keyboard():
+    return cached_markup("bot.admin", _build_admin_keyboard)
+
+def _build_admin_keyboard():
     keyboard = InlineKeyboardMarkup(row_width=2)
 
     buttons = [
@@ -448,6 +300,72 @@ def admin_keyboard():
     keyboard.add(InlineKeyboardButton("🏠 User Menu", callback_data="main_menu"))
     return keyboard
 
+# ==================== STATIC SCREENS ====================
+
+MAIN_MENU_TEXT = "📍 **MAIN MENU**\n\n*Select an option:*"
+ADMIN_PANEL_TEXT = "👑 **ADMIN PANEL**\n\nSelect an option below:"
+HOW_TO_PAY_TEXT = "❓ **HOW TO PAY - STEP BY STEP**\n\n1. Click View Plans\n2. Choose plan\n3. Click Buy Now\n4. Select payment method\n5. Make payment\n6. Click ✅ I've Paid"
+PAYMENT_METHODS_TEXT = "💳 **Payment Methods**\nSelect a plan first then a method."
+JOIN_CHANNEL_TEXT = "🔗 **JOIN PRIVATE CHANNEL**\n\nYou have active subscription!\n\nClick below to join:"
+ACCESS_DENIED_TEXT = "❌ **ACCESS DENIED**\n\nYou need an active subscription to join the channel."
+NO_SUBSCRIPTION_TEXT = "❌ **NO ACTIVE SUBSCRIPTION**\n\nYou don't have an active subscription."
+
+MAIN_MENU_ROW = [("🏠 Main Menu", "main_menu")]
+
+# ==================== PLAN SCREENS ====================
+
+# Rendered once per plan-catalog version through PlanCatalog.rendered().
+
+def render_plan_list():
+    return "📋 **AVAILABLE SUBSCRIPTION PLANS**\n\n" + "".join(
+        f"\n✨ **{plan['name']}**\n💰 Price: ₹{plan['price']}\n⏰ Duration: {plan['duration_days']} days\n📝 {plan['description']}\n────────────────────\n"
+        for plan in PlanCatalog.all()
+    )
+
+def render_plan_comparison():
+    return "📊 **PLAN COMPARISON**\n\n" + "".join(
+        f"\n✨ **{plan['name']}**\n💰 ₹{plan['price']} | {plan['duration_days']} days\n{plan['features']}\n────────────────────\n"
+        for plan in PlanCatalog.all()
+    )
+
+def render_plan_details(plan):
+    return f"""
+🎯 **SELECTED PLAN**
+
+✨ **{plan['name']}**
+💰 **Price:** ₹{plan['price']}
+⏰ **Duration:** {plan['duration_days']} days
+📝 **Description:** {plan['description']}
+
+✅ **Features Included:**
+{plan['features']}
+
+👇 **Click below to proceed**
+    """
+
+def render_plan_features(plan):
+    return f"""
+✨ **{plan['name']} - FULL FEATURES**
+
+✅ **Included Features:**
+{plan['features']}
+
+🎁 **Additional Benefits:**
+• Instant access after payment
+• 24/7 Support
+• Regular content updates
+• No hidden charges
+    """
+
+def render_plan_payment(plan):
+    return f"""
+💳 **PAYMENT FOR {plan['name']}**
+
+💰 **Amount:** ₹{plan['price']}
+
+**Select payment method:**
+    """
+
 # ==================== MESSAGE HANDLERS ====================
 
 @bot.message_handler(commands=['start', 'menu', 'help'])
@@ -457,15 +375,17 @@ def start_command(message):
     username = message.from_user.username or ""
 
     try:
-        DatabaseManager.execute_query('''
-        INSERT OR REPLACE INTO users (user_id, username, name, join_date, last_active)
+        Database.execute_query('''
+        INSERT INTO users (user_id, username, name, join_date, last_active)
         VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            username = excluded.username, name = excluded.name, last_active = excluded.last_active
         ''', (user_id, username, name,
               datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
               datetime.now().strftime('%Y-%m-%d %H:%M:%S')) ,
         commit=True)
     except Exception as e:
-        logger.error(f"Failed to insert/replace user on /start: {e}")
+        logger.error(f"Failed to upsert user on /start: {e}")
 
     welcome = f"""
 🎉 Welcome {name}!
@@ -478,13 +398,13 @@ def start_command(message):
 👇 **Use buttons below to navigate:**
     """
 
-    bot.send_message(user_id, welcome, parse_mode='Markdown', reply_markup=main_menu(user_id))
+    outbound.send_message(user_id, welcome, parse_mode='Markdown', reply_markup=main_menu(user_id))
 
 @bot.message_handler(commands=['admin'])
 def admin_command(message):
     user_id = message.from_user.id
     if user_id != ADMIN_ID:
-        bot.reply_to(message, "❌ Unauthorized!")
+        outbound.reply_to(message, "❌ Unauthorized!")
         return
 
     text = """
@@ -493,346 +413,246 @@ def admin_command(message):
 Select an option below:
     """
 
-    bot.send_message(user_id, text, parse_mode='Markdown', reply_markup=admin_keyboard())
+    outbound.send_message(user_id, text, parse_mode='Markdown', reply_markup=admin_keyboard())
 
 # ==================== CALLBACK HANDLERS ====================
 
-# ===== Optimized unified callback router (REPLACE existing handle_callback) =====
-@bot.callback_query_handler(func=lambda call: True)
-def handle_callback(call):
-    user_id = call.from_user.id
-    # some callbacks arrive without message (inline queries etc.) - guard
-    try:
-        chat_id = call.message.chat.id
-        msg_id = call.message.message_id
-    except Exception:
-        chat_id = None
-        msg_id = None
-
-    # Immediately stop spinner so user sees responsiveness
-    try:
-        bot.answer_callback_query(call.id)
-    except Exception:
-        pass
-
-    data = (call.data or "").strip()
-
-    # update last_active (best-effort)
-    try:
-        DatabaseManager.execute_query(
-            "UPDATE users SET last_active = ? WHERE user_id = ?",
-            (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), user_id),
-            commit=True
-        )
-    except Exception as e:
-        logger.debug(f"Could not update last_active for {user_id}: {e}")
-
-    try:
-        # ---------- MAIN MENU ----------
-        if data == "main_menu":
-            bot.edit_message_text(
-                "📍 **MAIN MENU**\n\n*Select an option:*",
-                chat_id, msg_id,
-                parse_mode='Markdown',
-                reply_markup=main_menu(user_id)
-            )
-            return
-
-        # ---------- VIEW PLANS ----------
-        if data == "view_plans":
-            try:
-                plans = DatabaseManager.execute_query(
-                    "SELECT name, price, days, description FROM plans ORDER BY price",
-                    fetchall=True
-                ) or []
-            except Exception as e:
-                logger.error(f"Error fetching plans: {e}")
-                plans = []
-
-            text = "📋 **AVAILABLE SUBSCRIPTION PLANS**\n\n"
-            for plan in plans:
-                text += f"\n✨ **{plan[0]}**\n💰 Price: ₹{plan[1]}\n⏰ Duration: {plan[2]} days\n📝 {plan[3]}\n────────────────────\n"
-
-            bot.edit_message_text(
-                text,
-                chat_id, msg_id,
-                parse_mode='Markdown',
-                reply_markup=plans_keyboard()
-            )
-            return
-
-        # ---------- PLAN DETAILS / BUY ----------
-        if data.startswith("plan_"):
-            try:
-                plan_id = int(data.split("_")[1])
-            except Exception:
-                bot.answer_callback_query(call.id, "Invalid plan.")
-                return
-
-            plan = DatabaseManager.execute_query(
-                "SELECT name, price, days, description, features FROM plans WHERE id = ?",
-                (plan_id,), fetchone=True
-            )
-            if not plan:
-                bot.answer_callback_query(call.id, "Plan not found.")
-                return
-
-            text = f"""
-🎯 **SELECTED PLAN**
-
-✨ **{plan[0]}**
-💰 **Price:** ₹{plan[1]}
-⏰ **Duration:** {plan[2]} days
-📝 **Description:** {plan[3]}
-
-✅ **Features Included:**
-{plan[4]}
-
-👇 **Click below to proceed**
-            """
-            bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=plan_details_keyboard(plan_id))
-            return
-
-        if data.startswith("features_"):
-            try:
-                plan_id = int(data.split("_")[1])
-            except Exception:
-                bot.answer_callback_query(call.id, "Invalid plan.")
-                return
-            plan = DatabaseManager.execute_query(
-                "SELECT name, features FROM plans WHERE id = ?",
-                (plan_id,), fetchone=True
-            )
-            if not plan:
-                bot.answer_callback_query(call.id, "Plan not found.")
-                return
-            text = f"""
-✨ **{plan[0]} - FULL FEATURES**
-
-✅ **Included Features:**
-{plan[1]}
-
-🎁 **Additional Benefits:**
-• Instant access after payment
-• 24/7 Support
-• Regular content updates
-• No hidden charges
-            """
-            keyboard = InlineKeyboardMarkup()
-            keyboard.add(InlineKeyboardButton("💳 Buy Now", callback_data=f"buy_{plan_id}"))
-            keyboard.add(InlineKeyboardButton("🔙 Back", callback_data=f"plan_{plan_id}"))
-            bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
-            return
+# Each screen is a route on callback_router: exact callback_data values are a
+# dict lookup, parameterised ones (plan_3, pay_upi_3, ...) are looked up by
+# their prefix, and every route records call count and latency (/cbstats).
+
+# ---------- MAIN MENU ----------
+@callback_router.exact("main_menu")
+def cb_main_menu(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    bot.edit_message_text(
+        MAIN_MENU_TEXT,
+        chat_id, msg_id,
+        parse_mode='Markdown',
+        reply_markup=main_menu(user_id)
+    )
 
-        if data.startswith("buy_"):
-            try:
-                plan_id = int(data.split("_")[1])
-            except Exception:
-                bot.answer_callback_query(call.id, "Invalid request.")
-                return
-            plan = DatabaseManager.execute_query(
-                "SELECT name, price FROM plans WHERE id = ?",
-                (plan_id,), fetchone=True
-            )
-            if not plan:
-                bot.answer_callback_query(call.id, "Plan not found!")
-                return
-            text = f"""
-💳 **PAYMENT FOR {plan[0]}**
+# ---------- VIEW PLANS ----------
+@callback_router.exact("view_plans")
+def cb_view_plans(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    text = PlanCatalog.rendered("bot.view_plans", render_plan_list)
+
+    bot.edit_message_text(
+        text,
+        chat_id, msg_id,
+        parse_mode='Markdown',
+        reply_markup=plans_keyboard()
+    )
 
-💰 **Amount:** ₹{plan[1]}
+# ---------- PLAN DETAILS / BUY ----------
+@callback_router.prefix("plan_", parse=int)
+def cb_plan(ctx, plan_id):
+    call, user_id, chat_id, msg_id = ctx
+    text = PlanCatalog.rendered(("bot.plan", plan_id), render_plan_details, plan_id)
+    if text is None:
+        bot.answer_callback_query(call.id, "Plan not found.")
+        return
+    bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=plan_details_keyboard(plan_id))
+
+@callback_router.prefix("features_", parse=int)
+def cb_features(ctx, plan_id):
+    call, user_id, chat_id, msg_id = ctx
+    text = PlanCatalog.rendered(("bot.features", plan_id), render_plan_features, plan_id)
+    if text is None:
+        bot.answer_callback_query(call.id, "Plan not found.")
+        return
+    keyboard = rows_markup(("bot.features", plan_id), [("💳 Buy Now", f"buy_{plan_id}")], [("🔙 Back", f"plan_{plan_id}")])
+    bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
+
+@callback_router.prefix("buy_", parse=int)
+def cb_buy(ctx, plan_id):
+    call, user_id, chat_id, msg_id = ctx
+    text = PlanCatalog.rendered(("bot.buy", plan_id), render_plan_payment, plan_id)
+    if text is None:
+        bot.answer_callback_query(call.id, "Plan not found!")
+        return
+    bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=payment_methods_keyboard(plan_id))
+
+# ---------- PAYMENT METHODS ----------
+def _parse_method_plan(arg):
+    """'upi_3' -> ('upi', 3); 'upi' -> ('upi', None)."""
+    method, _, plan_id = arg.partition("_")
+    if not method:
+        raise ValueError(arg)
+    return method, (int(plan_id) if plan_id else None)
+
+def _parse_method_required_plan(arg):
+    method, plan_id = _parse_method_plan(arg)
+    if plan_id is None:
+        raise ValueError(arg)
+    return method, plan_id
+
+# handles pay_upi_<id>, pay_bank_<id>, pay_phonepe_<id> etc. (plan id optional)
+@callback_router.prefix("pay_", parse=_parse_method_plan)
+def cb_pay(ctx, args):
+    call, user_id, chat_id, msg_id = ctx
+    method, plan_id = args
+
+    plan = None
+    if plan_id:
+        plan = PlanCatalog.get(plan_id)
 
-**Select payment method:**
-            """
-            bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=payment_methods_keyboard(plan_id))
+    # UPI flow
+    if method == "upi":
+        if not plan:
+            bot.answer_callback_query(call.id, "Plan not found!")
             return
-
-        # ---------- PAYMENT METHODS ----------
-        if data.startswith("pay_"):
-            # handles pay_upi_<id>, pay_bank_<id>, pay_phonepe_<id> etc.
-            parts = data.split("_")
-            # form: pay, method, planid OR pay, method if no plan
-            if len(parts) >= 3:
-                method = parts[1]
-                try:
-                    plan_id = int(parts[2])
-                except Exception:
-                    bot.answer_callback_query(call.id, "Invalid plan id.")
-                    return
-            else:
-                method = parts[1]
-                plan_id = None
-
-            plan = None
-            if plan_id:
-                plan = DatabaseManager.execute_query("SELECT name, price FROM plans WHERE id = ?", (plan_id,), fetchone=True)
-
-            # UPI flow
-            if method == "upi":
-                if not plan:
-                    bot.answer_callback_query(call.id, "Plan not found!")
-                    return
-                text = f"""
+        text = f"""
 📱 **UPI PAYMENT INSTRUCTIONS**
 
-**Plan:** {plan[0]}
-**Amount:** ₹{plan[1]}
+**Plan:** {plan['name']}
+**Amount:** ₹{plan['price']}
 
-Send ₹{plan[1]} to UPI ID:
+Send ₹{plan['price']} to UPI ID:
 `{UPI_ID}`
 
 Add `UserID: {user_id}` in note and click ✅ I've Paid.
-                """
-                bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=confirm_payment_keyboard(plan_id, "upi"))
-                return
-            else:
-                # generic method info
-                text = f"📝 Payment method: {method.upper()}\nContact support for instructions."
-                keyboard = InlineKeyboardMarkup()
-                keyboard.add(InlineKeyboardButton("📞 Contact Support", callback_data="contact_support"))
-                if plan_id:
-                    keyboard.add(InlineKeyboardButton("🔙 Back", callback_data=f"buy_{plan_id}"))
-                bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
-                return
-
-        # CONFIRM PAYMENT
-        if data.startswith("confirm_"):
-            parts = data.split("_")
-            if len(parts) < 3:
-                bot.answer_callback_query(call.id, "Invalid confirm request.")
-                return
-            method = parts[1]
-            try:
-                plan_id = int(parts[2])
-            except Exception:
-                bot.answer_callback_query(call.id, "Invalid plan id.")
-                return
+        """
+        bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=confirm_payment_keyboard(plan_id, "upi"))
+        return
+    else:
+        # generic method info
+        text = f"📝 Payment method: {method.upper()}\nContact support for instructions."
+        if plan_id:
+            keyboard = rows_markup(("bot.pay_other", plan_id), [("📞 Contact Support", "contact_support")], [("🔙 Back", f"buy_{plan_id}")])
+        else:
+            keyboard = rows_markup("bot.pay_other", [("📞 Contact Support", "contact_support")])
+        bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
+        return
 
-            plan = DatabaseManager.execute_query("SELECT name, price, days FROM plans WHERE id = ?", (plan_id,), fetchone=True)
-            if not plan:
-                bot.answer_callback_query(call.id, "Plan not found!")
-                return
+# CONFIRM PAYMENT
+@callback_router.prefix("confirm_", parse=_parse_method_required_plan)
+def cb_confirm(ctx, args):
+    call, user_id, chat_id, msg_id = ctx
+    method, plan_id = args
 
-            # create payment record
-            try:
-                DatabaseManager.execute_query('''
-                    INSERT INTO payments (user_id, plan_id, amount, method, status, timestamp)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (user_id, plan_id, plan[1], method, 'pending', datetime.now().strftime('%Y-%m-%d %H:%M:%S')), commit=True)
+    plan = PlanCatalog.get(plan_id)
+    if not plan:
+        bot.answer_callback_query(call.id, "Plan not found!")
+        return
 
-                result = DatabaseManager.execute_query("SELECT last_insert_rowid()", fetchone=True)
-                payment_id = result[0] if result else "N/A"
+    # create payment record
+    try:
+        payment_id = create_payment(user_id, plan_id, plan['price'], method, plan.get('currency'))
 
-                admin_msg = f"""
+        admin_msg = f"""
 ⚠️ NEW PAYMENT REQUEST
 User: {call.from_user.first_name} (@{call.from_user.username})
 User ID: `{user_id}`
-Plan: {plan[0]}
-Amount: ₹{plan[1]}
+Plan: {plan['name']}
+Amount: ₹{plan['price']}
 Method: {method}
 Payment ID: `{payment_id}`
 To approve: /approve {payment_id}
 """
-                try:
-                    bot.send_message(ADMIN_ID, admin_msg, parse_mode='Markdown')
-                except Exception as e:
-                    logger.error(f"Failed to notify admin: {e}")
-
-                text = f"✅ Payment Request submitted. Payment ID: `{payment_id}`. Wait for verification."
-                keyboard = InlineKeyboardMarkup()
-                keyboard.add(InlineKeyboardButton("📞 Contact Support", callback_data="contact_support"))
-                keyboard.add(InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu"))
-                bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
-                bot.answer_callback_query(call.id, "Payment request submitted!")
-                return
-            except Exception as e:
-                logger.exception(f"Failed while confirming payment: {e}")
-                bot.answer_callback_query(call.id, "❌ Failed to submit payment.")
-                return
+        try:
+            outbound.send_message(ADMIN_ID, admin_msg, parse_mode='Markdown')
+        except Exception as e:
+            logger.error(f"Failed to notify admin: {e}")
+
+        text = f"✅ Payment Request submitted. Payment ID: `{payment_id}`. Wait for verification."
+        keyboard = rows_markup("bot.payment_submitted", [("📞 Contact Support", "contact_support")], MAIN_MENU_ROW)
+        bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
+        bot.answer_callback_query(call.id, "Payment request submitted!")
+        return
+    except Exception as e:
+        logger.exception(f"Failed while confirming payment: {e}")
+        bot.answer_callback_query(call.id, "❌ Failed to submit payment.")
+        return
 
-        # ---------- MY SUBSCRIPTION ----------
-        if data == "my_subscription":
-            user = DatabaseManager.execute_query("SELECT plan, expiry_date FROM users WHERE user_id = ?", (user_id,), fetchone=True)
+# ---------- MY SUBSCRIPTION ----------
+@callback_router.exact("my_subscription")
+def cb_my_subscription(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    user = Database.execute_query("SELECT plan, expiry_date FROM users WHERE user_id = ?", (user_id,), fetchone=True)
+    show_channel = False
+    if user and user[1]:
+        try:
+            expiry = datetime.strptime(user[1], '%Y-%m-%d %H:%M:%S')
+        except Exception:
+            expiry = datetime.fromisoformat(user[1])
+        days_left = (expiry - datetime.now()).days
+        if days_left > 0:
+            status = "✅ ACTIVE"
+            status_desc = f"Expires in {days_left} days"
+            show_channel = True
+        else:
+            status = "❌ EXPIRED"
+            status_desc = f"Expired {abs(days_left)} days ago"
             show_channel = False
-            if user and user[1]:
-                try:
-                    expiry = datetime.strptime(user[1], '%Y-%m-%d %H:%M:%S')
-                except Exception:
-                    expiry = datetime.fromisoformat(user[1])
-                days_left = (expiry - datetime.now()).days
-                if days_left > 0:
-                    status = "✅ ACTIVE"
-                    status_desc = f"Expires in {days_left} days"
-                    show_channel = True
-                else:
-                    status = "❌ EXPIRED"
-                    status_desc = f"Expired {abs(days_left)} days ago"
-                    show_channel = False
-                text = f"""
+        text = f"""
 🔍 **MY SUBSCRIPTION**
 
 📅 **Plan:** {user[0]}
 📆 **Expiry Date:** {expiry.strftime('%d %b %Y')}
 ⏳ **Status:** {status}
 📝 **Note:** {status_desc}
-                """
-            else:
-                text = "❌ **NO ACTIVE SUBSCRIPTION**\n\nYou don't have an active subscription."
-                show_channel = False
-
-            keyboard = InlineKeyboardMarkup(row_width=2)
-            if show_channel:
-                keyboard.row(InlineKeyboardButton("🔗 Join Channel", url=CHANNEL_INVITE_LINK), InlineKeyboardButton("🔄 Renew", callback_data="view_plans"))
-            else:
-                keyboard.row(InlineKeyboardButton("💳 Subscribe", callback_data="view_plans"), InlineKeyboardButton("📋 View Plans", callback_data="view_plans"))
-            keyboard.add(InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu"))
-            bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
-            return
-
-        # ---------- JOIN CHANNEL ----------
-        if data == "join_channel":
-            if has_active_subscription(user_id):
-                keyboard = InlineKeyboardMarkup()
-                keyboard.add(InlineKeyboardButton("🔗 Join Now", url=CHANNEL_INVITE_LINK))
-                keyboard.add(InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu"))
-                bot.edit_message_text("🔗 **JOIN PRIVATE CHANNEL**\n\nYou have active subscription!\n\nClick below to join:", chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
-            else:
-                keyboard = InlineKeyboardMarkup()
-                keyboard.add(InlineKeyboardButton("💳 Subscribe Now", callback_data="view_plans"))
-                keyboard.add(InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu"))
-                bot.edit_message_text("❌ **ACCESS DENIED**\n\nYou need an active subscription to join the channel.", chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
-            return
+        """
+    else:
+        text = NO_SUBSCRIPTION_TEXT
+        show_channel = False
 
-        # ---------- CONTACT SUPPORT ----------
-        if data == "contact_support":
-            text = f"""
+    if show_channel:
+        keyboard = rows_markup("bot.my_sub_active", [("🔗 Join Channel", CHANNEL_INVITE_LINK), ("🔄 Renew", "view_plans")], MAIN_MENU_ROW)
+    else:
+        keyboard = rows_markup("bot.my_sub_none", [("💳 Subscribe", "view_plans"), ("📋 View Plans", "view_plans")], MAIN_MENU_ROW)
+    bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
+
+# ---------- JOIN CHANNEL ----------
+@callback_router.exact("join_channel")
+def cb_join_channel(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    if has_active_subscription(user_id):
+        keyboard = rows_markup("bot.join_now", [("🔗 Join Now", CHANNEL_INVITE_LINK)], MAIN_MENU_ROW)
+        bot.edit_message_text(JOIN_CHANNEL_TEXT, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
+    else:
+        keyboard = rows_markup("bot.subscribe_now", [("💳 Subscribe Now", "view_plans")], MAIN_MENU_ROW)
+        bot.edit_message_text(ACCESS_DENIED_TEXT, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
+
+# ---------- CONTACT SUPPORT ----------
+@callback_router.exact("contact_support")
+def cb_contact_support(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    text = f"""
 📞 **CONTACT SUPPORT**
 
 For payment or subscription help. Please provide your User ID: `{user_id}`
-            """
-            keyboard = InlineKeyboardMarkup()
-            keyboard.add(InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu"))
-            bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
-            return
-
-        # ---------- HOW TO PAY ----------
-        if data == "how_to_pay":
-            keyboard = InlineKeyboardMarkup(row_width=2)
-            keyboard.row(InlineKeyboardButton("📋 View Plans", callback_data="view_plans"), InlineKeyboardButton("📞 Contact Support", callback_data="contact_support"))
-            keyboard.add(InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu"))
-            bot.edit_message_text("❓ **HOW TO PAY - STEP BY STEP**\n\n1. Click View Plans\n2. Choose plan\n3. Click Buy Now\n4. Select payment method\n5. Make payment\n6. Click ✅ I've Paid", chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
-            return
-
-        # ---------- REFER & EARN (copy + withdraw) ----------
-        if data == "refer_earn":
-            # re-show refer screen (same as before)
-            try:
-                bot_info = bot.get_me()
-                bot_username = bot_info.username
-            except Exception:
-                bot_username = CHANNEL_USERNAME.replace("@", "") or "streamXsub_bot"
-            referral_link = f"https://t.me/{bot_username}?start=ref_{user_id}"
-            text = f"""
+    """
+    bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=rows_markup("bot.main_menu_only", MAIN_MENU_ROW))
+
+# ---------- HOW TO PAY ----------
+@callback_router.exact("how_to_pay")
+def cb_how_to_pay(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    keyboard = rows_markup("bot.how_to_pay", [("📋 View Plans", "view_plans"), ("📞 Contact Support", "contact_support")], MAIN_MENU_ROW)
+    bot.edit_message_text(HOW_TO_PAY_TEXT, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
+
+# ---------- REFER & EARN (copy + withdraw) ----------
+def answer_callback_later(call_id, text):
+    """Answer a callback from an outbound delivery callback (runs on a sender thread)."""
+    try:
+        bot.answer_callback_query(call_id, text)
+    except Exception as e:
+        # the query may have expired while the message waited in the queue
+        logger.debug(f"Late callback answer failed: {e}")
+
+def referral_link_for(user_id):
+    # bot identity is cached in Config at startup - no get_me() per tap
+    bot_username = Config.bot_username(bot) or CHANNEL_USERNAME.replace("@", "") or "streamXsub_bot"
+    return f"https://t.me/{bot_username}?start=ref_{user_id}"
+
+@callback_router.exact("refer_earn")
+def cb_refer_earn(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    # re-show refer screen (same as before)
+    referral_link = referral_link_for(user_id)
+    text = f"""
 🎁 **REFER & EARN PROGRAM**
 
 **Your Referral Link:**
@@ -840,202 +660,237 @@ For payment or subscription help. Please provide your User ID: `{user_id}`
 
 Earn 10% commission on referrals.
 Current balance shown in your chat.
-            """
-            keyboard = InlineKeyboardMarkup(row_width=2)
-            keyboard.row(InlineKeyboardButton("📋 Copy Link", callback_data="copy_ref_link"),
-                         InlineKeyboardButton("💰 Withdraw", callback_data="withdraw_earnings"))
-            keyboard.add(InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu"))
-            bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
-            return
+    """
+    keyboard = rows_markup("bot.refer", [("📋 Copy Link", "copy_ref_link"), ("💰 Withdraw", "withdraw_earnings")], MAIN_MENU_ROW)
+    bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
 
-        if data == "copy_ref_link":
-            try:
-                bot_info = bot.get_me()
-                bot_username = bot_info.username
-            except Exception:
-                bot_username = CHANNEL_USERNAME.replace("@", "") or "streamXsub_bot"
-            referral_link = f"https://t.me/{bot_username}?start=ref_{user_id}"
-            try:
-                bot.send_message(user_id, f"📋 Your referral link:\n{referral_link}")
-                bot.answer_callback_query(call.id, "Link sent to your chat.")
-            except Exception:
-                bot.answer_callback_query(call.id, "Unable to send link in chat.")
-            return
+@callback_router.exact("copy_ref_link")
+def cb_copy_ref_link(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    referral_link = referral_link_for(user_id)
 
-        if data == "withdraw_earnings":
-            # Check user's balance column (balanced added by migration)
-            try:
-                res = DatabaseManager.execute_query("SELECT balance FROM users WHERE user_id = ?", (user_id,), fetchone=True)
-            except Exception as e:
-                logger.debug(f"withdraw query failed: {e}")
-                res = None
+    # answered once the queue knows whether the message was delivered
+    def sent(ok, result):
+        answer_callback_later(call.id, "Link sent to your chat." if ok else "Unable to send link in chat.")
+
+    outbound.send_message(user_id, f"📋 Your referral link:\n{referral_link}", callback=sent)
+
+@callback_router.exact("withdraw_earnings")
+def cb_withdraw_earnings(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    # Check user's balance column (balanced added by migration)
+    try:
+        res = Database.execute_query("SELECT balance FROM users WHERE user_id = ?", (user_id,), fetchone=True)
+    except Exception as e:
+        logger.debug(f"withdraw query failed: {e}")
+        res = None
+    balance = 0
+    if res:
+        try:
+            balance = int(res[0] or 0)
+        except Exception:
             balance = 0
-            if res:
-                try:
-                    balance = int(res[0] or 0)
-                except Exception:
-                    balance = 0
-            if balance <= 0:
-                bot.answer_callback_query(call.id, "You have ₹0 balance.")
-                return
-            # Ask for UPI id via private message (simple flow)
-            try:
-                bot.send_message(user_id, f"💰 Your balance: ₹{balance}\nReply with your UPI ID to withdraw (or contact admin).")
-                # set withdraw_state so next message can be handled (if you implement message handler)
-                try:
-                    DatabaseManager.execute_query("UPDATE users SET withdraw_state = ? WHERE user_id = ?", ("awaiting_upi", user_id), commit=True)
-                except Exception:
-                    pass
-                bot.answer_callback_query(call.id, "Withdrawal started. Check your chat.")
-            except Exception:
-                bot.answer_callback_query(call.id, "Unable to start withdrawal.")
+    if balance <= 0:
+        bot.answer_callback_query(call.id, "You have ₹0 balance.")
+        return
+    # Ask for UPI id via private message (simple flow); the state is only set
+    # once the prompt was actually delivered
+    def sent(ok, result):
+        if not ok:
+            answer_callback_later(call.id, "Unable to start withdrawal.")
             return
-
-        # ---------- ADMIN PANEL ----------
-        if data == "admin_panel":
-            if user_id != ADMIN_ID:
-                bot.answer_callback_query(call.id, "❌ Unauthorized")
-                return
-            bot.edit_message_text("👑 **ADMIN PANEL**\n\nSelect an option below:", chat_id, msg_id, parse_mode='Markdown', reply_markup=admin_keyboard())
+        # set withdraw_state so next message can be handled (if you implement message handler)
+        try:
+            Database.execute_query("UPDATE users SET withdraw_state = ? WHERE user_id = ?", ("awaiting_upi", user_id), commit=True)
+        except Exception as e:
+            logger.error(f"Failed to set withdraw_state for {user_id}: {e}")
+            answer_callback_later(call.id, "Unable to start withdrawal.")
             return
+        answer_callback_later(call.id, "Withdrawal started. Check your chat.")
 
-        # admin actions
-        if data == "admin_users":
-            if user_id != ADMIN_ID:
-                bot.answer_callback_query(call.id, "❌ Unauthorized")
-                return
-            rows = DatabaseManager.execute_query("SELECT user_id, username, plan, expiry_date FROM users ORDER BY join_date DESC LIMIT 20", fetchall=True) or []
-            if not rows:
-                bot.send_message(user_id, "No users found.")
-            else:
-                text = "👥 Latest Users (up to 20):\n\n"
-                for r in rows:
-                    text += f"• {r[0]} / @{r[1] or '-'} — {r[2] or 'free'} — exp:{r[3] or '-'}\n"
-                bot.send_message(user_id, text)
-            bot.answer_callback_query(call.id)
-            return
+    outbound.send_message(user_id, f"💰 Your balance: ₹{balance}\nReply with your UPI ID to withdraw (or contact admin).",
+                          callback=sent)
 
-        if data == "admin_active":
-            if user_id != ADMIN_ID:
-                return
-            total_active = DatabaseManager.execute_query("SELECT COUNT(*) FROM users WHERE expiry_date > datetime('now')", fetchone=True) or (0,)
-            bot.send_message(user_id, f"✅ Active subscriptions: {total_active[0] if total_active else 0}")
-            bot.answer_callback_query(call.id)
-            return
+# ---------- ADMIN PANEL ----------
+@callback_router.exact("admin_panel")
+def cb_admin_panel(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    if user_id != ADMIN_ID:
+        bot.answer_callback_query(call.id, "❌ Unauthorized")
+        return
+    bot.edit_message_text(ADMIN_PANEL_TEXT, chat_id, msg_id, parse_mode='Markdown', reply_markup=admin_keyboard())
 
-        if data == "admin_stats":
-            if user_id != ADMIN_ID:
-                return
-            try:
-                total_users = DatabaseManager.execute_query("SELECT COUNT(*) FROM users", fetchone=True)[0]
-                active_subs = DatabaseManager.execute_query("SELECT COUNT(*) FROM users WHERE expiry_date > datetime('now')", fetchone=True)[0]
-                pending_payments = DatabaseManager.execute_query("SELECT COUNT(*) FROM payments WHERE status = 'pending'", fetchone=True)[0]
-                total_revenue = DatabaseManager.execute_query("SELECT SUM(amount) FROM payments WHERE status = 'completed'", fetchone=True)[0] or 0
-            except Exception as e:
-                logger.error(f"Error fetching admin stats: {e}")
-                total_users = active_subs = pending_payments = total_revenue = 0
-            text = f"""
+# admin actions
+@callback_router.exact("admin_users")
+def cb_admin_users(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    if user_id != ADMIN_ID:
+        bot.answer_callback_query(call.id, "❌ Unauthorized")
+        return
+    rows = Database.execute_query("SELECT user_id, username, plan, expiry_date FROM users ORDER BY join_date DESC LIMIT 20", fetchall=True) or []
+    if not rows:
+        outbound.send_message(user_id, "No users found.")
+    else:
+        text = "👥 Latest Users (up to 20):\n\n"
+        for r in rows:
+            text += f"• {r[0]} / @{r[1] or '-'} — {r[2] or 'free'} — exp:{r[3] or '-'}\n"
+        outbound.send_message(user_id, text)
+    bot.answer_callback_query(call.id)
+
+@callback_router.exact("admin_active")
+def cb_admin_active(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    if user_id != ADMIN_ID:
+        return
+    try:
+        total_active = load_admin_stats()["active_subs"]
+    except Exception as e:
+        logger.error(f"Error fetching active subscriptions: {e}")
+        total_active = 0
+    outbound.send_message(user_id, f"✅ Active subscriptions: {total_active}")
+    bot.answer_callback_query(call.id)
+
+@callback_router.exact("admin_stats")
+def cb_admin_stats(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    if user_id != ADMIN_ID:
+        return
+    try:
+        stats = load_admin_stats()
+        total_users = stats["total_users"]
+        active_subs = stats["active_subs"]
+        pending_payments = stats["pending_payments"]
+        total_revenue = stats["revenue"]
+    except Exception as e:
+        logger.error(f"Error fetching admin stats: {e}")
+        total_users = active_subs = pending_payments = total_revenue = 0
+    text = f"""
 📊 **ADMIN STATISTICS**
 
 👥 Total Users: {total_users}
 ✅ Active Subscriptions: {active_subs}
 💰 Total Revenue: ₹{total_revenue}
 ⏳ Pending Payments: {pending_payments}
-            """
-            keyboard = InlineKeyboardMarkup()
-            keyboard.add(InlineKeyboardButton("🔄 Refresh", callback_data="admin_stats"))
-            keyboard.add(InlineKeyboardButton("🔙 Admin Panel", callback_data="admin_panel"))
-            bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
-            return
-
-        if data == "admin_payments":
-            if user_id != ADMIN_ID:
-                return
-            pend = DatabaseManager.execute_query("SELECT id, user_id, plan_id, amount, timestamp FROM payments WHERE status = 'pending' ORDER BY id DESC LIMIT 20", fetchall=True) or []
-            if not pend:
-                bot.send_message(user_id, "No pending payments.")
-            else:
-                text = "⏳ Pending payments (up to 20):\n\n"
-                for p in pend:
-                    text += f"• ID:{p[0]} UID:{p[1]} Plan:{p[2]} ₹{p[3]} at {p[4]}\n"
-                bot.send_message(user_id, text)
-            bot.answer_callback_query(call.id)
-            return
+    """
+    keyboard = rows_markup("bot.admin_stats", [("🔄 Refresh", "admin_stats")], [("🔙 Admin Panel", "admin_panel")])
+    bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=keyboard)
 
-        if data == "admin_broadcast":
-            if user_id != ADMIN_ID:
-                return
-            bot.send_message(user_id, "📢 To broadcast: use /broadcast_send <message> (this bot supports a separate /broadcast_send admin command).")
-            bot.answer_callback_query(call.id)
-            return
+@callback_router.exact("admin_payments")
+def cb_admin_payments(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    if user_id != ADMIN_ID:
+        return
+    pend = Database.execute_query("SELECT id, user_id, plan_id, amount, timestamp FROM payments WHERE status = 'pending' ORDER BY id DESC LIMIT 20", fetchall=True) or []
+    if not pend:
+        outbound.send_message(user_id, "No pending payments.")
+    else:
+        text = "⏳ Pending payments (up to 20):\n\n"
+        for p in pend:
+            text += f"• ID:{p[0]} UID:{p[1]} Plan:{p[2]} ₹{p[3]} at {p[4]}\n"
+        outbound.send_message(user_id, text)
+    bot.answer_callback_query(call.id)
+
+@callback_router.exact("admin_broadcast")
+def cb_admin_broadcast(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    if user_id != ADMIN_ID:
+        return
+    outbound.send_message(user_id, "📢 To broadcast: use /broadcast_send <message>\n\nThe message is sent to every user; progress is shown in a single message and survives restarts.\nA broadcast that stalls is paused; continue it with /broadcast_resume <id>")
+    bot.answer_callback_query(call.id)
 
-        if data == "admin_add_sub":
-            if user_id != ADMIN_ID:
-                return
-            bot.send_message(user_id, "➕ Use /addsub <user_id> <days> to add subscription.")
-            bot.answer_callback_query(call.id)
-            return
+@callback_router.exact("admin_add_sub")
+def cb_admin_add_sub(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    if user_id != ADMIN_ID:
+        return
+    outbound.send_message(user_id, "➕ Use /addsub <user_id> <days> to add subscription.")
+    bot.answer_callback_query(call.id)
 
-        if data == "admin_settings":
-            if user_id != ADMIN_ID:
-                return
-            bot.send_message(user_id, "⚙️ Admin settings: (not yet implemented in UI). Use commands.")
-            bot.answer_callback_query(call.id)
-            return
+@callback_router.exact("admin_settings")
+def cb_admin_settings(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    if user_id != ADMIN_ID:
+        return
+    outbound.send_message(user_id, "⚙️ Admin settings: (not yet implemented in UI). Use commands.")
+    bot.answer_callback_query(call.id)
 
-        if data == "admin_logs":
-            if user_id != ADMIN_ID:
-                return
-            try:
-                if os.path.exists("bot.log"):
-                    with open("bot.log", "r", encoding="utf-8") as f:
-                        lines = f.readlines()[-40:]
-                    bot.send_message(user_id, "📄 Recent Logs:\n" + "".join(lines))
-                else:
-                    bot.send_message(user_id, "Log file not found.")
-            except Exception as e:
-                logger.exception(f"admin_logs error: {e}")
-            bot.answer_callback_query(call.id)
-            return
+@callback_router.exact("admin_logs")
+def cb_admin_logs(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    if user_id != ADMIN_ID:
+        return
+    send_log_tail(user_id)
+    bot.answer_callback_query(call.id)
 
-        # ---------- COMPARE / PAYMENT METHODS / RATE ----------
-        if data == "compare_plans":
-            plans = DatabaseManager.execute_query("SELECT name, price, days, features FROM plans ORDER BY price", fetchall=True) or []
-            text = "📊 **PLAN COMPARISON**\n\n"
-            for plan in plans:
-                text += f"\n✨ **{plan[0]}**\n💰 ₹{plan[1]} | {plan[2]} days\n{plan[3]}\n────────────────────\n"
-            kb = InlineKeyboardMarkup()
-            kb.add(InlineKeyboardButton("📋 View Plans", callback_data="view_plans"))
-            kb.add(InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu"))
-            bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=kb)
+def send_log_tail(chat_id, limit=40, min_level=None, pattern=None):
+    """Send the last log records; long output goes out as a .gz document."""
+    try:
+        if not os.path.exists(LOG_FILE):
+            outbound.send_message(chat_id, "Log file not found.")
             return
-
-        if data == "payment_methods":
-            kb = InlineKeyboardMarkup()
-            kb.add(InlineKeyboardButton("📋 View Plans", callback_data="view_plans"))
-            kb.add(InlineKeyboardButton("🏠 Main Menu", callback_data="main_menu"))
-            bot.edit_message_text("💳 **Payment Methods**\nSelect a plan first then a method.", chat_id, msg_id, parse_mode='Markdown', reply_markup=kb)
+        records = logtail.tail_records(LOG_FILE, limit, min_level, pattern)
+        if not records:
+            outbound.send_message(chat_id, "📄 No matching log records.")
             return
+        text = "\n".join(records)
+        if len(text) <= logtail.MAX_MESSAGE_CHARS:
+            outbound.send_message(chat_id, "📄 Recent Logs:\n" + text)
+        else:
+            outbound.submit("send_document", chat_id, logtail.gzip_document(text),
+                            caption=f"📄 Last {len(records)} log records")
+    except Exception as e:
+        logger.exception(f"admin_logs error: {e}")
+
+# ---------- COMPARE / PAYMENT METHODS / RATE ----------
+@callback_router.exact("compare_plans")
+def cb_compare_plans(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    text = PlanCatalog.rendered("bot.compare_plans", render_plan_comparison)
+    kb = rows_markup("bot.plans_and_menu", [("📋 View Plans", "view_plans")], MAIN_MENU_ROW)
+    bot.edit_message_text(text, chat_id, msg_id, parse_mode='Markdown', reply_markup=kb)
+
+@callback_router.exact("payment_methods")
+def cb_payment_methods(ctx):
+    call, user_id, chat_id, msg_id = ctx
+    kb = rows_markup("bot.plans_and_menu", [("📋 View Plans", "view_plans")], MAIN_MENU_ROW)
+    bot.edit_message_text(PAYMENT_METHODS_TEXT, chat_id, msg_id, parse_mode='Markdown', reply_markup=kb)
+
+@callback_router.prefix("rate_")
+def cb_rate(ctx, arg):
+    call, user_id, chat_id, msg_id = ctx
+    try:
+        rating = int(arg)
+        bot.answer_callback_query(call.id, f"Thanks for rating {rating}⭐")
+    except Exception:
+        bot.answer_callback_query(call.id, "Thanks for your feedback!")
 
-        if data.startswith("rate_"):
-            try:
-                rating = int(data.split("_")[1])
-                bot.answer_callback_query(call.id, f"Thanks for rating {rating}⭐")
-            except Exception:
-                bot.answer_callback_query(call.id, "Thanks for your feedback!")
-            return
+@bot.callback_query_handler(func=lambda call: True)
+def handle_callback(call):
+    ctx = CallbackContext.from_call(call)
 
-        # default fallback - stop spinner if nothing matched
+    # Immediately stop spinner so user sees responsiveness
+    try:
         bot.answer_callback_query(call.id)
-        return
+    except Exception:
+        pass
+
+    data = (call.data or "").strip()
+
+    # update last_active (buffered, written in batches by ActivityBuffer)
+    ActivityBuffer.touch(ctx.user_id)
 
+    try:
+        if not callback_router.dispatch(data, ctx):
+            # default fallback - stop spinner if nothing matched
+            bot.answer_callback_query(call.id)
+    except InvalidCallbackData:
+        bot.answer_callback_query(call.id, "Invalid request.")
     except Exception as e:
         logger.exception(f"Callback error: {e}")
         try:
             bot.answer_callback_query(call.id, "❌ Error occurred!")
         except Exception:
             pass
-        return
 
 # ==================== ADMIN COMMANDS ====================
 
@@ -1047,46 +902,31 @@ def approve_payment(message):
     try:
         parts = message.text.split()
         if len(parts) != 2:
-            bot.reply_to(message, "Usage: /approve <payment_id>")
+            outbound.reply_to(message, "Usage: /approve <payment_id>")
             return
 
         payment_id = int(parts[1])
 
         try:
-            payment = DatabaseManager.execute_query('''
-            SELECT p.user_id, p.plan_id, p.amount, pl.name, pl.days 
-            FROM payments p 
-            JOIN plans pl ON p.plan_id = pl.id 
-            WHERE p.id = ? AND p.status = 'pending'
-            ''', (payment_id,), fetchone=True)
-
-            if not payment:
-                bot.reply_to(message, "❌ Payment not found or already processed")
-                return
-
-            user_id, plan_id, amount, plan_name, days = payment
-
-            # Update payment status
-            DatabaseManager.execute_query(
-                "UPDATE payments SET status = 'completed' WHERE id = ?",
-                (payment_id,),
-                commit=True
-            )
-
-            # Add subscription to user
-            ok = add_subscription(user_id, plan_id, days)
-            if not ok:
-                bot.reply_to(message, "❌ Failed to update subscription in DB")
-                return
-
+            # claim + subscription in one transaction: a second /approve of the
+            # same payment (or a concurrent one) finds it no longer pending
+            approved = complete_payment(payment_id)
         except Exception as e:
             logger.error(f"Database error in /approve: {e}")
-            bot.reply_to(message, f"❌ Database error: {str(e)}")
+            outbound.reply_to(message, f"❌ Database error: {str(e)}")
+            return
+
+        if not approved:
+            outbound.reply_to(message, "❌ Payment not found or already processed")
             return
 
+        user_id, amount = approved["user_id"], approved["amount"]
+        plan_name, days = approved["plan_name"], approved["days"]
+        expiry_scheduler.schedule(user_id, approved["expiry"])
+
         # Notify user
         try:
-            bot.send_message(
+            outbound.send_message(
                 user_id,
                 f"""
 ✅ **PAYMENT APPROVED!**
@@ -1106,11 +946,92 @@ You now have access to the private channel!
         except Exception as e:
             logger.error(f"Failed to notify user: {e}")
 
-        bot.reply_to(message, f"✅ Payment {payment_id} approved. User notified.")
+        outbound.reply_to(message, f"✅ Payment {payment_id} approved. User notified.")
 
     except Exception as e:
         logger.exception(f"/approve command failed: {e}")
-        bot.reply_to(message, f"❌ Error: {str(e)}")
+        outbound.reply_to(message, f"❌ Error: {str(e)}")
+
+@bot.message_handler(commands=['broadcast_send'])
+def broadcast_send_command(message):
+    if message.from_user.id != ADMIN_ID:
+        return
+
+    parts = message.text.split(maxsplit=1)
+    if len(parts) != 2 or not parts[1].strip():
+        outbound.reply_to(message, "Usage: /broadcast_send <message>")
+        return
+
+    try:
+        broadcast_id = broadcaster.start(message.from_user.id, parts[1].strip())
+        logger.info(f"Broadcast {broadcast_id} started by {message.from_user.id}")
+    except Exception as e:
+        logger.exception(f"/broadcast_send failed: {e}")
+        outbound.reply_to(message, f"❌ Error: {str(e)}")
+
+@bot.message_handler(commands=['broadcast_resume'])
+def broadcast_resume_command(message):
+    if message.from_user.id != ADMIN_ID:
+        return
+
+    parts = message.text.split()
+    if len(parts) != 2 or not parts[1].isdigit():
+        outbound.reply_to(message, "Usage: /broadcast_resume <broadcast_id>")
+        return
+
+    try:
+        if broadcaster.resume(int(parts[1])):
+            outbound.reply_to(message, f"▶️ Broadcast {parts[1]} resumed")
+        else:
+            outbound.reply_to(message, f"❌ Broadcast {parts[1]} is not paused")
+    except Exception as e:
+        logger.exception(f"/broadcast_resume failed: {e}")
+        outbound.reply_to(message, f"❌ Error: {str(e)}")
+
+@bot.message_handler(commands=['cbstats'])
+def callback_stats_command(message):
+    if message.from_user.id != ADMIN_ID:
+        return
+    outbound.send_message(message.from_user.id, "⏱ Callback routes (by total time):\n\n" + callback_router.format_stats())
+
+@bot.message_handler(commands=['poolstats'])
+def pool_stats_command(message):
+    if message.from_user.id != ADMIN_ID:
+        return
+    outbound.send_message(message.from_user.id,
+                          update_pool.format_stats() + "\n\n" + Database.pool().format_stats())
+
+@bot.message_handler(commands=['logs'])
+def logs_command(message):
+    if message.from_user.id != ADMIN_ID:
+        return
+
+    # /logs [count] [level] [text to search for]
+    parts = message.text.split()[1:]
+    limit = 40
+    min_level = None
+    if parts and parts[0].isdigit():
+        limit = min(int(parts.pop(0)), 1000)
+    if parts and logtail.parse_level(parts[0]) is not None:
+        min_level = logtail.parse_level(parts.pop(0))
+    pattern = " ".join(parts) or None
+    send_log_tail(message.from_user.id, limit, min_level, pattern)
+
+@bot.message_handler(commands=['sqlstats'])
+def sql_stats_command(message):
+    if message.from_user.id != ADMIN_ID:
+        return
+
+    # /sqlstats [count] [total|max|calls|busy] | /sqlstats reset
+    parts = message.text.split()[1:]
+    if parts and parts[0] == "reset":
+        sqlstats.SqlStats.reset()
+        outbound.reply_to(message, "✅ SQL stats reset")
+        return
+    limit = int(parts.pop(0)) if parts and parts[0].isdigit() else 10
+    order = {"total": "total_ms", "max": "max_ms", "calls": "calls", "busy": "busy"}.get(
+        parts[0] if parts else "total", "total_ms")
+    outbound.send_message(message.from_user.id, sqlstats.SqlStats.format_top(min(limit, 30), order))
 
 @bot.message_handler(commands=['addsub'])
 def add_subscription_command(message):
@@ -1120,7 +1041,7 @@ def add_subscription_command(message):
     try:
         parts = message.text.split()
         if len(parts) != 3:
-            bot.reply_to(message, "Usage: /addsub <user_id> <days>")
+            outbound.reply_to(message, "Usage: /addsub <user_id> <days>")
             return
 
         target_user_id = int(parts[1])
@@ -1128,14 +1049,14 @@ def add_subscription_command(message):
 
         ok = add_subscription(target_user_id, 2, days)
         if not ok:
-            bot.reply_to(message, "❌ Failed to add subscription")
+            outbound.reply_to(message, "❌ Failed to add subscription")
             return
 
-        bot.reply_to(message, f"✅ Subscription added for user {target_user_id} for {days} days")
+        outbound.reply_to(message, f"✅ Subscription added for user {target_user_id} for {days} days")
 
         # Notify user
         try:
-            bot.send_message(
+            outbound.send_message(
                 target_user_id,
                 f"""
 🎉 **SUBSCRIPTION ACTIVATED**
@@ -1152,54 +1073,251 @@ Admin has activated your subscription for {days} days!
 
     except Exception as e:
         logger.exception(f"/addsub failed: {e}")
-        bot.reply_to(message, f"❌ Error: {str(e)}")
+        outbound.reply_to(message, f"❌ Error: {str(e)}")
 
 # ==================== BACKGROUND TASKS ====================
 
+def _parse_expiry(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except Exception:
+        return datetime.fromisoformat(value)
+
+def expire_due_subscriptions(now=None):
+    """
+    Flip every due subscription to 'expired' in one set-based statement.
+    Returns the affected user ids (one transaction regardless of count).
+    expiry_date is written with local datetime.now(), so compare against the
+    same clock rather than SQLite's UTC datetime('now').
+    """
+    now = (now or datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
+    rows = Database.execute_query(
+        "UPDATE users SET status = 'expired' "
+        "WHERE expiry_date <= ? AND status = 'active' "
+        "RETURNING user_id",
+        (now,),
+        fetchall=True,
+        commit=True
+    )
+    return [r[0] for r in rows or []]
+
 def check_expired_subscriptions():
-    """Check for expired subscriptions periodically"""
-    while True:
+    """Expire every due subscription and queue the expiry notices."""
+    try:
+        expired_ids = expire_due_subscriptions()
+    except Exception as e:
+        logger.error(f"Error expiring subscriptions: {e}")
+        return []
+
+    if expired_ids:
+        logger.info(f"Expired {len(expired_ids)} subscriptions")
+        notify_expired_users(expired_ids)
+    return expired_ids
+
+class ExpiryScheduler:
+    """
+    Deadline-driven expiry: keeps the upcoming expiry times in a min-heap and
+    sleeps until the earliest one, instead of polling the users table.
+
+    Only deadlines inside the current horizon are held in memory; when the
+    horizon ends the heap is re-seeded with one indexed range query, which
+    also picks up subscriptions written by other processes.
+    """
+
+    def __init__(self, horizon=timedelta(hours=1)):
+        self.horizon = horizon
+        self._heap = []
+        self._cond = threading.Condition()
+        self._horizon_end = datetime.min
+        self._stop = False
+        # sweep stats: lag = how long after the earliest due deadline the sweep started
+        self.sweeps = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.last_sweep_seconds = 0.0
+        self.last_sweep_at = None
+
+    def seed(self):
+        """Load all active deadlines that fall before the next horizon end."""
+        now = datetime.now()
+        horizon_end = now + self.horizon
+        with self._cond:
+            # schedule() must keep accepting deadlines up to the new horizon
+            # while the SELECT runs, or ones committed after it are lost
+            self._horizon_end = max(self._horizon_end, horizon_end)
         try:
+            rows = Database.execute_query(
+                "SELECT user_id, expiry_date FROM users "
+                "WHERE status = 'active' AND expiry_date IS NOT NULL AND expiry_date <= ?",
+                (horizon_end.strftime('%Y-%m-%d %H:%M:%S'),),
+                fetchall=True
+            ) or []
+        except Exception as e:
+            logger.error(f"Failed to seed expiry scheduler: {e}")
+            rows = []
+
+        heap = []
+        for user_id, expiry in rows:
+            try:
+                heap.append((_parse_expiry(expiry), user_id))
+            except Exception:
+                logger.warning(f"Unparseable expiry_date for user {user_id}: {expiry!r}")
+
+        with self._cond:
+            # merge instead of replacing: entries pushed since the SELECT are
+            # only in the old heap
+            merged = set(heap)
+            merged.update(entry for entry in self._heap if entry[0] <= horizon_end)
+            heap = list(merged)
+            heapq.heapify(heap)
+            self._heap = heap
+            self._horizon_end = horizon_end
+            self._cond.notify()
+        logger.debug(f"Expiry scheduler seeded with {len(heap)} deadlines")
+
+    def schedule(self, user_id, expiry):
+        """Register a new/renewed deadline (call after writing expiry_date)."""
+        with self._cond:
+            if expiry > self._horizon_end:
+                return  # picked up by the next seed
+            heapq.heappush(self._heap, (expiry, user_id))
+            self._cond.notify()
+
+    def next_deadline(self):
+        with self._cond:
+            return self._heap[0][0] if self._heap else None
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+
+    def snapshot(self):
+        with self._cond:
+            pending = len(self._heap)
+        return {
+            "sweeps": self.sweeps,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+            "last_sweep_seconds": self.last_sweep_seconds,
+            "last_sweep_at": self.last_sweep_at,
+            "pending_deadlines": pending,
+        }
+
+    def _sweep(self, due=None):
+        started = datetime.now()
+        t0 = time.perf_counter()
+        check_expired_subscriptions()
+        self.last_sweep_seconds = time.perf_counter() - t0
+        self.last_sweep_at = time.time()
+        self.sweeps += 1
+        self.last_lag = max((started - due).total_seconds(), 0.0) if due else 0.0
+        self.max_lag = max(self.max_lag, self.last_lag)
+
+    def run(self):
+        """Thread target: sweep on startup, then wake exactly at each deadline."""
+        self._sweep()
+        self.seed()
+        while True:
+            with self._cond:
+                if self._stop:
+                    return
+                now = datetime.now()
+                wake_at = self._horizon_end
+                if self._heap and self._heap[0][0] < wake_at:
+                    wake_at = self._heap[0][0]
+                if wake_at > now:
+                    self._cond.wait((wake_at - now).total_seconds())
+                    continue
+                reseed = now >= self._horizon_end
+                due = self._heap[0][0] if self._heap and self._heap[0][0] <= now else None
+                # drop everything that is due; renewed users simply won't match the sweep
+                while self._heap and self._heap[0][0] <= now:
+                    heapq.heappop(self._heap)
             try:
-                expired_users = DatabaseManager.execute_query(
-                    "SELECT user_id FROM users WHERE expiry_date <= datetime('now') AND status = 'active'",
-                    fetchall=True
-                )
+                self._sweep(due)
+                if reseed:
+                    self.seed()
             except Exception as e:
-                logger.error(f"Error fetching expired users: {e}")
-                expired_users = []
-
-            for user in expired_users:
-                try:
-                    DatabaseManager.execute_query(
-                        "UPDATE users SET status = 'expired' WHERE user_id = ?",
-                        (user[0],),
-                        commit=True
-                    )
-                    try:
-                        bot.send_message(
-                            user[0],
-                            "⚠️ **SUBSCRIPTION EXPIRED**\n\nYour subscription has expired. Renew now to continue access!",
-                            reply_markup=main_menu(user[0])
-                        )
-                    except Exception as e:
-                        logger.error(f"Failed to notify user {user[0]}: {e}")
-                except Exception as e:
-                    logger.error(f"Failed to expire user {user[0]}: {e}")
-
-            time.sleep(300)  # Check every 5 minutes
+                logger.exception(f"Background task error: {e}")
+                time.sleep(60)
+
+expiry_scheduler = ExpiryScheduler()
+
+def notify_expired_users(user_ids):
+    """Hand expiry notices to the outbound queue (sent at Telegram's pace)."""
+    for uid in user_ids:
+        outbound.send_message(
+            uid,
+            "⚠️ **SUBSCRIPTION EXPIRED**\n\nYour subscription has expired. Renew now to continue access!",
+            reply_markup=main_menu(uid)
+        )
 
-        except Exception as e:
-            logger.exception(f"Background task error: {e}")
-            time.sleep(60)
+# ==================== METRICS ====================
+
+def start_metrics_server():
+    """Wire update pool, outbound queue, router, API and DB stats into /metrics."""
+    reg = metrics.REGISTRY
+    metrics.attach_router(callback_router)
+    metrics.instrument_telegram_api()
+    metrics.attach_sqlstats()
+
+    reg.gauge_fn("bot_update_queue_depth", "Updates waiting in the worker pool",
+                 lambda: update_pool.snapshot()["queued"])
+    reg.counter_fn("bot_updates_processed_total", "Updates processed by the worker pool",
+                   lambda: update_pool.snapshot()["processed"])
+    reg.counter_fn("bot_update_errors_total", "Updates whose handler raised",
+                   lambda: update_pool.snapshot()["errors"])
+    reg.gauge_fn("bot_worker_utilization", "Busy time / uptime of the worker pool",
+                 lambda: update_pool.snapshot()["utilization"])
+
+    reg.gauge_fn("outbound_pending_messages", "Messages queued or in flight",
+                 lambda: outbound.pending())
+    reg.counter_fn("outbound_messages_total", "Outbound messages by result",
+                   lambda: {k: outbound.snapshot()[k] for k in ("sent", "failed", "retried_429")},
+                   ("result",))
+
+    reg.gauge_fn("expiry_sweep_lag_seconds", "Delay between the earliest due expiry and its sweep",
+                 lambda: expiry_scheduler.last_lag)
+    reg.gauge_fn("expiry_sweep_max_lag_seconds", "Largest sweep lag since start",
+                 lambda: expiry_scheduler.max_lag)
+    reg.gauge_fn("expiry_sweep_duration_seconds", "Duration of the last expiry sweep",
+                 lambda: expiry_scheduler.last_sweep_seconds)
+    reg.gauge_fn("expiry_last_sweep_timestamp_seconds", "Unix time of the last expiry sweep",
+                 lambda: expiry_scheduler.last_sweep_at)
+    reg.counter_fn("expiry_sweeps_total", "Expiry sweeps run", lambda: expiry_scheduler.sweeps)
+    reg.gauge_fn("expiry_pending_deadlines", "Deadlines held by the expiry scheduler",
+                 lambda: expiry_scheduler.snapshot()["pending_deadlines"])
+
+    db_pool = Database.pool()
+    reg.gauge_fn("db_pool_connections", "Open pooled SQLite connections by state",
+                 lambda: {"in_use": db_pool.snapshot()["in_use"], "idle": db_pool.snapshot()["idle"]},
+                 ("state",))
+    reg.counter_fn("db_pool_checkouts_total", "Connections checked out of the pool",
+                   lambda: db_pool.snapshot()["checkouts"])
+    reg.counter_fn("db_pool_waits_total", "Checkouts that had to wait for a free connection",
+                   lambda: db_pool.snapshot()["waits"])
+    reg.counter_fn("db_pool_wait_seconds_total", "Time spent waiting for a pooled connection",
+                   lambda: db_pool.snapshot()["wait_seconds"])
+    reg.counter_fn("db_pool_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT",
+                   lambda: db_pool.snapshot()["timeouts"])
+
+    server = metrics.MetricsServer(METRICS_HOST, METRICS_PORT)
+    server.start()
+    return server
 
 # ==================== START BOT ====================
 
 if __name__ == "__main__":
     # Start background task
     import threading
-    bg_thread = threading.Thread(target=check_expired_subscriptions, daemon=True)
+    bg_thread = threading.Thread(target=expiry_scheduler.run, daemon=True)
     bg_thread.start()
+    outbound.start()
+    update_pool.start()
+    ActivityBuffer.start()
+    broadcaster.resume_pending()
+    metrics_server = start_metrics_server() if METRICS_PORT else None
 
     logger.info("=" * 50)
     logger.info("🤖 STREAMX SUBSCRIPTION BOT STARTED")
@@ -1211,12 +1329,33 @@ if __name__ == "__main__":
 
     try:
         bot_info = bot.get_me()
+        Config.set_bot_identity(bot_info)
         print(f"✅ Bot connected: @{bot_info.username}")
         print(f"✅ Bot name: {bot_info.first_name}")
         print("✅ Bot is now running...")
 
-        bot.infinity_polling(timeout=60, long_polling_timeout=60)
+        if BOT_MODE == "webhook":
+            webhook_server = WebhookServer(bot, WEBHOOK_URL, WEBHOOK_SECRET,
+                                           host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                                           ssl_cert=WEBHOOK_SSL_CERT, ssl_key=WEBHOOK_SSL_KEY,
+                                           upload_certificate=WEBHOOK_SSL_SELF_SIGNED)
+            webhook_server.register()
+            webhook_server.serve_forever()
+        else:
+            # getUpdates refuses to work while a webhook is set
+            bot.remove_webhook()
+            bot.infinity_polling(timeout=60, long_polling_timeout=60)
     except Exception as e:
         logger.exception(f"Bot connection error: {e}")
         print(f"❌ Bot failed to connect: {e}")
         print("Check your bot token in .env file")
+    finally:
+        # write buffered last_active timestamps and drain queued messages before exiting
+        update_pool.stop()
+        ActivityBuffer.stop()
+        broadcaster.stop()
+        outbound.stop()
+        if metrics_server:
+            metrics_server.shutdown()
+        Database.close_pool()
+        stop_logging()
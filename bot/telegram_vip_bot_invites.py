@@ -33,13 +33,63 @@ FALLBACK_AMOUNT = float(os.getenv("SUBS_AMOUNT","199"))
 
 VIP_TOPIC = "VIP"
 
+# --- DB connection ---
+# One long-lived connection shared by every helper (opened in main()).
+# aiosqlite runs it on a single worker thread, so statements are serialized;
+# _write_lock keeps each execute+commit pair from interleaving with another.
+_db: Optional[aiosqlite.Connection] = None
+_write_lock = asyncio.Lock()
+
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
+
+async def open_db() -> aiosqlite.Connection:
+    global _db
+    if _db is None:
+        d = os.path.dirname(DB_PATH)
+        if d and not os.path.exists(d):
+            os.makedirs(d, exist_ok=True)
+        _db = await aiosqlite.connect(DB_PATH)
+        for pragma in DB_PRAGMAS:
+            await _db.execute(pragma)
+    return _db
+
+async def close_db():
+    global _db
+    if _db is not None:
+        await _db.close()
+        _db = None
+
+async def get_db() -> aiosqlite.Connection:
+    return _db if _db is not None else await open_db()
+
+async def db_write(sql: str, params=()) -> int:
+    """Run one write statement and commit it. Returns lastrowid."""
+    db = await get_db()
+    async with _write_lock:
+        cur = await db.execute(sql, params)
+        await db.commit()
+        return cur.lastrowid
+
+async def db_fetchone(sql: str, params=()):
+    db = await get_db()
+    async with db.execute(sql, params) as cur:
+        return await cur.fetchone()
+
+async def db_fetchall(sql: str, params=()):
+    db = await get_db()
+    async with db.execute(sql, params) as cur:
+        return await cur.fetchall()
+
 # --- DB init ---
 async def init_db():
-    # create DB dir
-    d = os.path.dirname(DB_PATH)
-    if d and not os.path.exists(d):
-        os.makedirs(d, exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
+    db = await get_db()
+    async with _write_lock:
         await db.executescript("""
 CREATE TABLE IF NOT EXISTS topics ( name TEXT PRIMARY KEY );
 CREATE TABLE IF NOT EXISTS users ( user_id INTEGER PRIMARY KEY, first_name TEXT, username TEXT );
@@ -51,60 +101,80 @@ CREATE TABLE IF NOT EXISTS wallets ( symbol TEXT PRIMARY KEY, address TEXT );
 """)
         await db.commit()
 
+# --- settings / wallet cache ---
+# Payment screens read these on every message; they only change through the
+# admin /set_* commands, so keep them in memory and update them write-through.
+_settings_cache: dict = {}
+_wallets_cache: list = []
+_subs_amount: float = FALLBACK_AMOUNT
+
+def _parse_amount(val: Optional[str]) -> float:
+    return float(val) if (val and val.replace('.','',1).isdigit()) else FALLBACK_AMOUNT
+
+def _cache_setting(key: str, value: Optional[str]):
+    global _subs_amount
+    _settings_cache[key] = value
+    if key == "subs_amount":
+        _subs_amount = _parse_amount(value)
+
+def _cache_wallet(symbol: str, address: str):
+    global _wallets_cache
+    wallets = {w["symbol"]: w["address"] for w in _wallets_cache}
+    wallets[symbol] = address
+    _wallets_cache = [{"symbol": k, "address": v} for k, v in sorted(wallets.items())]
+
+async def load_settings_cache():
+    """Populate the cache from the DB (called once at startup)."""
+    global _wallets_cache
+    for key, value in await db_fetchall("SELECT key,value FROM settings"):
+        _cache_setting(key, value)
+    rows = await db_fetchall("SELECT symbol,address FROM wallets ORDER BY symbol")
+    _wallets_cache = [{"symbol": r[0], "address": r[1]} for r in rows]
+
+def cached_upi() -> str:
+    return _settings_cache.get("upi_id") or FALLBACK_UPI
+
+def cached_amount() -> float:
+    return _subs_amount
+
+def cached_wallets() -> list:
+    return _wallets_cache
+
 # --- helpers ---
 async def set_setting(key: str, value: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("INSERT INTO settings(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, value))
-        await db.commit()
+    await db_write("INSERT INTO settings(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, value))
+    _cache_setting(key, value)
 
 async def get_setting(key: str) -> Optional[str]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT value FROM settings WHERE key=?", (key,))
-        row = await cur.fetchone()
-        return row[0] if row else None
+    row = await db_fetchone("SELECT value FROM settings WHERE key=?", (key,))
+    return row[0] if row else None
 
 async def set_wallet(symbol: str, address: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("INSERT INTO wallets(symbol,address) VALUES(?,?) ON CONFLICT(symbol) DO UPDATE SET address=excluded.address", (symbol.upper(), address))
-        await db.commit()
+    await db_write("INSERT INTO wallets(symbol,address) VALUES(?,?) ON CONFLICT(symbol) DO UPDATE SET address=excluded.address", (symbol.upper(), address))
+    _cache_wallet(symbol.upper(), address)
 
 async def list_wallets():
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT symbol,address FROM wallets ORDER BY symbol")
-        rows = await cur.fetchall()
-        return [{"symbol": r[0], "address": r[1]} for r in rows]
+    rows = await db_fetchall("SELECT symbol,address FROM wallets ORDER BY symbol")
+    return [{"symbol": r[0], "address": r[1]} for r in rows]
 
 async def add_channel_for_topic(topic: str, chat_id_or_invite: str, description: str=""):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("INSERT OR IGNORE INTO channels(topic, chat_id_or_invite, description) VALUES(?,?,?)", (topic, chat_id_or_invite, description))
-        await db.commit()
+    await db_write("INSERT OR IGNORE INTO channels(topic, chat_id_or_invite, description) VALUES(?,?,?)", (topic, chat_id_or_invite, description))
 
 async def get_channels_for_topic(topic: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT chat_id_or_invite, description FROM channels WHERE topic=?", (topic,))
-        rows = await cur.fetchall()
-        return [{"link": r[0], "desc": r[1]} for r in rows]
+    rows = await db_fetchall("SELECT chat_id_or_invite, description FROM channels WHERE topic=?", (topic,))
+    return [{"link": r[0], "desc": r[1]} for r in rows]
 
 async def ensure_user(user_id:int, first_name:str, username:Optional[str]):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("INSERT OR REPLACE INTO users(user_id, first_name, username) VALUES(?,?,?)", (user_id, first_name, username))
-        await db.commit()
+    await db_write("INSERT OR REPLACE INTO users(user_id, first_name, username) VALUES(?,?,?)", (user_id, first_name, username))
 
 async def save_payment(user_id:int, method:str, amount:float, details:str, proof_file_id:Optional[str]):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("INSERT INTO payments (user_id, method, amount, details, proof_file_id, status) VALUES (?,?,?,?,?, 'pending')", (user_id, method, amount, details, proof_file_id))
-        await db.commit()
-        return cur.lastrowid
+    return await db_write("INSERT INTO payments (user_id, method, amount, details, proof_file_id, status) VALUES (?,?,?,?,?, 'pending')", (user_id, method, amount, details, proof_file_id))
 
 async def get_payment(pid:int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT id,user_id,method,amount,details,proof_file_id,status,created_at FROM payments WHERE id=?", (pid,))
-        return await cur.fetchone()
+    return await db_fetchone("SELECT id,user_id,method,amount,details,proof_file_id,status,created_at FROM payments WHERE id=?", (pid,))
 
 async def update_payment_status(pid:int, status:str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE payments SET status=? WHERE id=?", (status, pid))
-        await db.commit()
+    await db_write("UPDATE payments SET status=? WHERE id=?", (status, pid))
 
 # --- utils ---
 def is_admin(uid:int) -> bool:
@@ -131,10 +201,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(text)
 
 async def pay_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    upi = await get_setting("upi_id") or FALLBACK_UPI
-    amt_val = await get_setting("subs_amount")
-    amount = float(amt_val) if (amt_val and amt_val.replace('.','',1).isdigit()) else FALLBACK_AMOUNT
-    wallets = await list_wallets()
+    upi = cached_upi()
+    amount = cached_amount()
+    wallets = cached_wallets()
     text = f"Payment Details\n\nAmount: ₹{amount}\n\nUPI ID: `{upi}`\n\nCrypto wallets:\n"
     if wallets:
         for w in wallets:
@@ -151,14 +220,12 @@ async def cb_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     if q.data == "pay_upi":
-        upi = await get_setting("upi_id") or FALLBACK_UPI
-        amt_val = await get_setting("subs_amount")
-        amount = float(amt_val) if (amt_val and amt_val.replace('.','',1).isdigit()) else FALLBACK_AMOUNT
+        upi = cached_upi()
+        amount = cached_amount()
         await q.message.reply_text(f"Pay ₹{amount} to UPI ID: `{upi}`\nSend screenshot or UPI ref here.", parse_mode="Markdown")
     else:
-        amt_val = await get_setting("subs_amount")
-        amount = float(amt_val) if (amt_val and amt_val.replace('.','',1).isdigit()) else FALLBACK_AMOUNT
-        wallets = await list_wallets()
+        amount = cached_amount()
+        wallets = cached_wallets()
         if not wallets:
             await q.message.reply_text("No crypto wallets configured. Contact admin.")
             return
@@ -184,8 +251,7 @@ async def payment_proof_handler(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("Send screenshot or transaction id.")
         return
 
-    amt_val = await get_setting("subs_amount")
-    amount = float(amt_val) if (amt_val and amt_val.replace('.','',1).isdigit()) else FALLBACK_AMOUNT
+    amount = cached_amount()
 
     await ensure_user(user.id, user.first_name or "", user.username)
     pid = await save_payment(user.id, "manual", amount, details, file_id)
@@ -250,9 +316,7 @@ async def approve_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await update.message.reply_text("Already approved.")
     await update_payment_status(pid, "approved")
     # subscribe and send join buttons
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("INSERT OR IGNORE INTO subscriptions(user_id, topic) VALUES(?,?)", (uid, VIP_TOPIC))
-        await db.commit()
+    await db_write("INSERT OR IGNORE INTO subscriptions(user_id, topic) VALUES(?,?)", (uid, VIP_TOPIC))
 
     channels = await get_channels_for_topic(VIP_TOPIC)
     if not channels:
@@ -334,7 +398,7 @@ async def set_crypto_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def list_wallets_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return await update.message.reply_text("Only admin.")
-    w = await list_wallets()
+    w = cached_wallets()
     if not w:
         return await update.message.reply_text("No wallets configured.")
     text = "Wallets:\n" + "\n".join(f"- {x['symbol']}: {x['address']}" for x in w)
@@ -342,9 +406,7 @@ async def list_wallets_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def my_subs_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT topic FROM subscriptions WHERE user_id=? ORDER BY topic", (user.id,))
-        rows = await cur.fetchall()
+    rows = await db_fetchall("SELECT topic FROM subscriptions WHERE user_id=? ORDER BY topic", (user.id,))
     if not rows:
         await update.message.reply_text("You have no subscriptions.")
     else:
@@ -355,11 +417,11 @@ async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # bootstrap
 async def main():
+    await open_db()
     await init_db()
     # ensure VIP topic exists
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("INSERT OR IGNORE INTO topics(name) VALUES(?)", (VIP_TOPIC,))
-        await db.commit()
+    await db_write("INSERT OR IGNORE INTO topics(name) VALUES(?)", (VIP_TOPIC,))
+    await load_settings_cache()
 
     app = ApplicationBuilder().token(BOT_TOKEN).build()
     app.add_handler(CommandHandler("start", start))
@@ -380,7 +442,10 @@ async def main():
     app.add_handler(MessageHandler(filters.COMMAND, unknown))
 
     print("Bot starting (polling)...")
-    await app.run_polling()
+    try:
+        await app.run_polling()
+    finally:
+        await close_db()
 
 if __name__ == "__main__":
     asyncio.run(main())
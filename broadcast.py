@@ -0,0 +1,267 @@
+"""
+broadcast.py - Streaming, resumable admin broadcasts
+Recipients are read from `users` in keyset-paginated chunks (never the whole
+table), sent through the rate-limited OutboundQueue, and progress is
+checkpointed in the `broadcasts` table after every chunk so a restart
+resumes from the last finished chunk. A chunk that is not delivered within
+CHUNK_WAIT_TIMEOUT pauses the broadcast (status 'paused', shown in the
+progress message); /broadcast_resume <id> continues it from the checkpoint.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from repository import Database
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 200                # recipients read + checkpointed at a time
+PROGRESS_EDIT_INTERVAL = 3.0    # min seconds between progress message edits
+CHUNK_WAIT_TIMEOUT = 600.0      # give up waiting on a stuck chunk after this
+
+
+def ensure_broadcast_table(cursor):
+    """Create the broadcast checkpoint table (idempotent)."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_id INTEGER NOT NULL,
+        progress_message_id INTEGER,
+        text TEXT NOT NULL,
+        status TEXT DEFAULT 'running',
+        last_user_id INTEGER DEFAULT 0,
+        total INTEGER DEFAULT 0,
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP,
+        finished_at TIMESTAMP
+    )
+    ''')
+
+
+def _now() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class _ChunkTracker:
+    """Counts outbound callbacks for one chunk so the runner can wait for it."""
+
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.sent = 0
+        self.failed = 0
+        self._cond = threading.Condition()
+
+    def done(self, ok, _result):
+        with self._cond:
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self._cond.notify_all()
+
+    def wait(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.sent + self.failed < self.expected:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(min(remaining, 1.0))
+            return True
+
+
+class Broadcaster:
+    """
+    Runs broadcasts in background threads, one per broadcast.
+
+    Delivery is at-least-once: if the process dies mid-chunk, that chunk is
+    sent again on resume, so CHUNK_SIZE also bounds possible duplicates.
+    """
+
+    def __init__(self, bot, outbound, chunk_size: int = CHUNK_SIZE):
+        self.bot = bot
+        self.outbound = outbound
+        self.chunk_size = chunk_size
+        self._runs = {}             # broadcast_id -> (thread, stop event of that run)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    # ==================== PUBLIC API ====================
+
+    def start(self, admin_id: int, text: str) -> int:
+        """Create a broadcast row, post the progress message and start sending."""
+        with Database.get_cursor(immediate=True) as cursor:
+            ensure_broadcast_table(cursor)
+            total = cursor.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            cursor.execute('''
+            INSERT INTO broadcasts (admin_id, text, total, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ''', (admin_id, text, total, _now(), _now()))
+            broadcast_id = cursor.lastrowid
+
+        try:
+            msg = self.bot.send_message(admin_id, self._progress_text(broadcast_id, total, 0, 0, 'running'))
+            with Database.get_cursor() as cursor:
+                cursor.execute("UPDATE broadcasts SET progress_message_id = ? WHERE id = ?",
+                               (msg.message_id, broadcast_id))
+        except Exception as e:
+            logger.error(f"Broadcast {broadcast_id}: could not post progress message: {e}")
+
+        self._spawn(broadcast_id)
+        return broadcast_id
+
+    def resume_pending(self) -> int:
+        """Restart every broadcast left in 'running' state (call once at startup)."""
+        try:
+            with Database.get_cursor() as cursor:
+                ensure_broadcast_table(cursor)
+                ids = [r[0] for r in cursor.execute(
+                    "SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id").fetchall()]
+        except Exception as e:
+            logger.error(f"Failed to look up unfinished broadcasts: {e}")
+            return 0
+        for broadcast_id in ids:
+            logger.info(f"Resuming broadcast {broadcast_id}")
+            self._spawn(broadcast_id)
+        return len(ids)
+
+    def resume(self, broadcast_id: int) -> bool:
+        """Continue a paused broadcast from its checkpoint. Returns False if it isn't paused."""
+        with Database.get_cursor() as cursor:
+            cursor.execute(
+                "UPDATE broadcasts SET status = 'running', updated_at = ? WHERE id = ? AND status = 'paused'",
+                (_now(), broadcast_id))
+            if cursor.rowcount != 1:
+                return False
+        logger.info(f"Resuming paused broadcast {broadcast_id}")
+        self._spawn(broadcast_id)
+        return True
+
+    def stop(self, timeout: float = 5.0):
+        """Stop runners; an unfinished chunk is not checkpointed and is resent on resume."""
+        with self._lock:
+            # no new runs after shutdown, so a start racing with stop() can't escape it
+            self._closed = True
+            runs = list(self._runs.values())
+        for _, stop_event in runs:
+            stop_event.set()
+        for t, _ in runs:
+            t.join(timeout=timeout)
+
+    # ==================== RUNNER ====================
+
+    def _spawn(self, broadcast_id: int):
+        with self._lock:
+            if self._closed:
+                logger.warning(f"Broadcast {broadcast_id} not started: broadcaster is stopped")
+                return
+            run = self._runs.get(broadcast_id)
+            if run and run[0].is_alive():
+                return
+            stop_event = threading.Event()
+            t = threading.Thread(target=self._run, args=(broadcast_id, stop_event),
+                                 name=f"broadcast-{broadcast_id}", daemon=True)
+            self._runs[broadcast_id] = (t, stop_event)
+            t.start()
+
+    def _run(self, broadcast_id: int, stop_event: threading.Event):
+        try:
+            self._run_inner(broadcast_id, stop_event)
+        except Exception as e:
+            logger.exception(f"Broadcast {broadcast_id} crashed: {e}")
+        finally:
+            with self._lock:
+                if self._runs.get(broadcast_id, (None,))[0] is threading.current_thread():
+                    del self._runs[broadcast_id]
+
+    def _run_inner(self, broadcast_id: int, stop_event: threading.Event):
+        with Database.get_cursor() as cursor:
+            row = cursor.execute('''
+            SELECT admin_id, progress_message_id, text, last_user_id, total, sent, failed
+            FROM broadcasts WHERE id = ? AND status = 'running'
+            ''', (broadcast_id,)).fetchone()
+        if not row:
+            return
+        admin_id, progress_id, text, last_user_id, total, sent, failed = row
+        last_edit = 0.0
+
+        while not stop_event.is_set():
+            # keyset pagination: cost per chunk is independent of how far we got
+            with Database.get_cursor() as cursor:
+                chunk = [r[0] for r in cursor.execute(
+                    "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                    (last_user_id, self.chunk_size)).fetchall()]
+            if not chunk:
+                break
+
+            tracker = _ChunkTracker(len(chunk))
+            chunk_started = time.monotonic()
+            for uid in chunk:
+                self.outbound.send_message(uid, text, callback=tracker.done)
+            while not tracker.wait(1.0):
+                if stop_event.is_set():
+                    return
+                if time.monotonic() - chunk_started > CHUNK_WAIT_TIMEOUT:
+                    # keep the checkpoint before this chunk: resuming resends it
+                    logger.error(f"Broadcast {broadcast_id}: chunk after user {last_user_id} timed out, pausing")
+                    with Database.get_cursor() as cursor:
+                        cursor.execute("UPDATE broadcasts SET status = 'paused', updated_at = ? WHERE id = ?",
+                                       (_now(), broadcast_id))
+                    self._edit_progress(admin_id, progress_id, broadcast_id, total, sent, failed, 'paused')
+                    return
+
+            last_user_id = chunk[-1]
+            sent += tracker.sent
+            failed += tracker.failed
+            with Database.get_cursor() as cursor:
+                cursor.execute('''
+                UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, updated_at = ?
+                WHERE id = ?
+                ''', (last_user_id, sent, failed, _now(), broadcast_id))
+
+            if time.monotonic() - last_edit >= PROGRESS_EDIT_INTERVAL:
+                self._edit_progress(admin_id, progress_id, broadcast_id, total, sent, failed, 'running')
+                last_edit = time.monotonic()
+
+        if stop_event.is_set():
+            return
+        with Database.get_cursor() as cursor:
+            cursor.execute('''
+            UPDATE broadcasts SET status = 'done', finished_at = ?, updated_at = ?
+            WHERE id = ?
+            ''', (_now(), _now(), broadcast_id))
+        self._edit_progress(admin_id, progress_id, broadcast_id, total, sent, failed, 'done')
+        logger.info(f"Broadcast {broadcast_id} finished: {sent} sent, {failed} failed")
+
+    # ==================== PROGRESS ====================
+
+    @staticmethod
+    def _progress_text(broadcast_id: int, total: int, sent: int, failed: int, status: str) -> str:
+        remaining = max(total - sent - failed, 0)
+        title = {"done": "✅ Broadcast finished", "paused": "⏸ Broadcast paused"}.get(status, "📢 Broadcasting...")
+        text = (
+            f"{title} (#{broadcast_id})\n\n"
+            f"✅ Sent: {sent}\n"
+            f"❌ Failed: {failed}\n"
+            f"⏳ Remaining: {remaining}"
+        )
+        if status == 'paused':
+            text += f"\n\nMessages stopped going out. Continue with /broadcast_resume {broadcast_id}"
+        return text
+
+    def _edit_progress(self, admin_id: int, progress_id: Optional[int], broadcast_id: int,
+                       total: int, sent: int, failed: int, status: str):
+        if not progress_id:
+            return
+        try:
+            self.bot.edit_message_text(
+                self._progress_text(broadcast_id, total, sent, failed, status),
+                admin_id, progress_id
+            )
+        except Exception as e:
+            # "message is not modified" and similar are harmless here
+            logger.debug(f"Broadcast {broadcast_id}: progress edit failed: {e}")
@@ -1,6 +1,10 @@
 # config.py
 import os
-from typing import List, Dict, Any
+import time
+import logging
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
 
 
 class Config:
@@ -12,6 +16,15 @@ class Config:
     # ========== BOT SETTINGS ==========
     BOT_TOKEN: str = os.getenv("BOT_TOKEN", "").strip()
 
+    # Bot identity: BOT_USERNAME from env is only a fallback, the real values
+    # come from one get_me() call at startup (see load_bot_identity)
+    BOT_USERNAME: str = os.getenv("BOT_USERNAME", "").strip().lstrip("@")
+    BOT_ID: Optional[int] = None
+    BOT_NAME: str = ""
+    IDENTITY_RETRY_SECONDS: float = 60.0
+    _identity_loaded: bool = False
+    _identity_failed_at: Optional[float] = None
+
     # Admin IDs (CSV in env, e.g. "12345,67890")
     _admin_env = os.getenv("ADMIN_IDS", "6764548697").strip()
     # parse to ints, ignore empties and invalid entries
@@ -31,6 +44,37 @@ class Config:
 
     # ========== DATABASE SETTINGS ==========
     DATABASE_NAME: str = os.getenv("DATABASE_NAME", "subscriptions.db").strip()
+    # prepared statements cached per connection (sqlite3's default is 128);
+    # pooled connections are shared by bot.py, handlers.py and the workers
+    DB_STATEMENT_CACHE_SIZE: int = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+    # PRAGMA profile applied to every connection (see repository.SQLITE_PROFILES):
+    # "tuned" = synchronous=NORMAL under WAL + the cache/mmap/temp settings below,
+    # "default" = SQLite's own defaults (FULL sync, ~2 MB cache, no mmap)
+    DB_PROFILE: str = os.getenv("DB_PROFILE", "tuned").strip().lower()
+    DB_CACHE_SIZE_KB: int = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))          # page cache per connection
+    DB_MMAP_SIZE: int = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))   # bytes, 0 disables mmap
+    # DEFAULT | FILE | MEMORY. MEMORY measured slower for GROUP BY / ORDER BY temp
+    # b-trees (python benchmark.py sqlite), so it is opt-in
+    DB_TEMP_STORE: str = os.getenv("DB_TEMP_STORE", "DEFAULT").strip().upper()
+    # seconds between PRAGMA optimize runs on each long-lived connection (0 = only on close)
+    DB_OPTIMIZE_INTERVAL: float = float(os.getenv("DB_OPTIMIZE_INTERVAL", "3600"))
+    # connection pool (repository.ConnectionPool): open connections never exceed
+    # DB_POOL_SIZE however many threads handle updates; idle ones are closed
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "8"))
+    DB_POOL_IDLE_TIMEOUT: float = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+    DB_POOL_HEALTH_CHECK_AFTER: float = float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30"))  # idle seconds before SELECT 1
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))   # max wait for a free connection
+    # per-statement timing / slow-query log (see sqlstats.py); SQL_STATS=0 turns it off
+    SQL_STATS: bool = os.getenv("SQL_STATS", "1").strip().lower() not in ("0", "false", "no", "off")
+    SQL_SLOW_MS: float = float(os.getenv("SQL_SLOW_MS", "100"))
+
+    # ========== LOGGING SETTINGS ==========
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+    LOG_FILE: str = os.getenv("LOG_FILE", "bot.log").strip() or "bot.log"
+    LOG_MAX_BYTES: int = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    LOG_BACKUP_COUNT: int = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    # e.g. "midnight" or "H" to rotate by time instead of size (see TimedRotatingFileHandler)
+    LOG_ROTATE_WHEN: str = os.getenv("LOG_ROTATE_WHEN", "").strip()
 
     # ========== PAYMENT SETTINGS ==========
     UPI_ID: str = os.getenv("UPI_ID", "yourbusiness@oksbi").strip()
@@ -154,6 +198,42 @@ class Config:
             # fallback: return minimal instruction
             return Config.PAYMENT_INSTRUCTIONS["default"].format(method=method.upper(), amount=Config.format_currency(amount), user_id=user_id)
 
+    @staticmethod
+    def set_bot_identity(me) -> None:
+        """Store the result of bot.get_me()."""
+        Config.BOT_ID = me.id
+        Config.BOT_USERNAME = me.username or Config.BOT_USERNAME
+        Config.BOT_NAME = me.first_name or ""
+        Config._identity_loaded = True
+        Config._identity_failed_at = None
+
+    @staticmethod
+    def load_bot_identity(bot) -> bool:
+        """Fetch the bot's identity once; on failure keep the env fallback and retry later."""
+        try:
+            Config.set_bot_identity(bot.get_me())
+            return True
+        except Exception as e:
+            logger.error(f"get_me failed, using BOT_USERNAME fallback: {e}")
+            Config._identity_failed_at = time.monotonic()
+            return False
+
+    @staticmethod
+    def bot_username(bot=None) -> str:
+        """
+        Cached bot username. If startup lookup failed, retries get_me() at
+        most once per IDENTITY_RETRY_SECONDS (only when bot is passed).
+        """
+        if not Config._identity_loaded and bot is not None:
+            failed_at = Config._identity_failed_at
+            if failed_at is None or time.monotonic() - failed_at >= Config.IDENTITY_RETRY_SECONDS:
+                Config.load_bot_identity(bot)
+        return Config.BOT_USERNAME
+
+    @staticmethod
+    def referral_link(user_id: Any, bot=None) -> str:
+        return f"https://t.me/{Config.bot_username(bot)}?start=ref_{user_id}"
+
     @staticmethod
     def admins_list() -> List[int]:
         """Return list of admin ids."""
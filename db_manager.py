@@ -1,8 +1,7 @@
-import sqlite3
 import shutil
 from datetime import datetime
 
-DB = "subscriptions.db"
+from repository import DB_PATH as DB, Database, bump_plan_catalog_version
 
 print("===== SQLITE DATA MANAGER =====")
 
@@ -12,7 +11,7 @@ shutil.copyfile(DB, backup)
 print(f"📌 Backup created: {backup}\n")
 
 # --- CONNECT DB ---
-conn = sqlite3.connect(DB)
+conn = Database.connect(DB)
 cur = conn.cursor()
 
 print("आप क्या करना चाहते हैं?\n")
@@ -41,6 +40,7 @@ try:
         cur.execute("DELETE FROM users")
         cur.execute("DELETE FROM payments")
         cur.execute("DELETE FROM plans")
+        bump_plan_catalog_version(cur)
         print("🧹 Full database reset (tables cleared)!")
 
     elif choice == "5":
@@ -8,6 +8,9 @@ from datetime import datetime, timedelta
 from telebot.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from config import Config
 from keyboards import Keyboards
+from outbound import OutboundQueue
+from router import CallbackRouter, CallbackContext
+from repository import Database, create_payment, read_stats_counters
 import utils
 
 logger = logging.getLogger(__name__)
@@ -17,73 +20,58 @@ class CallbackHandlers:
     def __init__(self, bot):
         """
         Do NOT store a long-lived DB connection here.
-        Use DatabaseUtils.get_cursor() for each DB operation.
+        Use Database.get_cursor() for each DB operation.
         """
         self.bot = bot
+        # outgoing messages share the bot's rate-limited queue
+        self.outbound = OutboundQueue.for_bot(bot)
+        self.router = self._build_router()
+
+    def _build_router(self) -> CallbackRouter:
+        """Map callback_data to handler methods (exact values first, then prefixes)."""
+        def screen(fn):
+            # adapt (user_id, chat_id, message_id[, arg]) handlers to router routes
+            return lambda ctx, *arg: fn(ctx.user_id, ctx.chat_id, ctx.message_id, *arg)
+
+        def with_call(fn):
+            return lambda ctx, *arg: fn(ctx.call)
+
+        router = CallbackRouter()
+        screens = {
+            "main_menu": self._handle_main_menu,
+            "view_plans": self._handle_view_plans,
+            "my_subscription": self._handle_my_subscription,
+            "payment_methods": self._handle_payment_methods,
+            "contact_support": self._handle_contact_support,
+            "how_to_use": self._handle_how_to_use,
+            "refer_earn": self._handle_refer_earn,
+            "check_access": self._handle_check_access,
+            "admin_panel": self._handle_admin_panel,
+            "join_channel": self._handle_join_channel,
+            "get_invite": self._handle_get_invite,
+        }
+        for data, fn in screens.items():
+            router.add_exact(data, screen(fn))
+
+        router.add_prefix("plan_", screen(self._handle_plan_select), parse=int)
+        router.add_prefix("buy_", screen(self._handle_buy_plan), parse=int)
+        router.add_prefix("pay_", with_call(self._handle_payment_method))
+        router.add_prefix("confirm_", with_call(self._handle_payment_confirmation))
+        router.add_prefix("admin_", with_call(self._handle_admin_actions))
+        router.add_prefix("delchan:", with_call(self._handle_admin_actions))
+        return router
 
     def handle_callback(self, call: CallbackQuery):
         """Main callback handler - routes to specific handlers"""
         user_id = call.from_user.id
-        chat_id = call.message.chat.id
-        message_id = call.message.message_id
         callback_data = call.data
 
         try:
             # Update user activity
             self._update_user_activity(user_id)
 
-            # Route callback based on data
-            if callback_data == "main_menu":
-                self._handle_main_menu(user_id, chat_id, message_id)
-
-            elif callback_data == "view_plans":
-                self._handle_view_plans(user_id, chat_id, message_id)
-
-            elif callback_data.startswith("plan_"):
-                plan_id = int(callback_data.split("_")[1])
-                self._handle_plan_select(user_id, chat_id, message_id, plan_id)
-
-            elif callback_data.startswith("buy_"):
-                plan_id = int(callback_data.split("_")[1])
-                self._handle_buy_plan(user_id, chat_id, message_id, plan_id)
-
-            elif callback_data.startswith("pay_"):
-                self._handle_payment_method(call)
-
-            elif callback_data.startswith("confirm_"):
-                self._handle_payment_confirmation(call)
-
-            elif callback_data == "my_subscription":
-                self._handle_my_subscription(user_id, chat_id, message_id)
-
-            elif callback_data == "payment_methods":
-                self._handle_payment_methods(user_id, chat_id, message_id)
-
-            elif callback_data == "contact_support":
-                self._handle_contact_support(user_id, chat_id, message_id)
-
-            elif callback_data == "how_to_use":
-                self._handle_how_to_use(user_id, chat_id, message_id)
-
-            elif callback_data == "refer_earn":
-                self._handle_refer_earn(user_id, chat_id, message_id)
-
-            elif callback_data == "check_access":
-                self._handle_check_access(user_id, chat_id, message_id)
-
-            elif callback_data == "admin_panel":
-                self._handle_admin_panel(user_id, chat_id, message_id)
-
-            elif callback_data.startswith("admin_") or callback_data.startswith("delchan:"):
-                self._handle_admin_actions(call)
-
-            elif callback_data == "join_channel":
-                self._handle_join_channel(user_id, chat_id, message_id)
-
-            elif callback_data == "get_invite":
-                self._handle_get_invite(user_id, chat_id, message_id)
-
-            else:
+            # Route callback based on data (dict lookup, see _build_router)
+            if not self.router.dispatch(callback_data, CallbackContext.from_call(call)):
                 # Unknown callback
                 self.bot.answer_callback_query(call.id, "Unknown command")
 
@@ -93,18 +81,14 @@ class CallbackHandlers:
                 self.bot.answer_callback_query(call.id, "❌ An error occurred!")
             except Exception:
                 # fallback: send message
-                self.bot.send_message(user_id, "❌ An error occurred while processing your request.")
+                self.outbound.send_message(user_id, "❌ An error occurred while processing your request.")
 
     # ==================== PRIVATE HANDLER METHODS ====================
 
     def _update_user_activity(self, user_id):
-        """Update user's last active timestamp (per-operation connection)"""
+        """Buffer user's last active timestamp (flushed in batches by ActivityBuffer)"""
         try:
-            with utils.DatabaseUtils.get_cursor() as cursor:
-                cursor.execute(
-                    "UPDATE users SET last_active = ? WHERE user_id = ?",
-                    (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), user_id)
-                )
+            utils.ActivityBuffer.touch(user_id)
         except Exception:
             logger.exception("Failed to update user activity")
 
@@ -122,22 +106,14 @@ class CallbackHandlers:
     def _handle_view_plans(self, user_id, chat_id, message_id):
         """Show all subscription plans"""
         try:
-            with utils.DatabaseUtils.get_cursor() as cursor:
-                cursor.execute("SELECT * FROM plans WHERE is_active = 1 ORDER BY price")
-                plans = cursor.fetchall()
+            plans = utils.PlanCatalog.all(active_only=True)
 
             if not plans:
                 text = "❌ No plans available at the moment."
                 keyboard = Keyboards.back_to_menu()
             else:
-                text = "📋 *AVAILABLE SUBSCRIPTION PLANS*\n\n"
-                for plan in plans:
-                    text += f"✨ *{plan['name']}*\n"
-                    text += f"💰 Price: ₹{plan['price']}\n"
-                    text += f"⏰ Duration: {plan['duration_days']} days\n"
-                    text += f"📝 {plan['description']}\n"
-                    text += "────────────────────\n"
-
+                text = utils.PlanCatalog.rendered(
+                    "handlers.view_plans", lambda: self._render_plan_list(utils.PlanCatalog.all(active_only=True)))
                 keyboard = Keyboards.plans_list(plans)
 
             self.bot.edit_message_text(
@@ -149,21 +125,25 @@ class CallbackHandlers:
             )
         except Exception:
             logger.exception("Failed to show plans")
-            self.bot.send_message(chat_id, "❌ Could not load plans. Try again later.")
-
-    def _handle_plan_select(self, user_id, chat_id, message_id, plan_id):
-        """Handle plan selection"""
-        try:
-            with utils.DatabaseUtils.get_cursor() as cursor:
-                cursor.execute("SELECT * FROM plans WHERE id = ?", (plan_id,))
-                plan = cursor.fetchone()
-
-            if not plan:
-                # fallback: send message to user
-                self.bot.send_message(chat_id, "Plan not found!")
-                return
+            self.outbound.send_message(chat_id, "❌ Could not load plans. Try again later.")
+
+    # Plan screens depend only on catalog data, so they are rendered once per
+    # catalog version (utils.PlanCatalog.rendered) and then reused.
+
+    @staticmethod
+    def _render_plan_list(plans):
+        return "📋 *AVAILABLE SUBSCRIPTION PLANS*\n\n" + "".join(
+            f"✨ *{plan['name']}*\n"
+            f"💰 Price: ₹{plan['price']}\n"
+            f"⏰ Duration: {plan['duration_days']} days\n"
+            f"📝 {plan['description']}\n"
+            "────────────────────\n"
+            for plan in plans
+        )
 
-            text = f"""
+    @staticmethod
+    def _render_plan_details(plan):
+        return f"""
 🎯 *SELECTED PLAN*
 
 ✨ *{plan['name']}*
@@ -180,6 +160,27 @@ class CallbackHandlers:
 👇 *Click BUY NOW to proceed*
             """
 
+    @staticmethod
+    def _render_plan_payment(plan):
+        return f"""
+💳 *PAYMENT FOR {plan['name']}*
+
+💰 *Amount:* ₹{plan['price']}
+⏰ *Duration:* {plan['duration_days']} days
+
+*Select payment method:*
+            """
+
+    def _handle_plan_select(self, user_id, chat_id, message_id, plan_id):
+        """Handle plan selection"""
+        try:
+            text = utils.PlanCatalog.rendered(("handlers.plan", plan_id), self._render_plan_details, plan_id)
+
+            if text is None:
+                # fallback: send message to user
+                self.outbound.send_message(chat_id, "Plan not found!")
+                return
+
             self.bot.edit_message_text(
                 chat_id=chat_id,
                 message_id=message_id,
@@ -189,28 +190,17 @@ class CallbackHandlers:
             )
         except Exception:
             logger.exception("Failed in plan select")
-            self.bot.send_message(chat_id, "❌ Something went wrong while selecting plan.")
+            self.outbound.send_message(chat_id, "❌ Something went wrong while selecting plan.")
 
     def _handle_buy_plan(self, user_id, chat_id, message_id, plan_id):
         """Initiate purchase process"""
         try:
-            with utils.DatabaseUtils.get_cursor() as cursor:
-                cursor.execute("SELECT * FROM plans WHERE id = ?", (plan_id,))
-                plan = cursor.fetchone()
+            text = utils.PlanCatalog.rendered(("handlers.buy", plan_id), self._render_plan_payment, plan_id)
 
-            if not plan:
-                self.bot.send_message(chat_id, "Plan not found!")
+            if text is None:
+                self.outbound.send_message(chat_id, "Plan not found!")
                 return
 
-            text = f"""
-💳 *PAYMENT FOR {plan['name']}*
-
-💰 *Amount:* ₹{plan['price']}
-⏰ *Duration:* {plan['duration_days']} days
-
-*Select payment method:*
-            """
-
             self.bot.edit_message_text(
                 chat_id=chat_id,
                 message_id=message_id,
@@ -220,7 +210,7 @@ class CallbackHandlers:
             )
         except Exception:
             logger.exception("Failed to start buy process")
-            self.bot.send_message(chat_id, "❌ Could not start purchase. Try again later.")
+            self.outbound.send_message(chat_id, "❌ Could not start purchase. Try again later.")
 
     def _handle_payment_method(self, call: CallbackQuery):
         """Handle payment method selection"""
@@ -236,19 +226,17 @@ class CallbackHandlers:
             try:
                 self.bot.answer_callback_query(call.id, "Please select a plan first!")
             except Exception:
-                self.bot.send_message(chat_id, "Please select a plan first!")
+                self.outbound.send_message(chat_id, "Please select a plan first!")
             return
 
         try:
-            with utils.DatabaseUtils.get_cursor() as cursor:
-                cursor.execute("SELECT * FROM plans WHERE id = ?", (plan_id,))
-                plan = cursor.fetchone()
+            plan = utils.PlanCatalog.get(plan_id)
 
             if not plan:
                 try:
                     self.bot.answer_callback_query(call.id, "Plan not found!")
                 except Exception:
-                    self.bot.send_message(chat_id, "Plan not found!")
+                    self.outbound.send_message(chat_id, "Plan not found!")
                 return
 
             if payment_method == "upi":
@@ -286,7 +274,7 @@ class CallbackHandlers:
             try:
                 self.bot.answer_callback_query(call.id, "❌ Something went wrong.")
             except Exception:
-                self.bot.send_message(chat_id, "❌ Something went wrong.")
+                self.outbound.send_message(chat_id, "❌ Something went wrong.")
 
     def _handle_payment_confirmation(self, call: CallbackQuery):
         """Handle payment confirmation"""
@@ -299,28 +287,15 @@ class CallbackHandlers:
         plan_id = int(parts[2])
 
         try:
-            with utils.DatabaseUtils.get_cursor() as cursor:
-                cursor.execute("SELECT * FROM plans WHERE id = ?", (plan_id,))
-                plan = cursor.fetchone()
-
-                if not plan:
-                    try:
-                        self.bot.answer_callback_query(call.id, "Plan not found!")
-                    except Exception:
-                        self.bot.send_message(chat_id, "Plan not found!")
-                    return
-
-                payment_data = (
-                    user_id, plan_id, plan['price'], plan.get('currency', 'INR'),
-                    payment_method, 'pending', datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                )
-
-                cursor.execute('''
-                INSERT INTO payments (user_id, plan_id, amount, currency, payment_method, status, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', payment_data)
+            plan = utils.PlanCatalog.get(plan_id)
+            if not plan:
+                try:
+                    self.bot.answer_callback_query(call.id, "Plan not found!")
+                except Exception:
+                    self.outbound.send_message(chat_id, "Plan not found!")
+                return
 
-                payment_id = cursor.lastrowid
+            payment_id = create_payment(user_id, plan_id, plan['price'], payment_method, plan.get('currency', 'INR'))
 
             # Notify admin (outside DB transaction)
             try:
@@ -361,23 +336,23 @@ You'll receive a notification once approved.
             try:
                 self.bot.answer_callback_query(call.id, "❌ Failed to submit payment.")
             except Exception:
-                self.bot.send_message(chat_id, "❌ Failed to submit payment.")
+                self.outbound.send_message(chat_id, "❌ Failed to submit payment.")
 
     def _handle_my_subscription(self, user_id, chat_id, message_id):
         """Show user's subscription status"""
         try:
-            with utils.DatabaseUtils.get_cursor() as cursor:
+            with Database.get_cursor() as cursor:
                 cursor.execute(
-                    "SELECT plan_type, subscription_end, status FROM users WHERE user_id = ?",
+                    "SELECT plan, expiry_date, status FROM users WHERE user_id = ?",
                     (user_id,)
                 )
                 user = cursor.fetchone()
 
-            if user and user['subscription_end']:
+            if user and user['expiry_date']:
                 try:
-                    expiry_date = datetime.strptime(user['subscription_end'], '%Y-%m-%d %H:%M:%S')
+                    expiry_date = datetime.strptime(user['expiry_date'], '%Y-%m-%d %H:%M:%S')
                 except Exception:
-                    expiry_date = datetime.fromisoformat(user['subscription_end'])
+                    expiry_date = datetime.fromisoformat(user['expiry_date'])
                 days_left = (expiry_date - datetime.now()).days
 
                 if days_left > 0:
@@ -390,7 +365,7 @@ You'll receive a notification once approved.
                 text = f"""
 🔍 *MY SUBSCRIPTION*
 
-📅 *Plan:* {user['plan_type']}
+📅 *Plan:* {user['plan']}
 📆 *Expiry:* {expiry_date.strftime('%d %b %Y')}
 ⏳ *Status:* {status}
 📝 *Note:* {status_desc}
@@ -404,7 +379,7 @@ You don't have an active subscription.
 👇 *Click below to view plans and subscribe!*
                 """
 
-            has_access = bool(user and user['subscription_end'] and (days_left > 0 if user and user['subscription_end'] else False))
+            has_access = bool(user and user['expiry_date'] and (days_left > 0 if user and user['expiry_date'] else False))
             keyboard = Keyboards.subscription_status(has_access)
 
             self.bot.edit_message_text(
@@ -416,7 +391,7 @@ You don't have an active subscription.
             )
         except Exception:
             logger.exception("Failed to fetch subscription")
-            self.bot.send_message(chat_id, "❌ Could not fetch subscription status.")
+            self.outbound.send_message(chat_id, "❌ Could not fetch subscription status.")
 
     def _handle_payment_methods(self, user_id, chat_id, message_id):
         """Show payment methods info"""
@@ -512,12 +487,12 @@ For any queries regarding:
     def _handle_refer_earn(self, user_id, chat_id, message_id):
         """Show referral program"""
         try:
-            with utils.DatabaseUtils.get_cursor() as cursor:
+            with Database.get_cursor() as cursor:
                 cursor.execute("SELECT COUNT(*) as referrals, COALESCE(SUM(commission),0) as earnings FROM referrals WHERE referrer_id = ?", (user_id,))
                 stats_row = cursor.fetchone()
                 stats = {'referrals': stats_row['referrals'] or 0, 'earnings': stats_row['earnings'] or 0}
 
-            referral_link = f"https://t.me/{Config.BOT_USERNAME}?start=ref_{user_id}"
+            referral_link = Config.referral_link(user_id, self.bot)
 
             text = f"""
 🎁 *REFER & EARN PROGRAM*
@@ -549,12 +524,12 @@ For any queries regarding:
             )
         except Exception:
             logger.exception("Failed to fetch referral stats")
-            self.bot.send_message(chat_id, "❌ Could not fetch referral stats.")
+            self.outbound.send_message(chat_id, "❌ Could not fetch referral stats.")
 
     def _handle_check_access(self, user_id, chat_id, message_id):
         """Check and grant channel access"""
         try:
-            with utils.DatabaseUtils.get_cursor() as cursor:
+            with Database.get_cursor() as cursor:
                 has_access = utils.check_subscription_status(user_id, cursor)
         except Exception:
             logger.exception("Failed to check access")
@@ -596,20 +571,17 @@ Subscribe now to get access to premium content!
             try:
                 self.bot.answer_callback_query(None, "⛔ Unauthorized!")
             except Exception:
-                self.bot.send_message(chat_id, "⛔ Unauthorized!")
+                self.outbound.send_message(chat_id, "⛔ Unauthorized!")
             return
 
         # gather stats
         try:
-            with utils.DatabaseUtils.get_cursor() as cursor:
-                cursor.execute("SELECT COUNT(*) FROM users")
-                total_users = cursor.fetchone()[0]
-
-                cursor.execute("SELECT COUNT(*) FROM users WHERE subscription_end > datetime('now')")
-                active_subs = cursor.fetchone()[0]
-
-                cursor.execute("SELECT COUNT(*) FROM payments WHERE status = 'pending'")
-                pending_payments = cursor.fetchone()[0]
+            with Database.get_cursor() as cursor:
+                # precomputed by triggers, no table scans
+                stats = read_stats_counters(cursor)
+            total_users = stats["total_users"]
+            active_subs = stats["active_subs"]
+            pending_payments = stats["pending_payments"]
         except Exception:
             logger.exception("Failed to load admin stats")
             total_users = active_subs = pending_payments = 0
@@ -657,7 +629,7 @@ Subscribe now to get access to premium content!
             try:
                 self.bot.answer_callback_query(call.id, "⛔ Unauthorized!")
             except Exception:
-                self.bot.send_message(user_id, "⛔ Unauthorized!")
+                self.outbound.send_message(user_id, "⛔ Unauthorized!")
             return
 
         # Admin: list channels
@@ -668,7 +640,7 @@ Subscribe now to get access to premium content!
                     try:
                         self.bot.answer_callback_query(call.id, "No channels saved.")
                     except Exception:
-                        self.bot.send_message(user_id, "No channels saved.")
+                        self.outbound.send_message(user_id, "No channels saved.")
                     return
 
                 kb = InlineKeyboardMarkup()
@@ -687,13 +659,13 @@ Subscribe now to get access to premium content!
                                                reply_markup=kb)
                     self.bot.answer_callback_query(call.id, "Channels listed")
                 except Exception:
-                    self.bot.send_message(user_id, "Channels:\n" + "\n".join(f"{c[1]} — {c[2] or ''}" for c in channels))
+                    self.outbound.send_message(user_id, "Channels:\n" + "\n".join(f"{c[1]} — {c[2] or ''}" for c in channels))
             except Exception:
                 logger.exception("Failed to list channels")
                 try:
                     self.bot.answer_callback_query(call.id, "Failed to load channels.")
                 except Exception:
-                    self.bot.send_message(user_id, "Failed to load channels.")
+                    self.outbound.send_message(user_id, "Failed to load channels.")
 
             return
 
@@ -706,7 +678,7 @@ Subscribe now to get access to premium content!
                     try:
                         self.bot.answer_callback_query(call.id, f"Removed {channel_id}")
                     except Exception:
-                        self.bot.send_message(user_id, f"Removed {channel_id}")
+                        self.outbound.send_message(user_id, f"Removed {channel_id}")
                     # Optionally edit the message to reflect deletion
                     try:
                         # reload list
@@ -728,13 +700,13 @@ Subscribe now to get access to premium content!
                     try:
                         self.bot.answer_callback_query(call.id, "Channel not found or could not be removed.")
                     except Exception:
-                        self.bot.send_message(user_id, "Channel not found or could not be removed.")
+                        self.outbound.send_message(user_id, "Channel not found or could not be removed.")
             except Exception:
                 logger.exception("Failed to remove channel")
                 try:
                     self.bot.answer_callback_query(call.id, "Failed to remove channel.")
                 except Exception:
-                    self.bot.send_message(user_id, "Failed to remove channel.")
+                    self.outbound.send_message(user_id, "Failed to remove channel.")
             return
 
         # Admin: add channel prompt
@@ -744,14 +716,14 @@ Subscribe now to get access to premium content!
             try:
                 self.bot.answer_callback_query(call.id, "Use /addchannel <@channel_or_id> [title] to add a channel.")
             except Exception:
-                self.bot.send_message(user_id, "Use /addchannel <@channel_or_id> [title] to add a channel.")
+                self.outbound.send_message(user_id, "Use /addchannel <@channel_or_id> [title] to add a channel.")
             return
 
         # fallback for other admin_ actions
         try:
             self.bot.answer_callback_query(call.id, "Admin feature under development")
         except Exception:
-            self.bot.send_message(user_id, "Admin feature under development")
+            self.outbound.send_message(user_id, "Admin feature under development")
 
     def _handle_join_channel(self, user_id, chat_id, message_id):
         """Provide channel join link"""
@@ -779,7 +751,7 @@ Click the button below to join:
     def _handle_get_invite(self, user_id, chat_id, message_id):
         """Get personal invite link"""
         try:
-            with utils.DatabaseUtils.get_cursor() as cursor:
+            with Database.get_cursor() as cursor:
                 has_access = utils.check_subscription_status(user_id, cursor)
         except Exception:
             logger.exception("Failed to check invite access")
@@ -816,7 +788,7 @@ Subscribe now to get access!
         """Notify all admins about new payment"""
         for admin_id in Config.ADMIN_IDS:
             try:
-                self.bot.send_message(
+                self.outbound.send_message(
                     admin_id,
                     f"⚠️ *NEW PAYMENT REQUEST*\n\n"
                     f"*User ID:* `{user_id}`\n"
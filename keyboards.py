@@ -1,15 +1,72 @@
 """
 All inline keyboard templates for the subscription bot
+Markups are built once per variant and cached as serialized JSON, which
+telebot sends as-is (pass the string straight to reply_markup).
 """
 
+import threading
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 from config import Config
 
+
+# ================== SERIALIZED MARKUP CACHE ==================
+
+MARKUP_CACHE_MAX = 1024
+
+_markup_cache = {}
+_markup_cache_lock = threading.Lock()
+
+def cached_markup(key, build):
+    """
+    Return build().to_json(), building it only the first time key is seen.
+    key must capture everything the markup depends on (plan id, admin flag,
+    plan list contents, ...).
+    """
+    payload = _markup_cache.get(key)
+    if payload is None:
+        payload = build().to_json()
+        with _markup_cache_lock:
+            # keys can come from callback data, so don't let the cache grow unbounded
+            if len(_markup_cache) >= MARKUP_CACHE_MAX:
+                _markup_cache.clear()
+            _markup_cache[key] = payload
+    return payload
+
+def clear_markup_cache():
+    with _markup_cache_lock:
+        _markup_cache.clear()
+
+def rows_markup(key, *rows):
+    """
+    Cached markup from rows of (text, target) pairs; target is callback_data,
+    or a URL if it starts with http(s)://.
+    """
+    def build():
+        keyboard = InlineKeyboardMarkup()
+        for row in rows:
+            keyboard.row(*[
+                InlineKeyboardButton(text, url=target) if target.startswith(("http://", "https://"))
+                else InlineKeyboardButton(text, callback_data=target)
+                for text, target in row
+            ])
+        return keyboard
+    return cached_markup(key, build)
+
+def plans_cache_key(plans, days_key="duration_days"):
+    """Cache key for a plan-list keyboard: changes whenever a shown field does."""
+    return tuple((p['id'], p['name'], p['price'], p[days_key]) for p in plans)
+
+
 class Keyboards:
     
     @staticmethod
     def main_menu(user_id=None):
         """Main menu keyboard"""
+        is_admin = bool(user_id and Config.is_admin(user_id))
+        return cached_markup(("main_menu", is_admin), lambda: Keyboards._build_main_menu(is_admin))
+
+    @staticmethod
+    def _build_main_menu(is_admin):
         keyboard = InlineKeyboardMarkup(row_width=getattr(Config, "BUTTONS_PER_ROW", 2))
         
         buttons = [
@@ -33,7 +90,7 @@ class Keyboards:
             keyboard.add(*row_buttons)
         
         # Add admin button if user is admin
-        if user_id and Config.is_admin(user_id):
+        if is_admin:
             keyboard.add(InlineKeyboardButton("👑 Admin Panel", callback_data="admin_panel"))
         
         return keyboard
@@ -44,6 +101,11 @@ class Keyboards:
     @staticmethod
     def plans_list(plans_data):
         """Keyboard showing all subscription plans"""
+        return cached_markup(("plans_list", plans_cache_key(plans_data)),
+                             lambda: Keyboards._build_plans_list(plans_data))
+
+    @staticmethod
+    def _build_plans_list(plans_data):
         keyboard = InlineKeyboardMarkup(row_width=1)
         
         for plan in plans_data:
@@ -66,6 +128,10 @@ class Keyboards:
     @staticmethod
     def plan_details(plan_id):
         """After selecting a plan"""
+        return cached_markup(("plan_details", plan_id), lambda: Keyboards._build_plan_details(plan_id))
+
+    @staticmethod
+    def _build_plan_details(plan_id):
         keyboard = InlineKeyboardMarkup(row_width=2)
         
         keyboard.row(
@@ -84,6 +150,10 @@ class Keyboards:
     @staticmethod
     def payment_methods(plan_id=None):
         """Payment methods selection"""
+        return cached_markup(("payment_methods", plan_id), lambda: Keyboards._build_payment_methods(plan_id))
+
+    @staticmethod
+    def _build_payment_methods(plan_id):
         keyboard = InlineKeyboardMarkup(row_width=2)
         
         methods = [
@@ -110,6 +180,11 @@ class Keyboards:
     @staticmethod
     def payment_confirmation(plan_id, payment_method):
         """Confirm payment made"""
+        return cached_markup(("payment_confirmation", plan_id, payment_method),
+                             lambda: Keyboards._build_payment_confirmation(plan_id, payment_method))
+
+    @staticmethod
+    def _build_payment_confirmation(plan_id, payment_method):
         keyboard = InlineKeyboardMarkup(row_width=2)
         
         keyboard.row(
@@ -127,6 +202,12 @@ class Keyboards:
 
     @staticmethod
     def subscription_status(has_access):
+        has_access = bool(has_access)
+        return cached_markup(("subscription_status", has_access),
+                             lambda: Keyboards._build_subscription_status(has_access))
+
+    @staticmethod
+    def _build_subscription_status(has_access):
         keyboard = InlineKeyboardMarkup(row_width=2)
 
         if has_access:
@@ -150,6 +231,10 @@ class Keyboards:
     @staticmethod
     def admin_panel():
         """Admin control panel"""
+        return cached_markup("admin_panel", Keyboards._build_admin_panel)
+
+    @staticmethod
+    def _build_admin_panel():
         keyboard = InlineKeyboardMarkup(row_width=2)
         
         admin_buttons = [
@@ -211,6 +296,10 @@ class Keyboards:
 
     @staticmethod
     def back_button(back_to="main_menu"):
+        return cached_markup(("back_button", back_to), lambda: Keyboards._build_back_button(back_to))
+
+    @staticmethod
+    def _build_back_button(back_to):
         keyboard = InlineKeyboardMarkup()
         keyboard.add(InlineKeyboardButton("🔙 Back", callback_data=back_to))
         return keyboard
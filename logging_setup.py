@@ -0,0 +1,100 @@
+"""
+logging_setup.py - Non-blocking logging with rotating, gzip-compressed files
+Handler threads only put records on an in-memory queue (QueueHandler); a
+single QueueListener thread formats them and writes the console and the log
+file, so a slow disk never adds to callback latency. The file is rotated by
+size (or by time with LOG_ROTATE_WHEN) and old segments are gzipped.
+"""
+import atexit
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+from typing import Optional
+
+from config import Config
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _gzip_namer(name: str) -> str:
+    return name + ".gz"
+
+
+def _gzip_rotator(source: str, dest: str):
+    # runs on the listener thread, so compression stays off the hot path too
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _file_handler(path: str, max_bytes: int, backup_count: int, when: str) -> logging.Handler:
+    if when:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=when, backupCount=backup_count, encoding='utf-8')
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    handler.namer = _gzip_namer
+    handler.rotator = _gzip_rotator
+    return handler
+
+
+def setup_logging(level: Optional[str] = None, log_file: Optional[str] = None,
+                  max_bytes: Optional[int] = None, backup_count: Optional[int] = None,
+                  when: Optional[str] = None, console: bool = True) -> logging.handlers.QueueListener:
+    """
+    Install a QueueHandler on the root logger and start the listener that
+    writes to the rotating log file (and the console). Arguments default to
+    the LOG_* settings in Config. Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    level_name = (level or Config.LOG_LEVEL or "INFO").upper()
+    numeric_level = logging.getLevelName(level_name)
+    if not isinstance(numeric_level, int):
+        numeric_level = logging.INFO
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [_file_handler(
+        log_file or Config.LOG_FILE,
+        Config.LOG_MAX_BYTES if max_bytes is None else max_bytes,
+        Config.LOG_BACKUP_COUNT if backup_count is None else backup_count,
+        Config.LOG_ROTATE_WHEN if when is None else when,
+    )]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for h in handlers:
+        h.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(numeric_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records to disk and stop the listener thread."""
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+    for h in listener.handlers:
+        try:
+            h.close()
+        except Exception:
+            pass
@@ -0,0 +1,97 @@
+"""
+logtail.py - Bounded-cost tail of the bot log for the admin log viewer
+The file is read backwards from the end in fixed-size blocks until enough
+matching records are found (or a byte budget runs out), so viewing logs costs
+the same no matter how large bot.log has grown. Records spanning several
+lines (tracebacks) are kept together and filtered as one.
+"""
+import gzip
+import io
+import logging
+import os
+import re
+from typing import List, Optional
+
+BLOCK_SIZE = 8192
+MAX_SCAN_BYTES = 4 * 1024 * 1024    # never read more than this per request
+MAX_MESSAGE_CHARS = 3500            # longer output is sent as a .gz document
+
+# records start with the asctime of the bot's log format: "2024-01-31 12:00:00,123 - "
+_RECORD_START = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+_LEVEL = re.compile(r" - (DEBUG|INFO|WARNING|ERROR|CRITICAL) - ")
+
+
+def _reverse_lines(f, block_size: int, max_bytes: int):
+    """Yield the lines of an open binary file last-to-first (without newlines)."""
+    f.seek(0, os.SEEK_END)
+    pos = f.tell()
+    stop = max(0, pos - max_bytes)
+    tail = b""
+    while pos > stop:
+        size = min(block_size, pos - stop)
+        pos -= size
+        f.seek(pos)
+        chunk = f.read(size) + tail
+        lines = chunk.split(b"\n")
+        # the first piece may be the end of a line that starts in an earlier block
+        tail = lines.pop(0)
+        for line in reversed(lines):
+            yield line
+    if tail and stop == 0:
+        yield tail
+
+
+def _record_level(header: str) -> int:
+    m = _LEVEL.search(header)
+    return logging.getLevelName(m.group(1)) if m else logging.NOTSET
+
+
+def tail_records(path: str, limit: int = 40, min_level: Optional[int] = None,
+                 pattern: Optional[str] = None, block_size: int = BLOCK_SIZE,
+                 max_bytes: int = MAX_SCAN_BYTES) -> List[str]:
+    """
+    Last `limit` log records of `path` (oldest first) that are at least
+    `min_level` and contain `pattern` (case-insensitive), each record joined
+    with its continuation lines. Returns [] if the file doesn't exist.
+    """
+    if limit <= 0 or not os.path.exists(path):
+        return []
+    needle = pattern.lower() if pattern else None
+    records = []
+    pending = []        # continuation lines seen (in reverse) before their header
+
+    with open(path, "rb") as f:
+        for raw in _reverse_lines(f, block_size, max_bytes):
+            line = raw.decode("utf-8", errors="replace").rstrip("\r")
+            if not _RECORD_START.match(line):
+                if line:
+                    pending.append(line)
+                continue
+            record = "\n".join([line] + pending[::-1])
+            pending = []
+            if min_level and _record_level(line) < min_level:
+                continue
+            if needle and needle not in record.lower():
+                continue
+            records.append(record)
+            if len(records) >= limit:
+                break
+
+    records.reverse()
+    return records
+
+
+def parse_level(name: str) -> Optional[int]:
+    """'warning' / 'WARN' / 'error' -> logging level, None if not a level name."""
+    name = (name or "").upper()
+    if name == "WARN":
+        name = "WARNING"
+    level = logging.getLevelName(name)
+    return level if isinstance(level, int) else None
+
+
+def gzip_document(text: str, filename: str = "bot.log.gz") -> io.BytesIO:
+    """Compress text into an in-memory file ready for send_document."""
+    buf = io.BytesIO(gzip.compress(text.encode("utf-8")))
+    buf.name = filename
+    return buf
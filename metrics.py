@@ -0,0 +1,287 @@
+"""
+metrics.py - Prometheus text-format metrics and a small HTTP endpoint
+Counters and histograms are updated in-process (callback routes, Telegram
+API calls, SQLite statements); queue depths and other point-in-time values
+are read from their owners when /metrics is scraped. No client library
+needed: the exposition format is written by hand.
+"""
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_fmt(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}       # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                v[index] += 1
+            v[-2] += value
+            v[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, v in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, v):
+                cumulative += n
+                le = 'le="%s"' % _fmt(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, inf)} {v[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(v[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {v[-1]}")
+        return lines
+
+
+class Collected:
+    """Values read at scrape time: fn() returns a number or {label tuple: number}."""
+
+    def __init__(self, name: str, help: str, kind: str, fn: Callable, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.debug(f"Metric {self.name} collection failed: {e}")
+            return lines
+        if isinstance(value, dict):
+            for key, v in sorted(value.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_fmt(v)}")
+        elif value is not None:
+            lines.append(f"{self.name} {_fmt(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            # re-registering a name (e.g. a module reloaded in tests) keeps the first one
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def gauge_fn(self, name: str, help: str, fn: Callable, labelnames: Iterable[str] = ()):
+        return self._add(Collected(name, help, "gauge", fn, labelnames))
+
+    def counter_fn(self, name: str, help: str, fn: Callable, labelnames: Iterable[str] = ()):
+        return self._add(Collected(name, help, "counter", fn, labelnames))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ==================== CALLBACK ROUTES ====================
+
+CALLBACKS = REGISTRY.counter("bot_callbacks_total", "Callback queries handled, by route and outcome",
+                             ("route", "outcome"))
+CALLBACK_SECONDS = REGISTRY.histogram("bot_callback_duration_seconds", "Callback handler latency by route",
+                                      ("route",))
+
+
+def attach_router(router):
+    """Feed a CallbackRouter's per-route timings into the callback metrics."""
+    def observe(name, elapsed, ok):
+        CALLBACKS.inc(route=name, outcome="ok" if ok else "error")
+        CALLBACK_SECONDS.observe(elapsed, route=name)
+    router.observers.append(observe)
+    return router
+
+# ==================== TELEGRAM API ====================
+
+API_REQUESTS = REGISTRY.counter("telegram_api_requests_total", "Bot API requests by method", ("method",))
+API_ERRORS = REGISTRY.counter("telegram_api_errors_total", "Failed Bot API requests by method and HTTP code",
+                              ("method", "code"))
+API_SECONDS = REGISTRY.histogram("telegram_api_duration_seconds", "Bot API request latency by method",
+                                 ("method",), buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+_api_installed = False
+
+
+def instrument_telegram_api():
+    """
+    Time every Bot API request through apihelper.CUSTOM_REQUEST_SENDER,
+    wrapping an existing custom sender if one is set.
+    """
+    global _api_installed
+    from telebot import apihelper
+    if _api_installed:
+        return
+    inner = apihelper.CUSTOM_REQUEST_SENDER
+
+    def send(method, url, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            if inner is not None:
+                result = inner(method, url, **kwargs)
+            else:
+                result = apihelper._get_req_session().request(method, url, **kwargs)
+        except Exception:
+            API_ERRORS.inc(method=api_method, code="exception")
+            raise
+        finally:
+            API_REQUESTS.inc(method=api_method)
+            # getUpdates long-polls by design; its latency says nothing about the API
+            if api_method != "getUpdates":
+                API_SECONDS.observe(time.perf_counter() - start, method=api_method)
+        if result.status_code != 200:
+            API_ERRORS.inc(method=api_method, code=str(result.status_code))
+        return result
+
+    apihelper.CUSTOM_REQUEST_SENDER = send
+    _api_installed = True
+
+# ==================== SQLITE ====================
+
+SQL_SECONDS = REGISTRY.histogram("sqlite_statement_duration_seconds", "SQLite statement/commit latency",
+                                 buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+
+
+def attach_sqlstats():
+    """Export sqlstats totals and a latency histogram of every statement."""
+    from sqlstats import SqlStats
+
+    SqlStats.observers.append(lambda sql, elapsed, busy, failed: SQL_SECONDS.observe(elapsed))
+    totals = SqlStats.totals
+    REGISTRY.counter_fn("sqlite_statements_total", "SQLite statements executed", lambda: totals["statements"])
+    REGISTRY.counter_fn("sqlite_errors_total", "SQLite statements that failed", lambda: totals["errors"])
+    REGISTRY.counter_fn("sqlite_busy_errors_total", "Statements that failed with 'database is locked'",
+                        lambda: totals["busy"])
+    REGISTRY.counter_fn("sqlite_slow_statements_total", "Statements slower than SQL_SLOW_MS",
+                        lambda: totals["slow"])
+    REGISTRY.counter_fn("sqlite_statement_seconds_total", "Time spent in SQLite statements",
+                        lambda: totals["seconds"])
+
+# ==================== HTTP ENDPOINT ====================
+
+def _make_handler(registry: Registry, path: str):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        server_version = "StreamXMetrics/1.0"
+
+        def do_GET(self):
+            if self.path != path:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("metrics %s - %s", self.client_address[0], format % args)
+
+    return MetricsHandler
+
+
+class MetricsServer:
+    """Serves REGISTRY on http://host:port/metrics from a daemon thread."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9090, path: str = "/metrics",
+                 registry: Optional[Registry] = None):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.registry = registry or REGISTRY
+        self._httpd = None
+
+    def start(self) -> threading.Thread:
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _make_handler(self.registry, self.path))
+        self._httpd.daemon_threads = True
+        t = threading.Thread(target=self._httpd.serve_forever, name="metrics-http", daemon=True)
+        t.start()
+        logger.info(f"Metrics endpoint on http://{self.host}:{self.port}{self.path}")
+        return t
+
+    def shutdown(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
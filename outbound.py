@@ -0,0 +1,253 @@
+"""
+outbound.py - Rate-limited outbound message scheduler
+Every bot.send_message goes through one queue per bot that respects Telegram's
+limits: a global token bucket (~30 msg/s), per-chat pacing (~1 msg/s) and
+automatic backoff when the API answers 429 with retry_after.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_RATE = 30.0          # messages per second across all chats
+GLOBAL_BURST = 5            # token bucket size (max messages sent back-to-back)
+PER_CHAT_INTERVAL = 1.0     # seconds between two messages to the same chat
+MAX_RETRIES = 3             # 429 retries per message before giving up
+NUM_SENDERS = 4             # sender threads (network round-trips overlap)
+
+
+class _Job:
+    __slots__ = ("method", "chat_id", "args", "kwargs", "callback", "attempts")
+
+    def __init__(self, method, chat_id, args, kwargs, callback):
+        self.method = method
+        self.chat_id = chat_id
+        self.args = args
+        self.kwargs = kwargs
+        self.callback = callback
+        self.attempts = 0
+
+
+class OutboundQueue:
+    """
+    Fire-and-forget send queue.
+
+    Jobs are kept in a FIFO per chat; a min-heap holds each chat that has
+    pending jobs keyed by the earliest time it may be sent to again, so
+    per-chat order is preserved while different chats interleave freely.
+    A chat has at most one message in flight: it is only rescheduled once
+    the previous send has finished, however slow that send was.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, bot, rate: float = GLOBAL_RATE, per_chat_interval: float = PER_CHAT_INTERVAL,
+                 max_retries: int = MAX_RETRIES, num_senders: int = NUM_SENDERS, burst: int = GLOBAL_BURST):
+        self.bot = bot
+        self.rate = rate
+        self.burst = burst
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.num_senders = num_senders
+
+        self._cond = threading.Condition()
+        self._chats = {}            # chat_id -> deque[_Job]
+        self._ready = []            # heap of (ready_at, seq, chat_id)
+        self._scheduled = set()     # chat_ids currently in _ready
+        self._next_ok = {}          # chat_id -> earliest next send time
+        self._sending = set()       # chat_ids with a message in flight
+        self._in_flight = 0
+        self._seq = itertools.count()
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._threads = []
+        self._stopping = False
+
+        self.stats = {"queued": 0, "sent": 0, "failed": 0, "retried_429": 0}
+
+    @staticmethod
+    def for_bot(bot) -> "OutboundQueue":
+        """Return the shared queue for this bot (created on first use)."""
+        with OutboundQueue._instances_lock:
+            q = OutboundQueue._instances.get(id(bot))
+            if q is None:
+                q = OutboundQueue(bot)
+                OutboundQueue._instances[id(bot)] = q
+            return q
+
+    # ==================== PUBLIC API ====================
+
+    def send_message(self, chat_id, text, callback: Optional[Callable] = None, **kwargs):
+        """Queue bot.send_message(chat_id, text, **kwargs)."""
+        self.submit("send_message", chat_id, text, callback=callback, **kwargs)
+
+    def reply_to(self, message, text, callback: Optional[Callable] = None, **kwargs):
+        """Queued equivalent of bot.reply_to(message, text, **kwargs)."""
+        kwargs.setdefault("reply_to_message_id", message.message_id)
+        self.submit("send_message", message.chat.id, text, callback=callback, **kwargs)
+
+    def submit(self, method: str, chat_id, *args, callback: Optional[Callable] = None, **kwargs):
+        """
+        Queue any chat-bound bot method (send_message, send_document, ...).
+        callback(ok, result_or_exception) is called from a sender thread.
+        """
+        job = _Job(method, chat_id, args, kwargs, callback)
+        with self._cond:
+            self._chats.setdefault(chat_id, deque()).append(job)
+            self.stats["queued"] += 1
+            self._schedule_chat(chat_id, time.monotonic())
+            self._cond.notify()
+        self._ensure_started()
+
+    def pending(self) -> int:
+        """Number of queued + in-flight messages."""
+        with self._cond:
+            return sum(len(q) for q in self._chats.values()) + self._in_flight
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            data = dict(self.stats)
+            data["pending"] = sum(len(q) for q in self._chats.values())
+            data["in_flight"] = self._in_flight
+            data["chats_waiting"] = len(self._chats)
+            return data
+
+    def start(self):
+        self._ensure_started()
+
+    def stop(self, drain_timeout: float = 10.0):
+        """Wait up to drain_timeout seconds for queued messages, then stop senders."""
+        deadline = time.monotonic() + drain_timeout
+        while self.pending() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout=2)
+        self._threads = []
+
+    # ==================== SCHEDULING ====================
+
+    def _schedule_chat(self, chat_id, now):
+        # caller holds self._cond
+        if chat_id in self._scheduled or chat_id in self._sending or not self._chats.get(chat_id):
+            return
+        ready_at = max(now, self._next_ok.get(chat_id, 0.0))
+        heapq.heappush(self._ready, (ready_at, next(self._seq), chat_id))
+        self._scheduled.add(chat_id)
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _next_job(self) -> Optional[_Job]:
+        with self._cond:
+            while True:
+                if self._stopping:
+                    return None
+                now = time.monotonic()
+                if not self._ready:
+                    self._cond.wait()
+                    continue
+                ready_at, _, chat_id = self._ready[0]
+                if ready_at > now:
+                    self._cond.wait(ready_at - now)
+                    continue
+                self._refill(now)
+                if self._tokens < 1:
+                    self._cond.wait((1 - self._tokens) / self.rate)
+                    continue
+
+                heapq.heappop(self._ready)
+                self._scheduled.discard(chat_id)
+                if self._next_ok.get(chat_id, 0.0) > now:
+                    # pushed back by a 429 after this entry was scheduled
+                    self._schedule_chat(chat_id, now)
+                    continue
+                chat_q = self._chats.get(chat_id)
+                if not chat_q:
+                    self._chats.pop(chat_id, None)
+                    continue
+                job = chat_q.popleft()
+                if not chat_q:
+                    del self._chats[chat_id]
+                self._tokens -= 1
+                self._in_flight += 1
+                self._next_ok[chat_id] = now + self.per_chat_interval
+                # rescheduled by _finish / _retry_later once this send is done
+                self._sending.add(chat_id)
+                return job
+
+    def _finish(self, job, ok, result):
+        with self._cond:
+            self._in_flight -= 1
+            self.stats["sent" if ok else "failed"] += 1
+            self._sending.discard(job.chat_id)
+            self._schedule_chat(job.chat_id, time.monotonic())
+            self._cond.notify()
+            # forget pacing state of idle chats so the dict doesn't grow forever
+            if len(self._next_ok) > 10000:
+                now = time.monotonic()
+                self._next_ok = {cid: t for cid, t in self._next_ok.items()
+                                 if t > now or cid in self._chats or cid in self._sending}
+        if job.callback:
+            try:
+                job.callback(ok, result)
+            except Exception:
+                logger.exception("Outbound callback failed")
+
+    def _retry_later(self, job, retry_after):
+        with self._cond:
+            self._in_flight -= 1
+            self.stats["retried_429"] += 1
+            self._sending.discard(job.chat_id)
+            now = time.monotonic()
+            self._next_ok[job.chat_id] = max(self._next_ok.get(job.chat_id, 0.0), now + retry_after)
+            # put it back at the head so per-chat order is kept
+            self._chats.setdefault(job.chat_id, deque()).appendleft(job)
+            self._schedule_chat(job.chat_id, now)
+            self._cond.notify()
+
+    def _sender(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            job.attempts += 1
+            try:
+                result = getattr(self.bot, job.method)(job.chat_id, *job.args, **job.kwargs)
+            except ApiTelegramException as e:
+                if e.error_code == 429 and job.attempts <= self.max_retries:
+                    retry_after = (e.result_json or {}).get("parameters", {}).get("retry_after", 1)
+                    logger.warning(f"429 for chat {job.chat_id}, retrying in {retry_after}s")
+                    self._retry_later(job, retry_after)
+                    continue
+                logger.error(f"{job.method} to {job.chat_id} failed: {e}")
+                self._finish(job, False, e)
+                continue
+            except Exception as e:
+                logger.error(f"{job.method} to {job.chat_id} failed: {e}")
+                self._finish(job, False, e)
+                continue
+            self._finish(job, True, result)
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._cond:
+            if self._threads:
+                return
+            self._stopping = False
+            for i in range(self.num_senders):
+                t = threading.Thread(target=self._sender, name=f"outbound-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
@@ -0,0 +1,931 @@
+"""
+repository.py - The one data-access layer for the bot
+bot.py, handlers.py, broadcast.py and the CLI tools (add_plan.py,
+update_prices.py, db_manager.py) all go through Database: one SQLite file
+(Config.DATABASE_NAME), a bounded ConnectionPool shared by every thread,
+sqlite3.Row rows, a sized prepared-statement cache and the PRAGMA profile
+selected by Config.DB_PROFILE. init_schema() owns the canonical schema and
+upgrades databases created by older versions of either stack (plans.days, payments.method, users.subscription_end / plan_type).
+"""
+import sqlite3
+import threading
+import logging
+import time
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+from config import Config
+import sqlstats
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = Config.DATABASE_NAME
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# ==================== CONNECTIONS ====================
+
+# PRAGMAs run on every new connection, after journal_mode=WAL / busy_timeout.
+# synchronous=NORMAL under WAL only syncs at checkpoints: a commit survives an
+# application crash, but the last transactions can be lost on power failure.
+SQLITE_PROFILES = {
+    "default": [],
+    "tuned": [
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA cache_size=-{Config.DB_CACHE_SIZE_KB}",   # negative = KiB, not pages
+        f"PRAGMA mmap_size={Config.DB_MMAP_SIZE}",
+        f"PRAGMA temp_store={Config.DB_TEMP_STORE}",
+    ],
+}
+
+class PoolTimeout(sqlite3.OperationalError):
+    """No pooled connection became free within DB_POOL_TIMEOUT seconds."""
+
+
+class _Pooled:
+    __slots__ = ("conn", "created_at", "last_used", "optimize_at", "suspect")
+
+    def __init__(self, conn: sqlite3.Connection):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+        self.optimize_at = now + Config.DB_OPTIMIZE_INTERVAL
+        self.suspect = False        # failed with a DatabaseError: health-check before reuse
+
+
+class ConnectionPool:
+    """
+    At most max_size open connections, handed out to whichever thread needs
+    one and returned after each unit of work. Idle connections are closed by
+    a reaper thread after idle_timeout seconds; connections idle longer than
+    health_check_after (or that raised a DatabaseError) run SELECT 1 before
+    reuse and are replaced if that fails.
+    """
+
+    def __init__(self, factory: Callable[[], sqlite3.Connection], max_size: int = 8,
+                 idle_timeout: float = 300.0, health_check_after: float = 30.0,
+                 timeout: float = 30.0, name: str = "db-pool"):
+        self.factory = factory
+        self.max_size = max(1, max_size)
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self.name = name
+        self._cond = threading.Condition()
+        self._idle = []             # most recently used last (LIFO keeps warm page caches busy)
+        self._size = 0              # open connections, idle + checked out
+        self._closed = False
+        self._stop_event = threading.Event()
+        self._reaper = None
+        self._stats = {"checkouts": 0, "waits": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0,
+                       "timeouts": 0, "created": 0, "reaped": 0, "replaced": 0, "in_use": 0, "peak": 0}
+
+    # ==================== CHECKOUT ====================
+
+    def acquire(self) -> _Pooled:
+        start = time.monotonic()
+        deadline = start + self.timeout
+        entry = None
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("Connection pool is closed")
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"No database connection free after {self.timeout:g}s "
+                                      f"({self.max_size} in use)")
+                waited = True
+                self._cond.wait(remaining)
+            s = self._stats
+            s["checkouts"] += 1
+            s["in_use"] += 1
+            s["peak"] = max(s["peak"], s["in_use"])
+            if waited:
+                wait = time.monotonic() - start
+                s["waits"] += 1
+                s["wait_seconds"] += wait
+                s["max_wait_seconds"] = max(s["max_wait_seconds"], wait)
+        self._ensure_reaper()
+
+        try:
+            if entry is None:
+                entry = self._open()
+            elif entry.suspect or time.monotonic() - entry.last_used >= self.health_check_after:
+                entry = self._check(entry)
+        except Exception:
+            # the slot was never handed out
+            with self._cond:
+                self._size -= 1
+                self._stats["in_use"] -= 1
+                self._cond.notify()
+            raise
+
+        if Config.DB_OPTIMIZE_INTERVAL > 0 and time.monotonic() >= entry.optimize_at:
+            entry.optimize_at = time.monotonic() + Config.DB_OPTIMIZE_INTERVAL
+            Database.optimize(entry.conn)
+        return entry
+
+    def release(self, entry: _Pooled):
+        try:
+            # work that neither committed nor rolled back must not leak into the next checkout
+            if entry.conn.in_transaction:
+                entry.conn.rollback()
+        except Exception:
+            entry.suspect = True
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._stats["in_use"] -= 1
+            if self._closed:
+                self._size -= 1
+                closing = True
+            else:
+                self._idle.append(entry)
+                closing = False
+            self._cond.notify()
+        if closing:
+            self._close(entry)
+
+    def _open(self) -> _Pooled:
+        entry = _Pooled(self.factory())
+        with self._cond:
+            self._stats["created"] += 1
+        logger.debug(f"{self.name}: opened connection ({self._size}/{self.max_size})")
+        return entry
+
+    def _check(self, entry: _Pooled) -> _Pooled:
+        try:
+            entry.conn.execute("SELECT 1").fetchone()
+            entry.suspect = False
+            return entry
+        except Exception as e:
+            logger.warning(f"{self.name}: replacing unhealthy connection: {e}")
+            self._close(entry, optimize=False)
+            with self._cond:
+                self._stats["replaced"] += 1
+            return self._open()
+
+    @staticmethod
+    def _close(entry: _Pooled, optimize: bool = True):
+        try:
+            if optimize:
+                Database.optimize(entry.conn)
+            entry.conn.close()
+        except Exception as e:
+            logger.debug(f"Closing pooled connection failed: {e}")
+
+    # ==================== REAPER / SHUTDOWN ====================
+
+    def reap(self) -> int:
+        """Close connections idle for longer than idle_timeout. Returns how many were closed."""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._cond:
+            stale = [e for e in self._idle if e.last_used < cutoff]
+            if not stale:
+                return 0
+            self._idle = [e for e in self._idle if e.last_used >= cutoff]
+            self._size -= len(stale)
+            self._stats["reaped"] += len(stale)
+        for entry in stale:
+            self._close(entry)
+        logger.debug(f"{self.name}: reaped {len(stale)} idle connections")
+        return len(stale)
+
+    def _ensure_reaper(self):
+        if self._reaper is not None or self.idle_timeout <= 0:
+            return
+        with self._cond:
+            if self._reaper is not None or self._closed:
+                return
+            self._reaper = threading.Thread(target=self._run_reaper, name=f"{self.name}-reaper", daemon=True)
+            self._reaper.start()
+
+    def _run_reaper(self):
+        interval = max(1.0, self.idle_timeout / 2)
+        while not self._stop_event.wait(interval):
+            try:
+                self.reap()
+            except Exception:
+                logger.exception(f"{self.name}: reaper failed")
+
+    def close(self):
+        """Close idle connections now and checked-out ones as they are released."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        self._stop_event.set()
+        if self._reaper and self._reaper is not threading.current_thread():
+            self._reaper.join(timeout=5)
+        for entry in idle:
+            self._close(entry)
+        logger.info(f"{self.name}: closed ({len(idle)} idle connections)")
+
+    # ==================== STATS ====================
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            s = dict(self._stats)
+            s["size"] = self._size
+            s["idle"] = len(self._idle)
+            s["max_size"] = self.max_size
+        s["avg_wait_ms"] = s["wait_seconds"] / s["waits"] * 1000 if s["waits"] else 0.0
+        return s
+
+    def format_stats(self) -> str:
+        s = self.snapshot()
+        return (
+            f"🗄 DB connections: {s['size']}/{s['max_size']} open "
+            f"({s['in_use']} in use, {s['idle']} idle, peak {s['peak']})\n"
+            f"Checkouts: {s['checkouts']}, waited: {s['waits']} "
+            f"(avg {s['avg_wait_ms']:.1f} ms, max {s['max_wait_seconds'] * 1000:.1f} ms), timeouts: {s['timeouts']}\n"
+            f"Opened: {s['created']}, reaped idle: {s['reaped']}, replaced unhealthy: {s['replaced']}"
+        )
+
+
+class Database:
+    """
+    Pooled SQLite connections shared by every module. A thread holds at most
+    one connection at a time: nested get_cursor()/connection() calls reuse it.
+    """
+
+    _local = threading.local()
+    _pool: Optional[ConnectionPool] = None
+    _pool_lock = threading.Lock()
+    # called with every new pooled connection (e.g. benchmark trace callbacks)
+    connect_hooks: List[Callable[[sqlite3.Connection], None]] = []
+
+    @staticmethod
+    def connect(path: Optional[str] = None, profile: Optional[str] = None) -> sqlite3.Connection:
+        """
+        Open a new connection with the standard settings and the PRAGMA profile
+        (Config.DB_PROFILE unless given). CLI tools use this directly and close
+        it themselves; the bot goes through the pool.
+        """
+        conn = sqlstats.connect(
+            path or DB_PATH,
+            check_same_thread=False,
+            timeout=30,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=Config.DB_STATEMENT_CACHE_SIZE
+        )
+        # allow row access by column name (row['name']) as well as by index
+        conn.row_factory = sqlite3.Row
+        # Enable WAL mode for better concurrency
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        profile = profile or Config.DB_PROFILE
+        pragmas = SQLITE_PROFILES.get(profile)
+        if pragmas is None:
+            logger.warning(f"Unknown DB_PROFILE '{profile}', using SQLite defaults")
+            pragmas = []
+        for pragma in pragmas:
+            conn.execute(pragma)
+        return conn
+
+    @staticmethod
+    def optimize(conn: sqlite3.Connection):
+        """
+        PRAGMA optimize: re-ANALYZE tables whose statistics are stale for the
+        queries this connection has run. Cheap when there is nothing to do.
+        """
+        if conn.in_transaction:
+            return
+        try:
+            start = time.perf_counter()
+            conn.execute("PRAGMA optimize")
+            logger.debug(f"PRAGMA optimize took {(time.perf_counter() - start) * 1000:.1f} ms")
+        except Exception as e:
+            logger.warning(f"PRAGMA optimize failed: {e}")
+
+    @staticmethod
+    def _pooled_connect() -> sqlite3.Connection:
+        conn = Database.connect()
+        for hook in Database.connect_hooks:
+            hook(conn)
+        return conn
+
+    @staticmethod
+    def pool() -> ConnectionPool:
+        """The process-wide pool (created on first use, sized from Config)."""
+        if Database._pool is None:
+            with Database._pool_lock:
+                if Database._pool is None:
+                    Database._pool = ConnectionPool(
+                        Database._pooled_connect,
+                        max_size=Config.DB_POOL_SIZE,
+                        idle_timeout=Config.DB_POOL_IDLE_TIMEOUT,
+                        health_check_after=Config.DB_POOL_HEALTH_CHECK_AFTER,
+                        timeout=Config.DB_POOL_TIMEOUT,
+                    )
+        return Database._pool
+
+    @staticmethod
+    def close_pool():
+        """Close every pooled connection (shutdown). The next use opens a new pool."""
+        with Database._pool_lock:
+            pool, Database._pool = Database._pool, None
+        if pool is not None:
+            pool.close()
+
+    @staticmethod
+    @contextmanager
+    def connection():
+        """
+        Check a connection out of the pool for the duration of the block.
+        Reentrant: inside an outer block the thread keeps using the same one.
+        """
+        local = Database._local
+        held = getattr(local, 'entry', None)
+        if held is not None:
+            yield held.conn
+            return
+        pool = Database.pool()
+        entry = pool.acquire()
+        local.entry = entry
+        try:
+            yield entry.conn
+        except sqlite3.DatabaseError as e:
+            if not isinstance(e, (sqlite3.IntegrityError, sqlite3.OperationalError)):
+                entry.suspect = True
+            raise
+        finally:
+            local.entry = None
+            pool.release(entry)
+
+    @staticmethod
+    def get_connection() -> sqlite3.Connection:
+        """
+        Compatibility for code that keeps a bare connection: checks one out and
+        pins it to this thread until close_connection(). Prefer get_cursor() /
+        connection(), which hand it back after each unit of work.
+        """
+        local = Database._local
+        held = getattr(local, 'entry', None)
+        if held is not None:
+            return held.conn
+        local.entry = Database.pool().acquire()
+        local.pinned = True
+        return local.entry.conn
+
+    @staticmethod
+    def close_connection():
+        """Return a connection pinned by get_connection() to the pool."""
+        local = Database._local
+        if getattr(local, 'pinned', False) and getattr(local, 'entry', None) is not None:
+            entry, local.entry, local.pinned = local.entry, None, False
+            Database.pool().release(entry)
+
+    @staticmethod
+    @contextmanager
+    def get_cursor(immediate: bool = False):
+        """
+        Context manager for one transaction: commits on success, rolls back on error.
+        immediate=True takes the write lock up front (BEGIN IMMEDIATE); use it
+        when the transaction reads before it writes, otherwise two of them can
+        each hold a read lock and fail with "database is locked" upgrading it.
+        Usage:
+        with Database.get_cursor() as cursor:
+            cursor.execute("SELECT ...")
+        """
+        with Database.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                if immediate and not conn.in_transaction:
+                    cursor.execute("BEGIN IMMEDIATE")
+                yield cursor
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def execute_query(query, params=None, fetchone=False, fetchall=False, commit=False):
+        """Execute a single statement; returns the row, the rows or the rowcount."""
+        with Database.connection() as conn:
+            cursor = None
+            try:
+                cursor = conn.cursor()
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+
+                # fetch before commit so UPDATE ... RETURNING rows are complete
+                if fetchone:
+                    result = cursor.fetchone()
+                elif fetchall:
+                    result = cursor.fetchall()
+                else:
+                    result = cursor.rowcount
+
+                if commit:
+                    conn.commit()
+
+                return result
+            except Exception as e:
+                logger.error(f"Database query failed: {e}")
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                raise
+            finally:
+                if cursor:
+                    cursor.close()
+
+# ==================== SCHEMA ====================
+
+def column_exists(cursor, table, column):
+    cursor.execute(f"PRAGMA table_info({table})")
+    cols = [r[1] for r in cursor.fetchall()]  # name is at index 1
+    return column in cols
+
+def table_exists(cursor, table):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",(table,))
+    return cursor.fetchone() is not None
+
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        name TEXT,
+        join_date TEXT,
+        expiry_date TEXT,
+        plan TEXT DEFAULT 'free',
+        status TEXT DEFAULT 'active',
+        last_active TEXT,
+        balance INTEGER DEFAULT 0,
+        withdraw_state TEXT DEFAULT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS plans (
+        id INTEGER PRIMARY KEY,
+        name TEXT,
+        duration_days INTEGER,
+        price INTEGER,
+        description TEXT,
+        features TEXT,
+        is_active INTEGER DEFAULT 1,
+        currency TEXT DEFAULT 'INR'
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS payments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        plan_id INTEGER,
+        amount INTEGER,
+        currency TEXT DEFAULT 'INR',
+        payment_method TEXT,
+        status TEXT DEFAULT 'pending',
+        timestamp TEXT,
+        transaction_id TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS channels (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_id TEXT UNIQUE NOT NULL,   -- stores @username or numeric id as text
+        title TEXT,
+        added_by INTEGER,
+        added_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS referrals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        referrer_id INTEGER,
+        referee_id INTEGER,
+        commission INTEGER DEFAULT 0,
+        timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+]
+
+# Columns added to tables created by older versions (ALTER TABLE ADD COLUMN)
+COLUMNS = {
+    "users": {
+        "name": "TEXT",
+        "expiry_date": "TEXT",
+        "plan": "TEXT DEFAULT 'free'",
+        "balance": "INTEGER DEFAULT 0",
+        "withdraw_state": "TEXT DEFAULT NULL",
+    },
+    "plans": {
+        "is_active": "INTEGER DEFAULT 1",
+        "currency": "TEXT DEFAULT 'INR'",
+    },
+    "payments": {
+        "currency": "TEXT DEFAULT 'INR'",
+    },
+}
+
+# Legacy column -> canonical column (renamed if only the legacy one exists,
+# otherwise copied into the canonical one where it is still empty)
+RENAMED_COLUMNS = [
+    ("plans", "days", "duration_days"),
+    ("payments", "method", "payment_method"),
+]
+
+# Secondary indexes for the hot queries in bot.py / handlers.py:
+#   (index name, table, columns that must exist, CREATE statement)
+INDEXES = [
+    # expiry sweeper: expiry_date <= now AND status = 'active' (only active rows are indexed)
+    ("idx_users_active_expiry", "users", ("expiry_date", "status"),
+     "CREATE INDEX idx_users_active_expiry ON users (expiry_date) WHERE status = 'active'"),
+    # admin counts: COUNT(*) ... WHERE expiry_date > now (covering)
+    ("idx_users_expiry", "users", ("expiry_date",),
+     "CREATE INDEX idx_users_expiry ON users (expiry_date)"),
+    # admin_users: ORDER BY join_date DESC LIMIT 20
+    ("idx_users_join_date", "users", ("join_date",),
+     "CREATE INDEX idx_users_join_date ON users (join_date)"),
+    # admin_payments: status = 'pending' ORDER BY id DESC (rowid order inside the index)
+    ("idx_payments_status", "payments", ("status",),
+     "CREATE INDEX idx_payments_status ON payments (status)"),
+    # admin_stats revenue: SUM(amount) WHERE status = 'completed' (covering, completed rows only)
+    ("idx_payments_completed_amount", "payments", ("status", "amount"),
+     "CREATE INDEX idx_payments_completed_amount ON payments (status, amount) WHERE status = 'completed'"),
+    # refer_earn: COUNT(*), SUM(commission) WHERE referrer_id = ? (covering)
+    ("idx_referrals_referrer", "referrals", ("referrer_id", "commission"),
+     "CREATE INDEX idx_referrals_referrer ON referrals (referrer_id, commission)"),
+]
+
+def _normalize_sql(sql):
+    return " ".join((sql or "").split()).lower()
+
+def ensure_indexes(cursor):
+    """
+    Create missing indexes from INDEXES and rebuild any whose definition changed.
+    Indexes whose table/columns do not exist in this schema are skipped.
+    Returns the list of index names created or rebuilt.
+    """
+    changed = []
+    for name, table, columns, sql in INDEXES:
+        if not table_exists(cursor, table):
+            continue
+        if not all(column_exists(cursor, table, col) for col in columns):
+            continue
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type='index' AND name=?", (name,))
+        row = cursor.fetchone()
+        if row and _normalize_sql(row[0]) == _normalize_sql(sql):
+            continue
+        try:
+            if row:
+                cursor.execute(f"DROP INDEX IF EXISTS {name}")
+            cursor.execute(sql)
+        except sqlite3.DatabaseError as e:
+            logger.error(f"Failed to build index {name}: {e}")
+            continue
+        changed.append(name)
+    # No ANALYZE here: stats gathered on a small table would later steer the
+    # planner to full scans once the table grows.
+    return changed
+
+DEFAULT_PLANS = [
+    (1, '⭐ BASIC - 1 Week', 7, 99,
+     'Weekly access to private channel',
+     '✅ Channel Access\n✅ Basic Support\n✅ Weekly Updates'),
+
+    (2, '🚀 PRO - 1 Month', 30, 299,
+     'Monthly access with priority support',
+     '✅ Channel Access\n✅ Priority Support\n✅ Daily Updates\n✅ HD Content'),
+
+    (3, '🔥 PREMIUM - 3 Months', 90, 799,
+     '3 months access + bonus content',
+     '✅ Channel Access\n✅ Priority Support\n✅ All Updates\n✅ Bonus Content\n✅ 4K Quality'),
+
+    (4, '👑 LIFETIME', 36500, 1999,
+     'Lifetime access + all future updates',
+     '✅ Lifetime Access\n✅ VIP Support\n✅ All Content\n✅ Future Updates\n✅ Special Badge\n✅ Early Access')
+]
+
+def ensure_plan_catalog_version(cursor):
+    """Create the single-row plan_catalog_version table if it is missing."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS plan_catalog_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO plan_catalog_version (id, version) VALUES (1, 0)")
+
+def bump_plan_catalog_version(cursor):
+    """
+    Mark the plans table as changed.
+    Call this in the same transaction as any INSERT/UPDATE/DELETE on plans
+    so running bots reload their cached catalog.
+    """
+    ensure_plan_catalog_version(cursor)
+    cursor.execute("UPDATE plan_catalog_version SET version = version + 1 WHERE id = 1")
+
+# Admin dashboard counters, kept current by triggers so the dashboard reads
+# a handful of rows instead of scanning users/payments on every refresh.
+# "active" means status = 'active' with an expiry date set; the expiry sweeper
+# flips status to 'expired' once the date has passed.
+STATS_COUNTERS = {
+    "total_users": "SELECT COUNT(*) FROM users",
+    "active_subs": "SELECT COUNT(*) FROM users WHERE status = 'active' AND expiry_date IS NOT NULL",
+    "pending_payments": "SELECT COUNT(*) FROM payments WHERE status = 'pending'",
+    "completed_payments": "SELECT COUNT(*) FROM payments WHERE status = 'completed'",
+    "revenue": "SELECT COALESCE(SUM(amount), 0) FROM payments WHERE status = 'completed'",
+}
+
+_USER_ACTIVE = "({r}.status = 'active' AND {r}.expiry_date IS NOT NULL)"
+_PAY_PENDING = "({r}.status = 'pending')"
+_PAY_COMPLETED = "({r}.status = 'completed')"
+_PAY_REVENUE = "(CASE WHEN {r}.status = 'completed' THEN COALESCE({r}.amount, 0) ELSE 0 END)"
+
+def _bump(name, delta):
+    return f"UPDATE stats_counters SET value = value + ({delta}) WHERE name = '{name}';"
+
+def _change(expr):
+    return f"{expr.format(r='NEW')} - {expr.format(r='OLD')}"
+
+#   (trigger name, event, statements run per row)
+STATS_TRIGGERS = [
+    ("trg_stats_users_insert", "AFTER INSERT ON users", [
+        _bump("total_users", "1"),
+        _bump("active_subs", _USER_ACTIVE.format(r="NEW")),
+    ]),
+    ("trg_stats_users_delete", "AFTER DELETE ON users", [
+        _bump("total_users", "-1"),
+        _bump("active_subs", "-" + _USER_ACTIVE.format(r="OLD")),
+    ]),
+    ("trg_stats_users_update", "AFTER UPDATE OF status, expiry_date ON users", [
+        _bump("active_subs", _change(_USER_ACTIVE)),
+    ]),
+    ("trg_stats_payments_insert", "AFTER INSERT ON payments", [
+        _bump("pending_payments", _PAY_PENDING.format(r="NEW")),
+        _bump("completed_payments", _PAY_COMPLETED.format(r="NEW")),
+        _bump("revenue", _PAY_REVENUE.format(r="NEW")),
+    ]),
+    ("trg_stats_payments_delete", "AFTER DELETE ON payments", [
+        _bump("pending_payments", "-" + _PAY_PENDING.format(r="OLD")),
+        _bump("completed_payments", "-" + _PAY_COMPLETED.format(r="OLD")),
+        _bump("revenue", "-" + _PAY_REVENUE.format(r="OLD")),
+    ]),
+    ("trg_stats_payments_update", "AFTER UPDATE OF status, amount ON payments", [
+        _bump("pending_payments", _change(_PAY_PENDING)),
+        _bump("completed_payments", _change(_PAY_COMPLETED)),
+        _bump("revenue", _change(_PAY_REVENUE)),
+    ]),
+]
+
+def _trigger_sql(name, event, statements):
+    return f"CREATE TRIGGER {name} {event} BEGIN " + " ".join(statements) + " END"
+
+def recount_stats(cursor):
+    """Recompute every counter with a full scan (initial fill / repair)."""
+    for name, sql in STATS_COUNTERS.items():
+        cursor.execute(sql)
+        value = cursor.fetchone()[0] or 0
+        cursor.execute(
+            "INSERT INTO stats_counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (name, value),
+        )
+
+def ensure_stats_counters(cursor):
+    """
+    Create the stats_counters table and its triggers (idempotent).
+    Counters are filled with a full scan only when the table is new, a
+    counter is missing or a trigger definition changed; after that the
+    triggers keep them in step with every write to users/payments.
+    Skipped if users (expiry_date, status) / payments (status, amount) are missing.
+    Returns True if the counters were recomputed.
+    """
+    if not (table_exists(cursor, "users") and table_exists(cursor, "payments")):
+        return False
+    if not all(column_exists(cursor, "users", col) for col in ("expiry_date", "status")):
+        return False
+    if not all(column_exists(cursor, "payments", col) for col in ("status", "amount")):
+        return False
+
+    cursor.execute("CREATE TABLE IF NOT EXISTS stats_counters (name TEXT PRIMARY KEY, value REAL NOT NULL DEFAULT 0)")
+    cursor.execute("SELECT name FROM stats_counters")
+    recount = set(STATS_COUNTERS) - {r[0] for r in cursor.fetchall()}
+
+    for name, event, statements in STATS_TRIGGERS:
+        sql = _trigger_sql(name, event, statements)
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name=?", (name,))
+        row = cursor.fetchone()
+        if row and _normalize_sql(row[0]) == _normalize_sql(sql):
+            continue
+        if row:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(sql)
+        recount.add(name)
+
+    if recount:
+        recount_stats(cursor)
+        return True
+    return False
+
+def read_stats_counters(cursor):
+    """Return {counter name: value}; counters that don't exist yet read as 0."""
+    cursor.execute("SELECT name, value FROM stats_counters")
+    stats = dict.fromkeys(STATS_COUNTERS, 0)
+    for name, value in cursor.fetchall():
+        # values are stored as REAL; whole numbers are shown without ".0"
+        stats[name] = int(value) if float(value).is_integer() else value
+    return stats
+
+def _migrate_legacy_columns(cursor) -> bool:
+    """Bring tables from older schemas to the canonical columns. Returns True if plans changed."""
+    plans_changed = False
+    for table, columns in COLUMNS.items():
+        for col, col_def in columns.items():
+            if not column_exists(cursor, table, col):
+                logger.info(f"Adding column {table}.{col}")
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {col} {col_def}")
+
+    for table, old, new in RENAMED_COLUMNS:
+        if not column_exists(cursor, table, old):
+            continue
+        if not column_exists(cursor, table, new):
+            logger.info(f"Renaming column {table}.{old} -> {table}.{new}")
+            cursor.execute(f"ALTER TABLE {table} RENAME COLUMN {old} TO {new}")
+            changed = True
+        else:
+            cursor.execute(f"UPDATE {table} SET {new} = {old} WHERE {new} IS NULL AND {old} IS NOT NULL")
+            changed = cursor.rowcount > 0
+            if changed:
+                logger.info(f"Copied {cursor.rowcount} values {table}.{old} -> {table}.{new}")
+        plans_changed = plans_changed or (changed and table == "plans")
+
+    # handlers.py used to read users.subscription_end / plan_type (written by
+    # older versions of migrate_db.py); expiry_date / plan are the columns both stacks write
+    if column_exists(cursor, "users", "subscription_end"):
+        cursor.execute(
+            "UPDATE users SET expiry_date = subscription_end "
+            "WHERE expiry_date IS NULL AND subscription_end IS NOT NULL"
+        )
+        cursor.execute("DROP INDEX IF EXISTS idx_users_subscription_end")
+    if column_exists(cursor, "users", "plan_type"):
+        cursor.execute(
+            "UPDATE users SET plan = plan_type "
+            "WHERE COALESCE(plan, 'free') = 'free' AND COALESCE(plan_type, 'free') != 'free'"
+        )
+    if column_exists(cursor, "users", "first_name"):
+        cursor.execute("UPDATE users SET name = first_name WHERE name IS NULL AND first_name IS NOT NULL")
+    return plans_changed
+
+def init_schema(cursor):
+    """
+    Create or upgrade every table to the canonical schema, seed the default
+    plans and (re)build indexes and dashboard counters. Idempotent.
+    """
+    for sql in TABLES:
+        cursor.execute(sql)
+
+    # Plan catalog version row (bumped by add_plan.py / update_prices.py)
+    ensure_plan_catalog_version(cursor)
+    if _migrate_legacy_columns(cursor):
+        bump_plan_catalog_version(cursor)
+
+    # Insert default plans if not present
+    cursor.execute("SELECT COUNT(*) FROM plans")
+    if cursor.fetchone()[0] == 0:
+        cursor.executemany(
+            'INSERT OR IGNORE INTO plans (id, name, duration_days, price, description, features) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            DEFAULT_PLANS
+        )
+        bump_plan_catalog_version(cursor)
+
+    # Secondary indexes for hot queries (see INDEXES)
+    ensure_indexes(cursor)
+    # Trigger-maintained counters for the admin dashboard
+    ensure_stats_counters(cursor)
+
+def init_database():
+    """Initialize the database on this thread's connection."""
+    with Database.get_cursor(immediate=True) as cursor:
+        init_schema(cursor)
+    logger.info("Database initialized successfully")
+
+# ==================== SUBSCRIPTIONS / PAYMENTS ====================
+
+def parse_time(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.strptime(value, TIME_FORMAT)
+    except Exception:
+        return datetime.fromisoformat(value)
+
+def has_active_subscription(user_id) -> bool:
+    """Check if user has active subscription."""
+    try:
+        row = Database.execute_query(
+            "SELECT expiry_date FROM users WHERE user_id = ?", (user_id,), fetchone=True
+        )
+        if row and row[0]:
+            return parse_time(row[0]) > datetime.now()
+        return False
+    except Exception as e:
+        logger.error(f"has_active_subscription error for {user_id}: {e}")
+        return False
+
+def save_subscription(cursor, user_id, plan_name, days) -> datetime:
+    """
+    Start (or restart) a subscription of `days` days from now in one UPSERT
+    on the caller's transaction. Returns the new expiry.
+    """
+    now = datetime.now()
+    new_expiry = now + timedelta(days=days)
+    current_time = now.strftime(TIME_FORMAT)
+    cursor.execute('''
+    INSERT INTO users (user_id, username, name, join_date, expiry_date, plan, status, last_active)
+    VALUES (?, '', '', ?, ?, ?, 'active', ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        plan = excluded.plan, expiry_date = excluded.expiry_date,
+        status = 'active', last_active = excluded.last_active
+    ''', (user_id, current_time, new_expiry.strftime(TIME_FORMAT), plan_name, current_time))
+    return new_expiry
+
+def create_payment(user_id, plan_id, amount, payment_method, currency='INR') -> int:
+    """Insert a pending payment and return its id."""
+    with Database.get_cursor() as cursor:
+        cursor.execute('''
+        INSERT INTO payments (user_id, plan_id, amount, currency, payment_method, status, timestamp)
+        VALUES (?, ?, ?, ?, ?, 'pending', ?)
+        ''', (user_id, plan_id, amount, currency or 'INR', payment_method, datetime.now().strftime(TIME_FORMAT)))
+        return cursor.lastrowid
+
+def complete_payment(payment_id) -> Optional[dict]:
+    """
+    Approve a pending payment and activate its plan in one transaction.
+    The conditional UPDATE is the claim: of any number of concurrent
+    approvals only the one that flips status 'pending' -> 'completed' gets
+    a row count of 1 and goes on to UPSERT the subscription; a failure
+    anywhere rolls both back. Called inside a caller's open transaction it
+    works in a SAVEPOINT and leaves the commit (and the caller's other
+    work) to the caller. Returns the payment/plan details and the new
+    expiry, or None if the payment is unknown, already processed or its
+    plan no longer exists.
+    """
+    with Database.connection() as conn:
+        nested = conn.in_transaction
+        cursor = conn.cursor()
+        started = False
+
+        def undo():
+            if nested:
+                cursor.execute("ROLLBACK TO complete_payment")
+                cursor.execute("RELEASE complete_payment")
+            else:
+                conn.rollback()
+
+        try:
+            if nested:
+                cursor.execute("SAVEPOINT complete_payment")
+            else:
+                # take the write lock up front instead of upgrading mid-transaction
+                cursor.execute("BEGIN IMMEDIATE")
+            started = True
+            cursor.execute(
+                "UPDATE payments SET status = 'completed' WHERE id = ? AND status = 'pending'",
+                (payment_id,))
+            if cursor.rowcount != 1:
+                undo()
+                return None
+            cursor.execute('''
+            SELECT p.user_id, p.plan_id, p.amount, pl.name, pl.duration_days
+            FROM payments p
+            JOIN plans pl ON p.plan_id = pl.id
+            WHERE p.id = ?
+            ''', (payment_id,))
+            row = cursor.fetchone()
+            if row is None:
+                logger.error(f"Payment {payment_id} references a missing plan, not approved")
+                undo()
+                return None
+            user_id, plan_id, amount, plan_name, days = row
+            new_expiry = save_subscription(cursor, user_id, plan_name, days)
+            if nested:
+                cursor.execute("RELEASE complete_payment")
+            else:
+                conn.commit()
+        except Exception:
+            if started:
+                undo()
+            raise
+        finally:
+            cursor.close()
+    return {"user_id": user_id, "plan_id": plan_id, "amount": amount,
+            "plan_name": plan_name, "days": days, "expiry": new_expiry}
@@ -0,0 +1,178 @@
+"""
+router.py - Declarative callback_data routing with per-route metrics
+Exact callback_data values are looked up in a dict; parameterised values
+(plan_3, pay_upi_3, delchan:-100...) are split at their first '_' or ':'
+and the head is looked up in a prefix dict, so dispatch cost does not grow
+with the number of buttons. Each route records call count and latency.
+"""
+import logging
+import re
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+_SEPARATOR = re.compile(r"[_:]")
+
+
+class InvalidCallbackData(ValueError):
+    """Raised when a prefix route's argument cannot be parsed."""
+
+
+class CallbackContext(NamedTuple):
+    call: object
+    user_id: int
+    chat_id: Optional[int]
+    message_id: Optional[int]
+
+    @staticmethod
+    def from_call(call) -> "CallbackContext":
+        # some callbacks arrive without message (inline queries etc.) - guard
+        try:
+            chat_id = call.message.chat.id
+            message_id = call.message.message_id
+        except Exception:
+            chat_id = None
+            message_id = None
+        return CallbackContext(call, call.from_user.id, chat_id, message_id)
+
+
+class _Route:
+    __slots__ = ("name", "fn", "parse", "takes_arg")
+
+    def __init__(self, name, fn, parse, takes_arg):
+        self.name = name
+        self.fn = fn
+        self.parse = parse
+        self.takes_arg = takes_arg
+
+
+class CallbackRouter:
+    """
+    Usage:
+        router = CallbackRouter()
+
+        @router.exact("main_menu")
+        def main_menu(ctx): ...
+
+        @router.prefix("plan_", parse=int)
+        def plan(ctx, plan_id): ...
+
+        router.dispatch(call.data, ctx)   # False if nothing matched
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._prefix = {}
+        self._lock = threading.Lock()
+        self._stats = {}        # route name -> [calls, errors, total_s, max_s]
+        self.observers = []     # fn(route name, elapsed_s, ok) called after each dispatch
+
+    # ==================== REGISTRATION ====================
+
+    def add_exact(self, data: str, fn: Callable, name: Optional[str] = None):
+        self._exact[data] = _Route(name or data, fn, None, False)
+
+    def add_prefix(self, prefix: str, fn: Callable, parse: Optional[Callable] = None,
+                   name: Optional[str] = None):
+        if not prefix or prefix[-1] not in "_:" or _SEPARATOR.search(prefix[:-1]):
+            raise ValueError(f"Prefix must end at its first '_' or ':': {prefix!r}")
+        self._prefix[prefix] = _Route(name or prefix + "*", fn, parse, True)
+
+    def exact(self, *data: str, name: Optional[str] = None):
+        def decorator(fn):
+            for d in data:
+                self.add_exact(d, fn, name)
+            return fn
+        return decorator
+
+    def prefix(self, prefix: str, parse: Optional[Callable] = None, name: Optional[str] = None):
+        def decorator(fn):
+            self.add_prefix(prefix, fn, parse, name)
+            return fn
+        return decorator
+
+    # ==================== DISPATCH ====================
+
+    def resolve(self, data: str):
+        """Return (route, raw_arg) for data, or (None, None)."""
+        route = self._exact.get(data)
+        if route:
+            return route, None
+        m = _SEPARATOR.search(data)
+        if m:
+            route = self._prefix.get(data[:m.end()])
+            if route:
+                return route, data[m.end():]
+        return None, None
+
+    def dispatch(self, data: str, *args) -> bool:
+        """
+        Call the route for data with *args (plus the parsed argument for
+        prefix routes). Returns False when no route matches; raises
+        InvalidCallbackData when the argument does not parse.
+        """
+        route, arg = self.resolve(data or "")
+        if route is None:
+            return False
+        if route.takes_arg and route.parse:
+            try:
+                arg = route.parse(arg)
+            except (ValueError, TypeError, IndexError) as e:
+                raise InvalidCallbackData(f"{route.name}: {data!r}") from e
+
+        start = time.perf_counter()
+        ok = False
+        try:
+            if route.takes_arg:
+                route.fn(*args, arg)
+            else:
+                route.fn(*args)
+            ok = True
+        finally:
+            self._record(route.name, time.perf_counter() - start, ok)
+        return True
+
+    # ==================== METRICS ====================
+
+    def _record(self, name: str, elapsed: float, ok: bool):
+        with self._lock:
+            s = self._stats.get(name)
+            if s is None:
+                s = self._stats[name] = [0, 0, 0.0, 0.0]
+            s[0] += 1
+            if not ok:
+                s[1] += 1
+            s[2] += elapsed
+            if elapsed > s[3]:
+                s[3] = elapsed
+        for observer in self.observers:
+            try:
+                observer(name, elapsed, ok)
+            except Exception:
+                logger.exception("Router observer failed")
+
+    def snapshot(self) -> list:
+        """Per-route stats, most total time first."""
+        with self._lock:
+            rows = [
+                {"route": name, "calls": c, "errors": e,
+                 "avg_ms": (t / c * 1000) if c else 0.0, "max_ms": m * 1000, "total_ms": t * 1000}
+                for name, (c, e, t, m) in self._stats.items()
+            ]
+        rows.sort(key=lambda r: r["total_ms"], reverse=True)
+        return rows
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    def format_stats(self, limit: int = 20) -> str:
+        rows = self.snapshot()[:limit]
+        if not rows:
+            return "No callbacks handled yet."
+        lines = ["route | calls | err | avg ms | max ms"]
+        for r in rows:
+            lines.append(f"{r['route']} | {r['calls']} | {r['errors']} | {r['avg_ms']:.1f} | {r['max_ms']:.1f}")
+        return "\n".join(lines)
@@ -0,0 +1,209 @@
+"""
+sqlstats.py - Optional SQL timing instrumentation for the SQLite connections
+Connections opened through sqlstats.connect() time every statement and
+commit, aggregate them by normalized SQL (literals replaced by ?), count
+statements that fail with "database is locked" and log statements slower
+than SQL_SLOW_MS to the "sql.slow" logger. /sqlstats shows the top offenders.
+Busy errors are not retried here: busy_timeout has already waited, and
+replaying one statement of an open transaction cannot resolve a lock
+upgrade conflict - write transactions take the lock with BEGIN IMMEDIATE.
+"""
+import logging
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("sql.slow")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+@lru_cache(maxsize=2048)
+def normalize_sql(sql: str) -> str:
+    """One-line SQL with literals replaced by ? so equivalent statements share a key."""
+    sql = " ".join((sql or "").split())
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("(?)", sql)
+    return sql
+
+
+def _is_locked(e: Exception) -> bool:
+    msg = str(e).lower()
+    return "database is locked" in msg or "database table is locked" in msg
+
+
+class SqlStats:
+    """Process-wide per-statement aggregates."""
+
+    _lock = threading.Lock()
+    # normalized sql -> [calls, errors, total_s, max_s, rows, busy]
+    _stats = {}
+    totals = {"statements": 0, "errors": 0, "busy": 0, "slow": 0, "seconds": 0.0}
+    observers = []      # fn(sql, elapsed_s, busy, failed) called for every statement
+
+    @staticmethod
+    def record(sql: str, elapsed: float, rows: int = 0, busy: bool = False, failed: bool = False):
+        key = normalize_sql(sql)
+        with SqlStats._lock:
+            s = SqlStats._stats.get(key)
+            if s is None:
+                s = SqlStats._stats[key] = [0, 0, 0.0, 0.0, 0, 0]
+            s[0] += 1
+            s[2] += elapsed
+            if elapsed > s[3]:
+                s[3] = elapsed
+            if rows > 0:
+                s[4] += rows
+            if busy:
+                s[5] += 1
+            if failed:
+                s[1] += 1
+            t = SqlStats.totals
+            t["statements"] += 1
+            t["seconds"] += elapsed
+            if busy:
+                t["busy"] += 1
+            if failed:
+                t["errors"] += 1
+        for observer in SqlStats.observers:
+            try:
+                observer(key, elapsed, busy, failed)
+            except Exception:
+                logger.exception("SqlStats observer failed")
+        if elapsed * 1000 >= Config.SQL_SLOW_MS:
+            with SqlStats._lock:
+                SqlStats.totals["slow"] += 1
+            slow_logger.warning(f"Slow query {elapsed * 1000:.1f} ms{' (database busy)' if busy else ''}: {key}")
+
+    @staticmethod
+    def add_rows(sql: str, rows: int):
+        """Rows fetched from a SELECT are only known after execute() returns."""
+        if rows <= 0:
+            return
+        key = normalize_sql(sql)
+        with SqlStats._lock:
+            s = SqlStats._stats.get(key)
+            if s is not None:
+                s[4] += rows
+
+    @staticmethod
+    def snapshot(order: str = "total_ms") -> list:
+        with SqlStats._lock:
+            rows = [
+                {"sql": sql, "calls": c, "errors": e, "total_ms": t * 1000, "max_ms": m * 1000,
+                 "avg_ms": (t / c * 1000) if c else 0.0, "rows": r, "busy": b}
+                for sql, (c, e, t, m, r, b) in SqlStats._stats.items()
+            ]
+        rows.sort(key=lambda r: r[order], reverse=True)
+        return rows
+
+    @staticmethod
+    def reset():
+        with SqlStats._lock:
+            SqlStats._stats.clear()
+            for k in SqlStats.totals:
+                SqlStats.totals[k] = 0.0 if k == "seconds" else 0
+
+    @staticmethod
+    def format_top(limit: int = 10, order: str = "total_ms") -> str:
+        rows = SqlStats.snapshot(order)[:limit]
+        t = dict(SqlStats.totals)
+        header = (f"🗄 SQL: {t['statements']} statements, {t['seconds'] * 1000:.0f} ms total, "
+                  f"{t['errors']} errors, {t['busy']} busy, {t['slow']} slow "
+                  f"(>{Config.SQL_SLOW_MS:g} ms)")
+        if not rows:
+            return header + "\n\nNo statements recorded."
+        lines = [header, ""]
+        for i, r in enumerate(rows, 1):
+            sql = r["sql"] if len(r["sql"]) <= 120 else r["sql"][:117] + "..."
+            lines.append(
+                f"{i}. {r['calls']}× avg {r['avg_ms']:.2f} / max {r['max_ms']:.1f} / total {r['total_ms']:.0f} ms, "
+                f"rows {r['rows']}, busy {r['busy']}, err {r['errors']}\n   {sql}"
+            )
+        return "\n".join(lines)
+
+
+def _timed(sql, fn):
+    """
+    Call fn(); returns (result, elapsed). Failures are recorded here since
+    the caller never gets the numbers; "database is locked" is counted as busy.
+    """
+    start = time.perf_counter()
+    try:
+        return fn(), time.perf_counter() - start
+    except sqlite3.OperationalError as e:
+        busy = _is_locked(e)
+        if busy:
+            logger.warning(f"Database busy after busy_timeout: {normalize_sql(sql)[:80]}")
+        SqlStats.record(sql, time.perf_counter() - start, 0, busy=busy, failed=True)
+        raise
+    except Exception:
+        SqlStats.record(sql, time.perf_counter() - start, 0, failed=True)
+        raise
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+
+    _last_sql = None
+
+    def execute(self, sql, parameters=()):
+        self._last_sql = sql
+        _, elapsed = _timed(sql, lambda: super(InstrumentedCursor, self).execute(sql, parameters))
+        SqlStats.record(sql, elapsed, self.rowcount)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._last_sql = sql
+        _, elapsed = _timed(sql, lambda: super(InstrumentedCursor, self).executemany(sql, seq_of_parameters))
+        SqlStats.record(sql, elapsed, self.rowcount)
+        return self
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None and self._last_sql:
+            SqlStats.add_rows(self._last_sql, 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size if size is not None else self.arraysize)
+        if self._last_sql:
+            SqlStats.add_rows(self._last_sql, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        if self._last_sql:
+            SqlStats.add_rows(self._last_sql, len(rows))
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute* create their cursor internally, bypassing cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        _, elapsed = _timed("COMMIT", super().commit)
+        SqlStats.record("COMMIT", elapsed)
+
+
+def connect(database, **kwargs) -> sqlite3.Connection:
+    """sqlite3.connect() that returns an instrumented connection when SQL_STATS is on."""
+    if Config.SQL_STATS:
+        kwargs.setdefault("factory", InstrumentedConnection)
+    return sqlite3.connect(database, **kwargs)
@@ -0,0 +1,135 @@
+"""
+Exactly-once payment approval (repository.complete_payment).
+Run: python -m pytest tests   (or python -m unittest discover tests)
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import repository
+from config import Config
+from repository import Database, complete_payment, create_payment, init_schema
+
+THREADS = 16
+
+
+class CompletePaymentTest(unittest.TestCase):
+
+    def setUp(self):
+        # a private database and a pool wide enough that every thread races
+        # on its own connection
+        Database.close_pool()
+        self.workdir = tempfile.mkdtemp(prefix="test_approve_")
+        self._saved = (repository.DB_PATH, Config.DB_POOL_SIZE)
+        repository.DB_PATH = os.path.join(self.workdir, "subscriptions.db")
+        Config.DB_POOL_SIZE = THREADS
+        with Database.get_cursor() as cursor:
+            init_schema(cursor)
+        self.plan = Database.execute_query(
+            "SELECT id, name, price, duration_days FROM plans ORDER BY id LIMIT 1", fetchone=True)
+
+    def tearDown(self):
+        Database.close_pool()
+        repository.DB_PATH, Config.DB_POOL_SIZE = self._saved
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _race(self, payment_id):
+        results, errors = [], []
+        barrier = threading.Barrier(THREADS)
+
+        def approve():
+            barrier.wait()
+            try:
+                results.append(complete_payment(payment_id))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=approve) for _ in range(THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results, errors
+
+    def _counter(self, name):
+        return Database.execute_query("SELECT value FROM stats_counters WHERE name = ?", (name,), fetchone=True)[0]
+
+    def test_concurrent_approvals_activate_once(self):
+        user_id = 4242
+        payment_id = create_payment(user_id, self.plan["id"], self.plan["price"], "upi")
+
+        results, errors = self._race(payment_id)
+
+        self.assertEqual(errors, [])
+        winners = [r for r in results if r]
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(results.count(None), THREADS - 1)
+        won = winners[0]
+        self.assertEqual((won["user_id"], won["plan_id"], won["days"]),
+                         (user_id, self.plan["id"], self.plan["duration_days"]))
+
+        status = Database.execute_query("SELECT status FROM payments WHERE id = ?", (payment_id,), fetchone=True)[0]
+        self.assertEqual(status, "completed")
+        # the subscription was written by the winner only: no later call moved the expiry
+        user = Database.execute_query(
+            "SELECT plan, status, expiry_date FROM users WHERE user_id = ?", (user_id,), fetchone=True)
+        self.assertEqual((user["plan"], user["status"]), (self.plan["name"], "active"))
+        self.assertEqual(user["expiry_date"], won["expiry"].strftime(repository.TIME_FORMAT))
+        self.assertEqual(self._counter("completed_payments"), 1)
+        self.assertEqual(self._counter("revenue"), self.plan["price"])
+        self.assertEqual(self._counter("pending_payments"), 0)
+
+    def test_processed_or_unknown_payment_is_not_approved(self):
+        payment_id = create_payment(4243, self.plan["id"], self.plan["price"], "upi")
+        self.assertIsNotNone(complete_payment(payment_id))
+        self.assertIsNone(complete_payment(payment_id))
+        self.assertIsNone(complete_payment(payment_id + 1000))
+        self.assertEqual(self._counter("completed_payments"), 1)
+
+    def test_failed_subscription_write_keeps_payment_pending(self):
+        payment_id = create_payment(4244, self.plan["id"], self.plan["price"], "upi")
+        with Database.get_cursor() as cursor:
+            cursor.execute("CREATE TRIGGER fail_users BEFORE INSERT ON users BEGIN SELECT RAISE(ABORT, 'fail'); END")
+        with self.assertRaises(Exception):
+            complete_payment(payment_id)
+        status = Database.execute_query("SELECT status FROM payments WHERE id = ?", (payment_id,), fetchone=True)[0]
+        self.assertEqual(status, "pending")
+
+        with Database.get_cursor() as cursor:
+            cursor.execute("DROP TRIGGER fail_users")
+        self.assertIsNotNone(complete_payment(payment_id))
+
+    def test_inside_outer_transaction_leaves_callers_work_alone(self):
+        done = create_payment(4245, self.plan["id"], self.plan["price"], "upi")
+        self.assertIsNotNone(complete_payment(done))
+        pending = create_payment(4246, self.plan["id"], self.plan["price"], "upi")
+
+        with Database.get_cursor() as cursor:
+            cursor.execute("INSERT INTO channels (channel_id, title) VALUES (-100, 'kept')")
+            # already processed: must not roll back the INSERT above
+            self.assertIsNone(complete_payment(done))
+            self.assertIsNotNone(complete_payment(pending))
+            # ...and must not have committed it either
+            self.assertTrue(cursor.connection.in_transaction)
+        self.assertEqual(Database.execute_query("SELECT COUNT(*) FROM channels", fetchone=True)[0], 1)
+        self.assertEqual(self._counter("completed_payments"), 2)
+
+        # the caller rolling back undoes the approval made in its transaction
+        another = create_payment(4247, self.plan["id"], self.plan["price"], "upi")
+        with self.assertRaises(RuntimeError):
+            with Database.get_cursor() as cursor:
+                cursor.execute("INSERT INTO channels (channel_id, title) VALUES (-101, 'dropped')")
+                self.assertIsNotNone(complete_payment(another))
+                raise RuntimeError("caller fails after approving")
+        status = Database.execute_query("SELECT status FROM payments WHERE id = ?", (another,), fetchone=True)[0]
+        self.assertEqual(status, "pending")
+        self.assertEqual(Database.execute_query("SELECT COUNT(*) FROM channels", fetchone=True)[0], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,211 @@
+"""
+repository.ConnectionPool: checkout timeout, idle reaping, unhealthy connections
+and reentrant checkout through Database.connection().
+Run: python -m pytest tests   (or python -m unittest discover tests)
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import repository
+from config import Config
+from repository import ConnectionPool, Database, PoolTimeout
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="test_pool_")
+        self.path = os.path.join(self.workdir, "pool.db")
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _pool(self, **kwargs):
+        kwargs.setdefault("max_size", 2)
+        kwargs.setdefault("timeout", 5.0)
+        pool = ConnectionPool(lambda: sqlite3.connect(self.path, check_same_thread=False), **kwargs)
+        self.pools.append(pool)
+        return pool
+
+    def test_acquire_times_out_when_every_connection_is_in_use(self):
+        pool = self._pool(max_size=1, timeout=0.1)
+        held = pool.acquire()
+        errors = []
+
+        def acquire():
+            start = time.monotonic()
+            try:
+                pool.acquire()
+            except PoolTimeout as e:
+                errors.append((e, time.monotonic() - start))
+
+        t = threading.Thread(target=acquire)
+        t.start()
+        t.join(5)
+
+        self.assertEqual(len(errors), 1)
+        self.assertGreaterEqual(errors[0][1], 0.09)
+        stats = pool.snapshot()
+        self.assertEqual((stats["timeouts"], stats["in_use"], stats["size"]), (1, 1, 1))
+
+        # once released, the same connection is handed out again
+        pool.release(held)
+        again = pool.acquire()
+        self.assertIs(again.conn, held.conn)
+        pool.release(again)
+
+    def test_waiter_gets_the_released_connection(self):
+        pool = self._pool(max_size=1, timeout=5.0)
+        held = pool.acquire()
+        got = []
+
+        def acquire():
+            entry = pool.acquire()
+            got.append(entry.conn)
+            pool.release(entry)
+
+        t = threading.Thread(target=acquire)
+        t.start()
+        time.sleep(0.05)
+        pool.release(held)
+        t.join(5)
+
+        self.assertEqual(got, [held.conn])
+        stats = pool.snapshot()
+        self.assertEqual((stats["waits"], stats["timeouts"], stats["created"]), (1, 0, 1))
+
+    def test_reap_closes_only_connections_idle_past_timeout(self):
+        pool = self._pool(idle_timeout=0.1)
+        old, recent = pool.acquire(), pool.acquire()
+        pool.release(old)
+        time.sleep(0.15)
+        pool.release(recent)
+
+        self.assertEqual(pool.reap(), 1)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            old.conn.execute("SELECT 1")
+        recent.conn.execute("SELECT 1")
+        stats = pool.snapshot()
+        self.assertEqual((stats["reaped"], stats["size"], stats["idle"]), (1, 1, 1))
+
+        # the reaped slot is free again: a second checkout opens a new connection
+        a, b = pool.acquire(), pool.acquire()
+        self.assertIs(a.conn, recent.conn)
+        self.assertEqual(pool.snapshot()["created"], 3)
+        pool.release(a)
+        pool.release(b)
+
+    def test_unhealthy_connection_is_replaced(self):
+        pool = self._pool(max_size=1)
+        entry = pool.acquire()
+        broken = entry.conn
+        broken.close()
+        pool.release(entry)      # rolling back a closed connection marks it suspect
+        self.assertTrue(entry.suspect)
+
+        replacement = pool.acquire()
+        self.assertIsNot(replacement.conn, broken)
+        self.assertFalse(replacement.suspect)
+        self.assertEqual(replacement.conn.execute("SELECT 1").fetchone(), (1,))
+        pool.release(replacement)
+        stats = pool.snapshot()
+        self.assertEqual((stats["replaced"], stats["created"], stats["size"]), (1, 2, 1))
+
+    def test_idle_connection_is_checked_before_reuse(self):
+        pool = self._pool(max_size=1, health_check_after=0.0)
+        entry = pool.acquire()
+        pool.release(entry)
+        entry.conn.close()       # went bad while idle, not suspect
+
+        replacement = pool.acquire()
+        self.assertIsNot(replacement.conn, entry.conn)
+        pool.release(replacement)
+        self.assertEqual(pool.snapshot()["replaced"], 1)
+
+    def test_suspect_but_healthy_connection_is_kept(self):
+        pool = self._pool(max_size=1)
+        entry = pool.acquire()
+        entry.suspect = True
+        pool.release(entry)
+
+        again = pool.acquire()
+        self.assertIs(again.conn, entry.conn)
+        self.assertFalse(again.suspect)
+        pool.release(again)
+        self.assertEqual(pool.snapshot()["replaced"], 0)
+
+
+class ReentrantCheckoutTest(unittest.TestCase):
+
+    def setUp(self):
+        # a single-connection pool: a non-reentrant nested checkout would time out
+        Database.close_pool()
+        self.workdir = tempfile.mkdtemp(prefix="test_pool_")
+        self._saved = (repository.DB_PATH, Config.DB_POOL_SIZE, Config.DB_POOL_TIMEOUT)
+        repository.DB_PATH = os.path.join(self.workdir, "subscriptions.db")
+        Config.DB_POOL_SIZE = 1
+        Config.DB_POOL_TIMEOUT = 0.2
+
+    def tearDown(self):
+        Database.close_pool()
+        repository.DB_PATH, Config.DB_POOL_SIZE, Config.DB_POOL_TIMEOUT = self._saved
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_nested_blocks_share_one_connection(self):
+        with Database.connection() as outer:
+            with Database.get_cursor() as cursor:
+                self.assertIs(cursor.connection, outer)
+                cursor.execute("CREATE TABLE t (x INTEGER)")
+                with Database.connection() as inner:
+                    self.assertIs(inner, outer)
+                    self.assertEqual(Database.pool().snapshot()["in_use"], 1)
+            self.assertEqual(Database.pool().snapshot()["in_use"], 1)
+
+        stats = Database.pool().snapshot()
+        self.assertEqual((stats["in_use"], stats["checkouts"], stats["timeouts"]), (0, 1, 0))
+
+    def test_other_thread_waits_for_the_outer_block(self):
+        order = []
+
+        def other():
+            with Database.connection():
+                order.append("other")
+
+        with Database.connection():
+            t = threading.Thread(target=other)
+            t.start()
+            with Database.connection():
+                time.sleep(0.05)
+                order.append("inner")
+        t.join(5)
+
+        # the inner block neither released the connection early nor blocked on itself
+        self.assertEqual(order, ["inner", "other"])
+        self.assertEqual(Database.pool().snapshot()["in_use"], 0)
+
+    def test_database_error_marks_connection_suspect(self):
+        with self.assertRaises(sqlite3.DatabaseError):
+            with Database.connection():
+                raise sqlite3.DatabaseError("file is not a database")
+        self.assertTrue(Database.pool()._idle[-1].suspect)
+
+        # constraint and lock errors say nothing about the connection itself
+        with self.assertRaises(sqlite3.IntegrityError):
+            with Database.connection():
+                raise sqlite3.IntegrityError("UNIQUE constraint failed")
+        self.assertFalse(Database.pool()._idle[-1].suspect)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+"""
+OutboundQueue pacing, ordering and 429 handling against a fake bot.
+Run: python -m pytest tests   (or python -m unittest discover tests)
+"""
+import os
+import random
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telebot.apihelper import ApiTelegramException
+
+from outbound import OutboundQueue
+
+
+def too_many_requests(retry_after):
+    return ApiTelegramException("sendMessage", None, {
+        "ok": False, "error_code": 429, "description": "Too Many Requests",
+        "parameters": {"retry_after": retry_after},
+    })
+
+
+class FakeBot:
+    """
+    Records (monotonic time, chat_id, text) per delivered message.
+    fail(chat_id, text) may raise; delay() seconds are spent in each request.
+    """
+
+    def __init__(self, fail=None, delay=None):
+        self.fail = fail
+        self.delay = delay
+        self.sent = []
+        self.attempts = 0
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        with self._lock:
+            self.attempts += 1
+        if self.delay:
+            time.sleep(self.delay())
+        if self.fail:
+            self.fail(chat_id, text)
+        with self._lock:
+            self.sent.append((time.monotonic(), chat_id, text))
+        return text
+
+
+class OutboundQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queues = []
+        self.results = []
+        self._done = threading.Condition()
+
+    def tearDown(self):
+        for q in self.queues:
+            q.stop(drain_timeout=0)
+
+    def _queue(self, bot, **kwargs):
+        kwargs.setdefault("rate", 1000.0)
+        kwargs.setdefault("burst", 1000)
+        kwargs.setdefault("per_chat_interval", 0.0)
+        q = OutboundQueue(bot, **kwargs)
+        self.queues.append(q)
+        return q
+
+    def _callback(self, ok, result):
+        with self._done:
+            self.results.append((ok, result))
+            self._done.notify_all()
+
+    def _wait_for(self, count, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        with self._done:
+            while len(self.results) < count:
+                remaining = deadline - time.monotonic()
+                self.assertGreater(remaining, 0, f"only {len(self.results)}/{count} callbacks")
+                self._done.wait(remaining)
+
+    def test_order_kept_within_a_chat(self):
+        # requests slower than the per-chat interval must not let later messages overtake
+        bot = FakeBot(delay=lambda: random.uniform(0, 0.005))
+        q = self._queue(bot, num_senders=4)
+        for i in range(20):
+            q.send_message(1, f"a{i}", callback=self._callback)
+            q.send_message(2, f"b{i}", callback=self._callback)
+        self._wait_for(40)
+
+        for chat_id, prefix in ((1, "a"), (2, "b")):
+            texts = [text for _, cid, text in bot.sent if cid == chat_id]
+            self.assertEqual(texts, [f"{prefix}{i}" for i in range(20)])
+        self.assertEqual(q.snapshot()["sent"], 40)
+
+    def test_per_chat_interval(self):
+        bot = FakeBot()
+        q = self._queue(bot, per_chat_interval=0.1)
+        for i in range(3):
+            q.send_message(1, f"m{i}", callback=self._callback)
+        q.send_message(2, "other", callback=self._callback)
+        self._wait_for(4)
+
+        times = [t for t, cid, _ in bot.sent if cid == 1]
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        self.assertTrue(all(gap >= 0.09 for gap in gaps), gaps)
+        # another chat is not held back by chat 1's pacing
+        other = next(t for t, cid, _ in bot.sent if cid == 2)
+        self.assertLess(other - times[0], 0.09)
+
+    def test_global_token_bucket(self):
+        bot = FakeBot()
+        q = self._queue(bot, rate=20.0, burst=2)
+        start = time.monotonic()
+        for chat_id in range(10):
+            q.send_message(chat_id, "hi", callback=self._callback)
+        self._wait_for(10)
+
+        offsets = sorted(t - start for t, _, _ in bot.sent)
+        # the burst goes out at once, the other 8 at 20/s
+        self.assertLess(offsets[1], 0.05)
+        self.assertGreaterEqual(offsets[-1], 8 / 20.0 - 0.05)
+
+    def test_429_is_retried_after_retry_after(self):
+        failed_once = []
+        both_queued = threading.Event()
+
+        def fail(chat_id, text):
+            if text == "first" and not failed_once:
+                # answer 429 only once "second" is waiting behind it
+                both_queued.wait(5)
+                failed_once.append(time.monotonic())
+                raise too_many_requests(0.2)
+
+        bot = FakeBot(fail)
+        q = self._queue(bot, num_senders=2)
+        q.send_message(1, "first", callback=self._callback)
+        q.send_message(1, "second", callback=self._callback)
+        both_queued.set()
+        self._wait_for(2)
+
+        self.assertEqual([ok for ok, _ in self.results], [True, True])
+        # retried message keeps its place ahead of the next one in the chat
+        self.assertEqual([text for _, _, text in bot.sent], ["first", "second"])
+        self.assertGreaterEqual(bot.sent[0][0] - failed_once[0], 0.19)
+        stats = q.snapshot()
+        self.assertEqual((stats["sent"], stats["failed"], stats["retried_429"]), (2, 0, 1))
+
+    def test_429_gives_up_after_max_retries(self):
+        def fail(chat_id, text):
+            raise too_many_requests(0.01)
+
+        bot = FakeBot(fail)
+        q = self._queue(bot, max_retries=2)
+        q.send_message(1, "never", callback=self._callback)
+        self._wait_for(1)
+
+        ok, error = self.results[0]
+        self.assertFalse(ok)
+        self.assertIsInstance(error, ApiTelegramException)
+        self.assertEqual(error.error_code, 429)
+        self.assertEqual(bot.attempts, 3)
+        stats = q.snapshot()
+        self.assertEqual((stats["sent"], stats["failed"], stats["retried_429"]), (0, 1, 2))
+
+    def test_other_errors_are_not_retried(self):
+        def fail(chat_id, text):
+            raise ApiTelegramException("sendMessage", None, {
+                "ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"})
+
+        bot = FakeBot(fail)
+        q = self._queue(bot)
+        q.send_message(1, "blocked", callback=self._callback)
+        self._wait_for(1)
+
+        self.assertFalse(self.results[0][0])
+        self.assertEqual(bot.attempts, 1)
+        self.assertEqual(q.snapshot()["retried_429"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,16 +4,14 @@ update_prices.py - Command line tool to update plan prices
 Usage: python update_prices.py [command] [arguments]
 """
 
-import sqlite3
 import sys
 import argparse
 from tabulate import tabulate
+from repository import Database, bump_plan_catalog_version
 
 def get_connection():
-    """Get database connection"""
-    conn = sqlite3.connect('subscriptions.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get database connection (rows support plan['name'])"""
+    return Database.connect()
 
 def show_current_prices():
     """Display current plan prices"""
@@ -32,7 +30,7 @@ def show_current_prices():
         table_data.append([
             plan['id'],
             plan['name'],
-            f"{plan['days']} days",
+            f"{plan['duration_days']} days",
             f"₹{plan['price']}",
             plan['description'][:50] + "..." if len(plan['description']) > 50 else plan['description']
         ])
@@ -61,6 +59,7 @@ def update_single_price(plan_id, new_price):
     
     # Update price
     cursor.execute("UPDATE plans SET price = ? WHERE id = ?", (new_price, plan_id))
+    bump_plan_catalog_version(cursor)
     conn.commit()
     
     print(f"✅ Price updated successfully!")
@@ -101,6 +100,7 @@ def update_all_prices(percentage):
     
     # Apply changes
     cursor.execute("UPDATE plans SET price = ROUND(price * ?)", (multiplier,))
+    bump_plan_catalog_version(cursor)
     conn.commit()
     
     print("✅ All prices updated successfully!")
@@ -123,6 +123,7 @@ def set_all_prices(prices_dict):
             cursor.execute("UPDATE plans SET price = ? WHERE id = ?", (new_price, plan_id))
             print(f"  Plan {plan_id} ({plan['name']}): ₹{plan['price']} → ₹{new_price}")
     
+    bump_plan_catalog_version(cursor)
     conn.commit()
     conn.close()
     print("✅ Prices set successfully!")
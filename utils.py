@@ -1,184 +1,227 @@
 """
-utils.py - Database utilities with thread-local connection pooling
-FIXED VERSION - No premature connection closing
-Added: sqlite3.Row row_factory + channels functions
+utils.py - Plan catalog cache, activity buffer and channel helpers
+Database access goes through repository.Database (pooled connections
+shared with bot.py / handlers.py); DatabaseUtils is kept as an alias for
+older imports.
 """
 import sqlite3
 import threading
 import logging
-from datetime import datetime, timedelta
-from contextlib import contextmanager
-from typing import List, Optional, Tuple
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+import repository
+from repository import Database, init_database, has_active_subscription
 
 logger = logging.getLogger(__name__)
 
-DB_PATH = "subscriptions.db"  # अगर आपके प्रोजेक्ट में अलग जगह है तो बदल दें
+# old name, still imported by scripts outside this repo
+DatabaseUtils = Database
+
+# ==================== PLAN CATALOG CACHE ====================
+
+# How often (seconds) the cached catalog re-checks the version row.
+PLAN_CATALOG_CHECK_INTERVAL = 5.0
+
+def _normalize_plan(row) -> dict:
+    """Convert a plans row to a dict, filling defaults for rows added before is_active / currency existed."""
+    plan = dict(row)
+    if plan.get('is_active') is None:
+        plan['is_active'] = 1
+    if not plan.get('currency'):
+        plan['currency'] = 'INR'
+    return plan
+
+class PlanCatalog:
+    """
+    Process-wide, versioned snapshot of the plans table.
+    Plans are loaded once and served from memory; the snapshot is reloaded
+    only when plan_catalog_version changes (checked at most every
+    PLAN_CATALOG_CHECK_INTERVAL seconds) or after invalidate().
+    """
+
+    _lock = threading.Lock()
+    _plans: List[dict] = []
+    _by_id: dict = {}
+    _rendered: dict = {}        # screen key -> rendered text for the current snapshot
+    _version: Optional[int] = None
+    _loaded = False
+    _checked_at = 0.0
 
-class DatabaseUtils:
-    """Database utility class with thread-local connection pooling."""
-    
-    # Thread-local storage for database connections
-    _local = threading.local()
-    
     @staticmethod
-    def get_connection():
-        """
-        Get a thread-local database connection.
-        Connections are reused within the same thread.
-        """
-        if not hasattr(DatabaseUtils._local, 'connection') or DatabaseUtils._local.connection is None:
-            try:
-                # Create new connection with appropriate settings
-                conn = sqlite3.connect(
-                    DB_PATH,
-                    check_same_thread=False,
-                    timeout=30,
-                    detect_types=sqlite3.PARSE_DECLTYPES
-                )
+    def _read_version(cursor) -> Optional[int]:
+        try:
+            cursor.execute("SELECT version FROM plan_catalog_version WHERE id = 1")
+            row = cursor.fetchone()
+            return row[0] if row else 0
+        except sqlite3.OperationalError:
+            # table not created yet (old database) - always reload
+            return None
 
-                # allow row access by column name (so handlers can use row['name'])
-                conn.row_factory = sqlite3.Row
-                
-                # Enable WAL mode for better concurrency
-                conn.execute("PRAGMA journal_mode=WAL")
-                conn.execute("PRAGMA busy_timeout=5000")
-                
-                DatabaseUtils._local.connection = conn
-                logger.debug(f"Created new database connection for thread {threading.current_thread().name}")
-                
-            except Exception as e:
-                logger.error(f"Failed to create database connection: {e}")
-                raise
-        
-        return DatabaseUtils._local.connection
-    
     @staticmethod
-    def close_connection():
-        """Close the thread-local connection."""
-        if hasattr(DatabaseUtils._local, 'connection') and DatabaseUtils._local.connection is not None:
+    def _ensure_fresh():
+        now = time.monotonic()
+        if PlanCatalog._loaded and now - PlanCatalog._checked_at < PLAN_CATALOG_CHECK_INTERVAL:
+            return
+        with PlanCatalog._lock:
+            if PlanCatalog._loaded and now - PlanCatalog._checked_at < PLAN_CATALOG_CHECK_INTERVAL:
+                return
             try:
-                DatabaseUtils._local.connection.close()
-                DatabaseUtils._local.connection = None
-                logger.debug(f"Closed database connection for thread {threading.current_thread().name}")
+                with Database.get_cursor() as cursor:
+                    version = PlanCatalog._read_version(cursor)
+                    if PlanCatalog._loaded and version is not None and version == PlanCatalog._version:
+                        PlanCatalog._checked_at = now
+                        return
+                    cursor.execute("SELECT * FROM plans ORDER BY price, id")
+                    plans = [_normalize_plan(r) for r in cursor.fetchall()]
             except Exception as e:
-                logger.error(f"Failed to close database connection: {e}")
-    
+                logger.error(f"Failed to load plan catalog: {e}")
+                if not PlanCatalog._loaded:
+                    return
+                # keep serving the previous snapshot
+                PlanCatalog._checked_at = now
+                return
+
+            PlanCatalog._plans = plans
+            PlanCatalog._by_id = {p['id']: p for p in plans}
+            PlanCatalog._rendered = {}
+            PlanCatalog._version = version
+            PlanCatalog._loaded = True
+            PlanCatalog._checked_at = now
+            logger.debug(f"Plan catalog loaded: {len(plans)} plans (version {version})")
+
+    @staticmethod
+    def all(active_only: bool = False) -> List[dict]:
+        """Return all plans ordered by price (optionally only is_active ones)."""
+        PlanCatalog._ensure_fresh()
+        plans = PlanCatalog._plans
+        if active_only:
+            return [p for p in plans if p['is_active']]
+        return list(plans)
+
+    @staticmethod
+    def get(plan_id) -> Optional[dict]:
+        """Return a single plan dict or None."""
+        PlanCatalog._ensure_fresh()
+        return PlanCatalog._by_id.get(plan_id)
+
     @staticmethod
-    @contextmanager
-    def get_cursor():
+    def version() -> Optional[int]:
+        """Current catalog version (changes whenever the plans table changes)."""
+        PlanCatalog._ensure_fresh()
+        return PlanCatalog._version
+
+    @staticmethod
+    def rendered(key, render: Callable[..., str], plan_id=None) -> Optional[str]:
         """
-        Context manager for database operations.
-        Usage:
-        with DatabaseUtils.get_cursor() as cursor:
-            cursor.execute("SELECT ...")
+        Return render() for key, computed once per catalog version.
+        Use for screens built only from plan data (lists, details, comparison);
+        the cache is dropped whenever the catalog reloads. With plan_id,
+        render(plan) gets the plan from the snapshot the text is cached under
+        (None if there is no such plan) - never render a plan fetched before
+        this call, the catalog may have reloaded in between.
         """
-        conn = DatabaseUtils.get_connection()
-        cursor = conn.cursor()
+        PlanCatalog._ensure_fresh()
+        with PlanCatalog._lock:
+            # one consistent snapshot: a reload swaps both
+            cache, by_id = PlanCatalog._rendered, PlanCatalog._by_id
+        text = cache.get(key)
+        if text is None:
+            if plan_id is None:
+                text = render()
+            else:
+                plan = by_id.get(plan_id)
+                if plan is None:
+                    return None
+                text = render(plan)
+            cache[key] = text
+        return text
+
+    @staticmethod
+    def invalidate():
+        """Force a reload on next access (use after changing plans in-process)."""
+        with PlanCatalog._lock:
+            PlanCatalog._loaded = False
+
+# ==================== LAST-ACTIVE WRITE-BEHIND BUFFER ====================
+
+# How often (seconds) buffered last_active timestamps are written to the DB.
+ACTIVITY_FLUSH_INTERVAL = 30.0
+
+class ActivityBuffer:
+    """
+    Coalesces per-user last_active timestamps in memory and writes them
+    in one executemany transaction every ACTIVITY_FLUSH_INTERVAL seconds,
+    so button taps never open a write transaction themselves.
+    """
+
+    _lock = threading.Lock()
+    _pending: dict = {}
+    _stop_event = threading.Event()
+    _thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def touch(user_id, when: Optional[datetime] = None):
+        """Record activity for user_id (latest timestamp wins)."""
+        ts = (when or datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
+        with ActivityBuffer._lock:
+            ActivityBuffer._pending[user_id] = ts
+
+    @staticmethod
+    def pending_count() -> int:
+        with ActivityBuffer._lock:
+            return len(ActivityBuffer._pending)
+
+    @staticmethod
+    def flush() -> int:
+        """Write all buffered timestamps in a single transaction. Returns rows flushed."""
+        with ActivityBuffer._lock:
+            batch = ActivityBuffer._pending
+            ActivityBuffer._pending = {}
+        if not batch:
+            return 0
         try:
-            yield cursor
-            conn.commit()
-        except Exception:
-            conn.rollback()
-            raise
-        finally:
-            cursor.close()
-            # DO NOT close connection here - it's managed by thread-local
-    
+            with Database.get_cursor() as cursor:
+                cursor.executemany(
+                    "UPDATE users SET last_active = ? WHERE user_id = ?",
+                    [(ts, uid) for uid, ts in batch.items()]
+                )
+            logger.debug(f"Flushed last_active for {len(batch)} users")
+            return len(batch)
+        except Exception as e:
+            logger.error(f"Failed to flush last_active buffer: {e}")
+            # put the batch back without overwriting newer timestamps
+            with ActivityBuffer._lock:
+                for uid, ts in batch.items():
+                    ActivityBuffer._pending.setdefault(uid, ts)
+            return 0
+
     @staticmethod
-    def init_database():
-        """Initialize database with correct schema (users, plans, payments, channels)."""
-        with DatabaseUtils.get_cursor() as cursor:
-            # Users table (matching bot.py schema)
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                name TEXT,
-                join_date TEXT,
-                expiry_date TEXT,
-                plan TEXT DEFAULT 'free',
-                status TEXT DEFAULT 'active',
-                last_active TEXT,
-                plan_type TEXT,
-                subscription_end TEXT
-            )
-            ''')
-            
-            # Plans table (matching bot.py schema)
-            # Note: include columns used by handlers: id, name, price, duration_days, description, is_active
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS plans (
-                id INTEGER PRIMARY KEY,
-                name TEXT,
-                duration_days INTEGER,
-                price INTEGER,
-                description TEXT,
-                features TEXT,
-                is_active INTEGER DEFAULT 1,
-                currency TEXT DEFAULT 'INR'
-            )
-            ''')
-            
-            # Payments table (matching bot.py schema)
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                plan_id INTEGER,
-                amount INTEGER,
-                currency TEXT,
-                payment_method TEXT,
-                status TEXT DEFAULT 'pending',
-                timestamp TEXT,
-                transaction_id TEXT
-            )
-            ''')
-            
-            # Channels table (new)
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS channels (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                channel_id TEXT UNIQUE NOT NULL,   -- stores @username or numeric id as text
-                title TEXT,
-                added_by INTEGER,
-                added_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-            ''')
-            
-            # Referrals table (used by handlers)
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS referrals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                referrer_id INTEGER,
-                referee_id INTEGER,
-                commission INTEGER DEFAULT 0,
-                timestamp TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-            ''')
-            
-            # Insert default plans if not present
-            cursor.execute("SELECT COUNT(*) FROM plans")
-            if cursor.fetchone()[0] == 0:
-                plans = [
-                    (1, '⭐ BASIC - 1 Week', 7, 49,
-                     'Weekly access to private channel',
-                     '✅ Channel Access\n✅ Basic Support\n✅ Weekly Updates', 1, 'INR'),
-                    
-                    (2, '🚀 PRO - 1 Month', 30, 199,
-                     'Monthly access with priority support',
-                     '✅ Channel Access\n✅ Priority Support\n✅ Daily Updates\n✅ HD Content', 1, 'INR'),
-                    
-                    (3, '🔥 PREMIUM - 3 Months', 90, 399,
-                     '3 months access + bonus content',
-                     '✅ Channel Access\n✅ Priority Support\n✅ All Updates\n✅ Bonus Content\n✅ 4K Quality', 1, 'INR'),
-                    
-                    (4, '👑 LIFETIME', 36500, 1999,
-                     'Lifetime access + all future updates',
-                     '✅ Lifetime Access\n✅ VIP Support\n✅ All Content\n✅ Future Updates\n✅ Special Badge\n✅ Early Access', 1, 'INR')
-                ]
-                cursor.executemany('INSERT INTO plans (id, name, duration_days, price, description, features, is_active, currency) VALUES (?,?,?,?,?,?,?,?)', plans)
-        
-        logger.info("Database initialized successfully")
+    def _run(interval: float):
+        while not ActivityBuffer._stop_event.wait(interval):
+            ActivityBuffer.flush()
+
+    @staticmethod
+    def start(interval: float = ACTIVITY_FLUSH_INTERVAL):
+        """Start the background flusher thread (idempotent)."""
+        if ActivityBuffer._thread and ActivityBuffer._thread.is_alive():
+            return
+        ActivityBuffer._stop_event.clear()
+        ActivityBuffer._thread = threading.Thread(
+            target=ActivityBuffer._run, args=(interval,),
+            name="activity-flusher", daemon=True
+        )
+        ActivityBuffer._thread.start()
+
+    @staticmethod
+    def stop():
+        """Stop the flusher thread and write whatever is still buffered."""
+        ActivityBuffer._stop_event.set()
+        if ActivityBuffer._thread:
+            ActivityBuffer._thread.join(timeout=5)
+            ActivityBuffer._thread = None
+        ActivityBuffer.flush()
 
 # ==================== CHANNELS: CRUD FUNCTIONS ====================
 
@@ -191,7 +234,7 @@ def add_channel(channel_id: str, title: Optional[str] = None, added_by: Optional
     Returns True if inserted, False if already exists or error.
     """
     try:
-        with DatabaseUtils.get_cursor() as cursor:
+        with Database.get_cursor() as cursor:
             cursor.execute(
                 "INSERT INTO channels (channel_id, title, added_by) VALUES (?, ?, ?)",
                 (channel_id, title, added_by)
@@ -211,7 +254,7 @@ def remove_channel(channel_id: str) -> bool:
     Remove channel by exact channel_id. Returns True if deleted, False if not found or error.
     """
     try:
-        with DatabaseUtils.get_cursor() as cursor:
+        with Database.get_cursor() as cursor:
             cursor.execute("DELETE FROM channels WHERE channel_id = ?", (channel_id,))
             deleted = cursor.rowcount > 0
         if deleted:
@@ -228,7 +271,7 @@ def list_channels() -> List[Tuple[int, str, Optional[str]]]:
     Return list of channels as tuples (id, channel_id, title).
     """
     try:
-        with DatabaseUtils.get_cursor() as cursor:
+        with Database.get_cursor() as cursor:
             cursor.execute("SELECT id, channel_id, title FROM channels ORDER BY id")
             rows = cursor.fetchall()
         # convert sqlite3.Row to plain tuples for callers
@@ -242,7 +285,7 @@ def get_channel(channel_id: str) -> Optional[Tuple[int, str, Optional[str]]]:
     Return single channel row (id, channel_id, title) or None.
     """
     try:
-        with DatabaseUtils.get_cursor() as cursor:
+        with Database.get_cursor() as cursor:
             cursor.execute("SELECT id, channel_id, title FROM channels WHERE channel_id = ?", (channel_id,))
             row = cursor.fetchone()
         if row:
@@ -252,72 +295,35 @@ def get_channel(channel_id: str) -> Optional[Tuple[int, str, Optional[str]]]:
         logger.error(f"Error fetching channel {channel_id}: {e}")
         return None
 
-# ==================== EXISTING FUNCTIONS (compat) ====================
-
-def has_active_subscription(user_id):
-    """Check if user has active subscription."""
-    try:
-        with DatabaseUtils.get_cursor() as cursor:
-            cursor.execute("SELECT expiry_date FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            
-            if result and result[0]:
-                expiry = datetime.strptime(result[0], '%Y-%m-%d %H:%M:%S')
-                return expiry > datetime.now()
-            return False
-    except Exception as e:
-        logger.error(f"Error checking subscription for user {user_id}: {e}")
-        return False
+# ==================== SUBSCRIPTIONS ====================
 
 def add_subscription(user_id, plan_id, days):
-    """Add subscription to user."""
+    """
+    Start a `days`-day subscription on plan_id for user_id.
+    Returns the new expiry datetime, or None if the plan is unknown or the write failed.
+    """
+    plan = PlanCatalog.get(plan_id)
+    if not plan:
+        logger.error(f"Plan {plan_id} not found")
+        return None
     try:
-        with DatabaseUtils.get_cursor() as cursor:
-            # Get plan details
-            cursor.execute("SELECT name FROM plans WHERE id = ?", (plan_id,))
-            result = cursor.fetchone()
-            if not result:
-                logger.error(f"Plan {plan_id} not found")
-                return False
-            
-            plan_name = result['name'] if isinstance(result, sqlite3.Row) else result[0]
-            
-            # Calculate expiry
-            new_expiry = datetime.now() + timedelta(days=days)
-            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-            # Check if user exists
-            cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-            if cursor.fetchone():
-                # Update existing user
-                cursor.execute('''
-                UPDATE users 
-                SET plan = ?, expiry_date = ?, status = 'active', last_active = ?
-                WHERE user_id = ?
-                ''', (plan_name, new_expiry.strftime('%Y-%m-%d %H:%M:%S'), current_time, user_id))
-            else:
-                # Insert new user
-                cursor.execute('''
-                INSERT INTO users (user_id, username, name, join_date, expiry_date, plan, status, last_active)
-                VALUES (?, ?, ?, ?, ?, ?, 'active', ?)
-                ''', (user_id, '', '', current_time, 
-                      new_expiry.strftime('%Y-%m-%d %H:%M:%S'), plan_name, current_time))
-            
-            logger.info(f"Subscription added for user {user_id}, plan {plan_name}, {days} days")
-            return True
-            
+        with Database.get_cursor() as cursor:
+            new_expiry = repository.save_subscription(cursor, user_id, plan['name'], days)
+        logger.info(f"Subscription added for user {user_id}, plan {plan['name']}, {days} days")
+        return new_expiry
     except Exception as e:
-        logger.error(f"Error adding subscription for user {user_id}: {e}")
-        return False
+        logger.exception(f"add_subscription failed for {user_id}: {e}")
+        return None
 
 # ==================== BOT.PY COMPATIBILITY ====================
 
 def get_db():
     """
     Compatibility function for bot.py.
-    Returns a database connection (do NOT close it).
+    Returns a pooled connection pinned to this thread (do NOT close it;
+    hand it back with Database.close_connection()).
     """
-    return DatabaseUtils.get_connection()
+    return Database.get_connection()
 
 # ==================== TEST FUNCTION ====================
 
@@ -327,16 +333,16 @@ def test_connection():
     
     try:
         # Initialize database
-        DatabaseUtils.init_database()
+        init_database()
         
         # Test with context manager
-        with DatabaseUtils.get_cursor() as cursor:
+        with Database.get_cursor() as cursor:
             cursor.execute("SELECT COUNT(*) FROM plans")
             count = cursor.fetchone()[0]
             print(f"✅ Found {count} plans in database")
         
         # Test channels table
-        with DatabaseUtils.get_cursor() as cursor:
+        with Database.get_cursor() as cursor:
             cursor.execute("SELECT COUNT(*) FROM channels")
             ccount = cursor.fetchone()[0]
             print(f"✅ Found {ccount} channels in database")
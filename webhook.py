@@ -0,0 +1,168 @@
+"""
+webhook.py - Embedded HTTP receiver for Telegram webhook mode
+Telegram POSTs each update to WEBHOOK_PATH; the request is checked against
+the X-Telegram-Bot-Api-Secret-Token header, handed to
+bot.process_new_updates (which queues it on the worker pool) and answered
+with 200 right away, so slow handlers never hold the connection open.
+Telegram only delivers to HTTPS URLs: either terminate TLS in a reverse
+proxy / load balancer in front of this server, or give it a certificate
+and key (WEBHOOK_SSL_CERT / WEBHOOK_SSL_KEY) so it serves HTTPS itself.
+"""
+import hmac
+import json
+import logging
+import re
+import ssl
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot.types import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY_BYTES = 1024 * 1024
+# Telegram accepts 1-256 characters from A-Z, a-z, 0-9, _ and -
+_SECRET_RE = re.compile(r"^[A-Za-z0-9_-]{1,256}$")
+
+
+def valid_secret(secret: str) -> bool:
+    return bool(secret and _SECRET_RE.match(secret))
+
+
+def _make_handler(bot, path: str, secret: str):
+    secret_bytes = secret.encode()
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+        server_version = "StreamXWebhook/1.0"
+        # a client that stalls mid-request (or mid-handshake) can't pin a thread forever
+        timeout = 60
+
+        def handle(self):
+            if isinstance(self.request, ssl.SSLSocket):
+                # deferred from accept() so a slow handshake only blocks this thread
+                try:
+                    self.request.do_handshake()
+                except (ssl.SSLError, OSError) as e:
+                    logger.debug(f"Webhook TLS handshake with {self.client_address[0]} failed: {e}")
+                    return
+            super().handle()
+
+        def _reply(self, code: int, body: bytes = b""):
+            self.send_response(code)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if body:
+                self.wfile.write(body)
+
+        def do_GET(self):
+            # load balancer health check
+            if self.path == "/healthz":
+                self._reply(200, b"ok")
+            else:
+                self._reply(404)
+
+        def do_POST(self):
+            if self.path != path:
+                self._reply(404)
+                return
+
+            token = (self.headers.get(SECRET_HEADER) or "").encode()
+            if not hmac.compare_digest(token, secret_bytes):
+                logger.warning(f"Webhook request with bad secret from {self.client_address[0]}")
+                self._reply(403)
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                length = -1
+            if length <= 0 or length > MAX_BODY_BYTES:
+                self._reply(400)
+                return
+
+            try:
+                update = Update.de_json(json.loads(self.rfile.read(length)))
+            except Exception as e:
+                logger.error(f"Webhook: invalid update payload: {e}")
+                self._reply(400)
+                return
+
+            # ack first: Telegram only needs to know we have it
+            self._reply(200)
+            try:
+                bot.process_new_updates([update])
+            except Exception as e:
+                logger.exception(f"Webhook: failed to queue update {update.update_id}: {e}")
+
+        def log_message(self, format, *args):
+            logger.debug("webhook %s - %s", self.client_address[0], format % args)
+
+    return WebhookHandler
+
+
+class WebhookServer:
+    """
+    ThreadingHTTPServer wrapper that registers/unregisters the webhook.
+    With ssl_cert/ssl_key it serves HTTPS; upload_certificate sends the
+    (self-signed) certificate to Telegram when registering.
+    """
+
+    def __init__(self, bot, url: str, secret: str, host: str = "0.0.0.0", port: int = 8443,
+                 path: str = "/webhook", ssl_cert: str = "", ssl_key: str = "",
+                 upload_certificate: bool = False):
+        if not valid_secret(secret):
+            raise ValueError("WEBHOOK_SECRET must be 1-256 characters of A-Z, a-z, 0-9, _ or -")
+        self.bot = bot
+        self.url = url.rstrip("/") + path
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.path = path
+        self.ssl_cert = ssl_cert
+        self.upload_certificate = upload_certificate and bool(ssl_cert)
+        self._ssl_context = None
+        if ssl_cert:
+            # load now so a bad path or key fails at startup, not on the first request
+            self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self._ssl_context.load_cert_chain(ssl_cert, ssl_key or None)
+        elif not self.url.lower().startswith("https://"):
+            logger.warning(f"Webhook URL {self.url} is not HTTPS; Telegram will not deliver to it")
+        self._httpd = None
+
+    def register(self, max_connections: int = 40, drop_pending_updates: bool = False):
+        """Point Telegram at this server."""
+        certificate = open(self.ssl_cert, "rb") if self.upload_certificate else None
+        try:
+            self.bot.set_webhook(
+                url=self.url,
+                certificate=certificate,
+                secret_token=self.secret,
+                max_connections=max_connections,
+                drop_pending_updates=drop_pending_updates,
+            )
+        finally:
+            if certificate:
+                certificate.close()
+        logger.info(f"Webhook registered at {self.url}")
+
+    def serve_forever(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _make_handler(self.bot, self.path, self.secret))
+        self._httpd.daemon_threads = True
+        if self._ssl_context:
+            self._httpd.socket = self._ssl_context.wrap_socket(
+                self._httpd.socket, server_side=True, do_handshake_on_connect=False)
+        scheme = "https" if self._ssl_context else "http"
+        logger.info(f"Webhook server listening on {scheme}://{self.host}:{self.port}{self.path}")
+        self._httpd.serve_forever()
+
+    def start_background(self) -> threading.Thread:
+        t = threading.Thread(target=self.serve_forever, name="webhook-http", daemon=True)
+        t.start()
+        return t
+
+    def shutdown(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
@@ -0,0 +1,166 @@
+"""
+workers.py - Per-user ordered worker pool for update processing
+Updates are sharded by user id onto a fixed set of workers, each with its own
+FIFO queue: updates from the same user run one after another (no races on
+that user's rows), updates from different users run in parallel.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+NUM_WORKERS = int(os.getenv("BOT_WORKERS", "8"))
+WORKER_QUEUE_SIZE = int(os.getenv("BOT_WORKER_QUEUE_SIZE", "1000"))
+
+_STOP = object()
+
+
+def update_user_id(update) -> Optional[int]:
+    """Best-effort sender id of a telebot Update (None for anonymous updates)."""
+    for attr in ("message", "edited_message", "callback_query", "inline_query",
+                 "chosen_inline_result", "shipping_query", "pre_checkout_query",
+                 "my_chat_member", "chat_member", "chat_join_request"):
+        obj = getattr(update, attr, None)
+        if obj is not None:
+            user = getattr(obj, "from_user", None)
+            if user is not None:
+                return user.id
+            chat = getattr(obj, "chat", None)
+            return chat.id if chat is not None else None
+    return None
+
+
+class _Worker:
+    __slots__ = ("queue", "thread", "processed", "errors", "busy_seconds")
+
+    def __init__(self, queue_size: int):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+
+
+class ShardedWorkerPool:
+    """
+    Fixed pool of worker threads; submit(key, fn, ...) always lands on
+    worker hash(key) % num_workers. A full queue blocks the submitter,
+    which pushes back on polling instead of buffering without limit.
+    """
+
+    def __init__(self, num_workers: int = NUM_WORKERS, queue_size: int = WORKER_QUEUE_SIZE,
+                 name: str = "update-worker"):
+        self.num_workers = max(1, num_workers)
+        self.name = name
+        self._workers = [_Worker(queue_size) for _ in range(self.num_workers)]
+        self._lock = threading.Lock()
+        self._started_at = None
+        self._rr = 0
+
+    # ==================== PUBLIC API ====================
+
+    def submit(self, key, fn: Callable, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the worker that owns key."""
+        self._ensure_started()
+        if key is None:
+            # no user to serialize on: spread round-robin
+            with self._lock:
+                self._rr = (self._rr + 1) % self.num_workers
+                index = self._rr
+        else:
+            index = hash(key) % self.num_workers
+        self._workers[index].queue.put((fn, args, kwargs))
+
+    def start(self):
+        self._ensure_started()
+
+    def stop(self, timeout: float = 10.0):
+        """Let workers finish what is queued, then stop them."""
+        with self._lock:
+            if self._started_at is None:
+                return
+            self._started_at = None
+        for w in self._workers:
+            w.queue.put(_STOP)
+        deadline = time.monotonic() + timeout
+        for w in self._workers:
+            if w.thread:
+                w.thread.join(timeout=max(0.0, deadline - time.monotonic()))
+                w.thread = None
+
+    def snapshot(self) -> dict:
+        """Queue depths, throughput and utilization (busy time / uptime) per worker."""
+        started = self._started_at
+        uptime = (time.monotonic() - started) if started else 0.0
+        depths = [w.queue.qsize() for w in self._workers]
+        busy = [w.busy_seconds for w in self._workers]
+        return {
+            "workers": self.num_workers,
+            "queued": sum(depths),
+            "max_depth": max(depths),
+            "depths": depths,
+            "processed": sum(w.processed for w in self._workers),
+            "errors": sum(w.errors for w in self._workers),
+            "utilization": (sum(busy) / (uptime * self.num_workers)) if uptime else 0.0,
+            "worker_utilization": [(b / uptime) if uptime else 0.0 for b in busy],
+        }
+
+    def format_stats(self) -> str:
+        s = self.snapshot()
+        return (
+            f"👷 Workers: {s['workers']}\n"
+            f"📥 Queued: {s['queued']} (max per worker: {s['max_depth']})\n"
+            f"✅ Processed: {s['processed']}\n"
+            f"❌ Errors: {s['errors']}\n"
+            f"⚙️ Utilization: {s['utilization'] * 100:.1f}%\n"
+            f"Per worker: " + ", ".join(f"{u * 100:.0f}%" for u in s['worker_utilization'])
+        )
+
+    # ==================== WORKERS ====================
+
+    def _ensure_started(self):
+        if self._started_at is not None:
+            return
+        with self._lock:
+            if self._started_at is not None:
+                return
+            for i, w in enumerate(self._workers):
+                w.thread = threading.Thread(target=self._run, args=(w,), name=f"{self.name}-{i}", daemon=True)
+                w.thread.start()
+            self._started_at = time.monotonic()
+
+    def _run(self, worker: _Worker):
+        while True:
+            item = worker.queue.get()
+            if item is _STOP:
+                return
+            fn, args, kwargs = item
+            start = time.perf_counter()
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                worker.errors += 1
+                logger.exception(f"Worker task failed: {e}")
+            finally:
+                worker.busy_seconds += time.perf_counter() - start
+                worker.processed += 1
+
+
+def attach_to_bot(bot, pool: ShardedWorkerPool):
+    """
+    Route bot.process_new_updates through the pool, one update per task.
+    The bot should be created with threaded=False so telebot doesn't add
+    its own unordered thread pool on top.
+    """
+    process = bot.process_new_updates
+
+    def process_new_updates(updates):
+        for update in updates:
+            pool.submit(update_user_id(update), process, [update])
+
+    bot.process_new_updates = process_new_updates
+    return pool